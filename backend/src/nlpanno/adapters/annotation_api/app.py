@@ -4,7 +4,7 @@ import fastapi
 
 import nlpanno.container
 from nlpanno import datasets
-from nlpanno.application import unitofwork
+from nlpanno.application import service, unitofwork
 
 from . import controller_sample, controller_static, controller_task, middlewares
 
@@ -23,6 +23,8 @@ def create_app() -> fastapi.FastAPI:
 
     unit_of_work = container.unit_of_work()
     _setup_db(unit_of_work, settings)
+    if settings.fill_db_with_test_data:
+        container.notification_service().publish(service.NotificationChannel.EMBEDDING_REQUESTED)
 
     app = fastapi.FastAPI()
     app.container = container  # type: ignore
@@ -56,8 +58,7 @@ def _fill_db_with_test_data(unit_of_work: unitofwork.UnitOfWork) -> None:
         limit=100,
     )
 
-    is_empty = len(unit_of_work.samples.find()) == 0
+    is_empty = unit_of_work.samples.count() == 0
     if is_empty:
-        for sample in mtop_dataset.samples:
-            unit_of_work.samples.create(sample)
         unit_of_work.annotation_tasks.create(mtop_dataset.task_config)
+        unit_of_work.samples.create_many(tuple(mtop_dataset.iter_samples()))
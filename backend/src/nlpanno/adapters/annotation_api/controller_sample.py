@@ -13,17 +13,43 @@ router = fastapi.APIRouter(prefix="/samples")
 
 @router.patch("/{sample_id}")
 @inject
-def patch(
+async def patch(
     sample_id: str,
     sample_patch: schema.SamplePatchSchema,
-    annotate_sample_use_case: usecase.AnnotateSampleUseCase = fastapi.Depends(  # noqa: B008
-        Provide[Container.annotate_sample_use_case]
-    ),
-    fetch_annotation_task_use_case: usecase.FetchAnnotationTaskUseCase = fastapi.Depends(  # noqa: B008
-        Provide[Container.fetch_annotation_task_use_case]
+    annotate_sample_use_case: usecase.AsyncAnnotateSampleUseCase = fastapi.Depends(  # noqa: B008
+        Provide[Container.async_annotate_sample_use_case]
     ),
 ) -> schema.SampleReadSchema:
     """Patch (partial update) a sample."""
-    sample = annotate_sample_use_case.execute(sample_id, sample_patch.text_class_id)
-    annotation_task = fetch_annotation_task_use_case.execute(sample.annotation_task_id)
+    sample, annotation_task = await annotate_sample_use_case.execute(
+        sample_id, sample_patch.text_class_id
+    )
     return mapper.map_sample_to_read_schema(sample, annotation_task)
+
+
+@router.get("/{sample_id}/similar", response_model=list[schema.SimilarSampleReadSchema])
+@inject
+async def get_similar_samples(
+    sample_id: str,
+    k: int = fastapi.Query(10, ge=1, le=1000),  # noqa: B008
+    find_similar_samples_use_case: usecase.AsyncFindSimilarSamplesUseCase = fastapi.Depends(  # noqa: B008
+        Provide[Container.async_find_similar_samples_use_case]
+    ),
+    fetch_annotation_task_use_case: usecase.AsyncFetchAnnotationTaskUseCase = fastapi.Depends(  # noqa: B008
+        Provide[Container.async_fetch_annotation_task_use_case]
+    ),
+) -> list[schema.SimilarSampleReadSchema]:
+    """Get the k samples of the same task with the most similar embeddings."""
+    try:
+        similar_samples = await find_similar_samples_use_case.execute(sample_id, k)
+    except ValueError as error:
+        raise fastapi.HTTPException(status_code=404, detail=str(error)) from error
+    if len(similar_samples) == 0:
+        return []
+    annotation_task = await fetch_annotation_task_use_case.execute(
+        similar_samples[0][0].annotation_task_id
+    )
+    return [
+        mapper.map_similar_sample_to_read_schema(sample, similarity, annotation_task)
+        for sample, similarity in similar_samples
+    ]
@@ -13,43 +13,56 @@ router = fastapi.APIRouter(prefix="/tasks")
 
 @router.get("/{task_id}", response_model=schema.TaskReadSchema)
 @inject
-def get_task(
+async def get_task(
     task_id: str,
-    fetch_annotation_task_use_case: usecase.FetchAnnotationTaskUseCase = fastapi.Depends(  # noqa: B008
-        Provide[Container.fetch_annotation_task_use_case]
+    fetch_annotation_task_use_case: usecase.AsyncFetchAnnotationTaskUseCase = fastapi.Depends(  # noqa: B008
+        Provide[Container.async_fetch_annotation_task_use_case]
     ),
 ) -> schema.TaskReadSchema:
     """Get the task config."""
-    annotation_task = fetch_annotation_task_use_case.execute(task_id)
+    annotation_task = await fetch_annotation_task_use_case.execute(task_id)
     return mapper.map_task_to_read_schema(annotation_task)
 
 
 @router.get("", response_model=list[schema.TaskReadSchema])
 @inject
-def get_tasks(
-    fetch_all_annotation_tasks_use_case: usecase.FetchAllAnnotationTasksUseCase = fastapi.Depends(  # noqa: B008
-        Provide[Container.fetch_all_annotation_tasks_use_case]
+async def get_tasks(
+    fetch_annotation_tasks_use_case: usecase.AsyncFetchAllAnnotationTasksUseCase = fastapi.Depends(  # noqa: B008
+        Provide[Container.async_fetch_all_annotation_tasks_use_case]
     ),
 ) -> list[schema.TaskReadSchema]:
     """Get all tasks."""
-    annotation_tasks = fetch_all_annotation_tasks_use_case.execute()
+    annotation_tasks = await fetch_annotation_tasks_use_case.execute()
     return [mapper.map_task_to_read_schema(task) for task in annotation_tasks]
 
 
 @router.get("/{task_id}/nextSample")
 @inject
-def get_next_sample(
+async def get_next_sample(
     task_id: str,
-    fetch_annotation_task_use_case: usecase.FetchAnnotationTaskUseCase = fastapi.Depends(  # noqa: B008
-        Provide[Container.fetch_annotation_task_use_case]
-    ),
-    get_next_sample_use_case: usecase.GetNextSampleUseCase = fastapi.Depends(  # noqa: B008
-        Provide[Container.get_next_sample_use_case]
+    get_next_sample_use_case: usecase.AsyncGetNextSampleUseCase = fastapi.Depends(  # noqa: B008
+        Provide[Container.async_get_next_sample_use_case]
     ),
 ) -> schema.SampleReadSchema | None:
     """Get the next sample (e.g. for annotation)."""
-    sample = get_next_sample_use_case.execute(task_id)
+    sample, annotation_task = await get_next_sample_use_case.execute(task_id)
     if sample is None:
         return None
-    annotation_task = fetch_annotation_task_use_case.execute(task_id)
     return mapper.map_sample_to_read_schema(sample, annotation_task)
+
+
+@router.patch("/{task_id}/samples", status_code=204)
+@inject
+async def patch_samples(
+    task_id: str,
+    sample_batch_patch: schema.SampleBatchPatchSchema,
+    annotate_samples_use_case: usecase.AsyncAnnotateSamplesUseCase = fastapi.Depends(  # noqa: B008
+        Provide[Container.async_annotate_samples_use_case]
+    ),
+) -> None:
+    """Patch the labels of many samples of the task in one transaction."""
+    labels = {sample.id: sample.text_class_id for sample in sample_batch_patch.samples}
+    try:
+        await annotate_samples_use_case.execute(task_id, labels)
+    except ValueError as error:
+        raise fastapi.HTTPException(status_code=422, detail=str(error)) from error
@@ -19,6 +19,8 @@ def map_sample_to_read_schema(
     confidence_by_class = {
         estimate.text_class_id: estimate.confidence for estimate in sample.estimates
     }
+    # Only the top estimates are stored for some tasks, the other classes share the rest.
+    missing_confidence = 0.0 if sample.rest_confidence is None else sample.rest_confidence
     text_class_read_schema = (
         map_text_class_to_read_schema(sample.text_class) if sample.text_class else None
     )
@@ -26,7 +28,7 @@ def map_sample_to_read_schema(
         schema.AvailableTextClassReadSchema(
             id=text_class.id,
             name=text_class.name,
-            confidence=confidence_by_class.get(text_class.id, 0.0),
+            confidence=confidence_by_class.get(text_class.id, missing_confidence),
         )
         for text_class in task.text_classes
     )
@@ -41,6 +43,14 @@ def map_sample_to_read_schema(
     )
 
 
+def map_similar_sample_to_read_schema(
+    sample: model.Sample, similarity: float, task: model.AnnotationTask
+) -> schema.SimilarSampleReadSchema:
+    """Map a similar sample and its similarity to a read schema."""
+    sample_read_schema = map_sample_to_read_schema(sample, task)
+    return schema.SimilarSampleReadSchema(**sample_read_schema.model_dump(), similarity=similarity)
+
+
 def map_task_to_read_schema(
     annotation_task: model.AnnotationTask,
 ) -> schema.TaskReadSchema:
@@ -37,12 +37,30 @@ class SampleReadSchema(BaseSchema):
     )
 
 
+class SimilarSampleReadSchema(SampleReadSchema):
+    """Data transfer object for a sample similar to another one."""
+
+    similarity: float
+
+
 class SamplePatchSchema(BaseSchema):
     """Data transfer object for a sample patch."""
 
     text_class_id: Optional[str] = pydantic.Field(validation_alias="textClassId")
 
 
+class SampleLabelPatchSchema(SamplePatchSchema):
+    """Data transfer object for the label of a sample in a batch patch."""
+
+    id: str
+
+
+class SampleBatchPatchSchema(BaseSchema):
+    """Data transfer object for patching the labels of many samples."""
+
+    samples: tuple[SampleLabelPatchSchema, ...]
+
+
 class TaskReadSchema(BaseSchema):
     """Data transfer object for a task config."""
 
@@ -0,0 +1,151 @@
+"""Persistent cache for embeddings."""
+
+import hashlib
+import logging
+import pathlib
+import sqlite3
+import time
+from collections.abc import Iterable, Iterator, Sequence
+
+from nlpanno.application import service
+from nlpanno.domain import model
+
+from .persistence import serialization
+
+_LOG = logging.getLogger("nlpanno")
+
+# Maximum number of parameters of a single SQLite statement (conservative).
+_MAX_PARAMETERS = 500
+# Seconds to wait for the write lock held by another process (e.g. another embedding worker).
+_BUSY_TIMEOUT = 60.0
+
+
+class CachingEmbeddingService(service.EmbeddingService):
+    """
+    Embedding service that caches the embeddings of another service in a SQLite file.
+
+    The embeddings are keyed by the model name and the SHA-256 hash of the text, so that the
+    same text is only embedded once per model (also within a batch). If the cache holds more
+    than `max_entries` embeddings, the least recently used ones are evicted.
+
+    Several processes may share the cache file. Writes wait for each other and do not block
+    readers (write-ahead log).
+    """
+
+    def __init__(
+        self,
+        embedding_service: service.EmbeddingService,
+        model_name: str,
+        path: pathlib.Path | str,
+        max_entries: int = 1_000_000,
+    ) -> None:
+        self._embedding_service = embedding_service
+        self._model_name = model_name
+        self._max_entries = max_entries
+        path = pathlib.Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._connection = sqlite3.connect(path, timeout=_BUSY_TIMEOUT)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "model_name TEXT NOT NULL, text_hash BLOB NOT NULL, embedding BLOB NOT NULL, "
+            "last_used REAL NOT NULL, PRIMARY KEY (model_name, text_hash))"
+        )
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS ix_embeddings_last_used ON embeddings (last_used)"
+        )
+        self._connection.commit()
+        self.requests = 0
+        self.misses = 0
+
+    @property
+    def hit_rate(self) -> float:
+        """Share of the embedded texts that did not need to be embedded by the model."""
+        if self.requests == 0:
+            return 0.0
+        return 1.0 - self.misses / self.requests
+
+    def embed_samples(self, samples: Sequence[model.Sample]) -> Sequence[model.Embedding]:
+        hashes = tuple(hashlib.sha256(sample.text.encode("utf-8")).digest() for sample in samples)
+        embeddings = self._load(set(hashes))
+        # Only the first sample of every missing text is embedded.
+        missing_samples = {
+            text_hash: sample
+            for text_hash, sample in zip(hashes, samples)
+            if text_hash not in embeddings
+        }
+        if len(missing_samples) > 0:
+            new_embeddings = self._embedding_service.embed_samples(tuple(missing_samples.values()))
+            embeddings.update(zip(missing_samples.keys(), new_embeddings))
+            self._store({text_hash: embeddings[text_hash] for text_hash in missing_samples})
+        self.requests += len(samples)
+        self.misses += len(missing_samples)
+        _LOG.info(
+            f"Embedding cache: {len(samples) - len(missing_samples)} of {len(samples)} hits "
+            f"({self.hit_rate:.1%} overall)"
+        )
+        return tuple(embeddings[text_hash] for text_hash in hashes)
+
+    def close(self) -> None:
+        """Close the cache file."""
+        self._connection.close()
+
+    def _load(self, hashes: Iterable[bytes]) -> dict[bytes, model.Embedding]:
+        """Load the cached embeddings of the hashes and mark them as used."""
+        embeddings: dict[bytes, model.Embedding] = {}
+        for chunk in _chunked(tuple(hashes), _MAX_PARAMETERS):
+            placeholders = ", ".join("?" * len(chunk))
+            rows = self._connection.execute(
+                "SELECT text_hash, embedding FROM embeddings "
+                f"WHERE model_name = ? AND text_hash IN ({placeholders})",
+                (self._model_name, *chunk),
+            )
+            embeddings.update(
+                (text_hash, serialization.deserialize_embedding(data)) for text_hash, data in rows
+            )
+        now = time.time()
+        self._connection.executemany(
+            "UPDATE embeddings SET last_used = ? WHERE model_name = ? AND text_hash = ?",
+            ((now, self._model_name, text_hash) for text_hash in embeddings),
+        )
+        self._connection.commit()
+        return embeddings
+
+    def _store(self, embeddings: dict[bytes, model.Embedding]) -> None:
+        """Store the embeddings and evict the least recently used ones beyond the maximum."""
+        now = time.time()
+        self._connection.executemany(
+            "INSERT OR IGNORE INTO embeddings VALUES (?, ?, ?, ?)",
+            (
+                (self._model_name, text_hash, serialization.serialize_embedding(embedding), now)
+                for text_hash, embedding in embeddings.items()
+            ),
+        )
+        # Counted in the transaction of the insert, which holds the write lock, so that the
+        # embeddings stored by other processes are included.
+        (size,) = self._connection.execute("SELECT count(*) FROM embeddings").fetchone()
+        if size > self._max_entries:
+            self._connection.execute(
+                "DELETE FROM embeddings WHERE rowid IN "
+                "(SELECT rowid FROM embeddings ORDER BY last_used LIMIT ?)",
+                (size - self._max_entries,),
+            )
+        self._connection.commit()
+
+
+def create_embedding_service(
+    embedding_service: service.EmbeddingService,
+    model_name: str,
+    data_dir: pathlib.Path | str,
+    max_entries: int,
+) -> service.EmbeddingService:
+    """Wrap the embedding service with a cache in the data directory (unless disabled by 0)."""
+    if max_entries <= 0:
+        return embedding_service
+    path = pathlib.Path(data_dir) / "embedding_cache.sqlite3"
+    return CachingEmbeddingService(embedding_service, model_name, path, max_entries)
+
+
+def _chunked(items: Sequence[bytes], size: int) -> Iterator[Sequence[bytes]]:
+    for start in range(0, len(items), size):
+        yield items[start : start + size]
@@ -0,0 +1,144 @@
+"""Memory-mapped store of the sample embeddings."""
+
+import dataclasses
+import json
+import pathlib
+import threading
+from collections.abc import Mapping, Sequence
+
+import numpy as np
+import torch
+
+from nlpanno.application import service
+from nlpanno.domain import model
+
+from . import filestore
+
+_METADATA_FILE = "metadata.json"
+_EMBEDDINGS_FILE = "embeddings.f32"
+_IDS_FILE = "ids.txt"
+
+
+@dataclasses.dataclass
+class _Metadata:
+    """State of the files of a task's embeddings, which are only valid up to these sizes."""
+
+    dimension: int = 0
+    count: int = 0
+    ids_size: int = 0
+    # Incremented whenever the embeddings are cleared.
+    version: int = 0
+
+
+class MemmapEmbeddingStore(service.EmbeddingStore):
+    """
+    Store of the embeddings of each task as a float32 matrix file with one row per embedding.
+
+    The sample ids of the rows are stored in a text file next to the matrix. The files are
+    appended to (see `filestore`), so that embedding workers can add embeddings while other
+    processes read. Readers map the matrix into memory read-only, so that all processes share
+    the page cache instead of holding their own copies of the embeddings.
+
+    An embedding that is added again is appended as a new row, which replaces the earlier one.
+    """
+
+    def __init__(self, directory: pathlib.Path | str) -> None:
+        self._directory = pathlib.Path(directory)
+        self._task_matrices: dict[model.Id, _TaskMatrix] = {}
+        self._task_matrices_lock = threading.Lock()
+
+    def add(self, task_id: model.Id, embeddings: Mapping[model.Id, model.Embedding]) -> None:
+        if len(embeddings) == 0:
+            return
+        matrix = np.stack(
+            [embedding.detach().cpu().float().numpy() for embedding in embeddings.values()]
+        )
+        ids = "".join(f"{sample_id}\n" for sample_id in embeddings).encode("utf-8")
+        with filestore.lock_directory(self._directory / task_id) as directory:
+            metadata = _read_metadata(directory)
+            if metadata.count == 0:
+                metadata.dimension = matrix.shape[1]
+            elif matrix.shape[1] != metadata.dimension:
+                raise ValueError(
+                    f"Embedding dimension {matrix.shape[1]} does not match the dimension "
+                    f"{metadata.dimension} of the stored embeddings of task {task_id}"
+                )
+            filestore.append(
+                directory / _EMBEDDINGS_FILE, metadata.count * metadata.dimension * 4, matrix
+            )
+            filestore.append(directory / _IDS_FILE, metadata.ids_size, ids)
+            metadata.count += len(matrix)
+            metadata.ids_size += len(ids)
+            _write_metadata(directory, metadata)
+
+    def get(self, task_id: model.Id, sample_ids: Sequence[model.Id]) -> model.Matrix | None:
+        directory = self._directory / task_id
+        metadata = _read_metadata(directory)
+        with self._task_matrices_lock:
+            task_matrix = self._task_matrices.get(task_id)
+            if (
+                task_matrix is None
+                or task_matrix.version != metadata.version
+                or task_matrix.count > metadata.count
+            ):
+                task_matrix = _TaskMatrix(metadata)
+                self._task_matrices[task_id] = task_matrix
+            task_matrix.refresh(directory, metadata)
+        rows = []
+        for sample_id in sample_ids:
+            row = task_matrix.rows.get(sample_id)
+            if row is None:
+                return None
+            rows.append(row)
+        # Only the requested rows are copied out of the memory map.
+        return torch.from_numpy(np.asarray(task_matrix.embeddings[np.array(rows, dtype=np.int64)]))
+
+    def clear(self, task_id: model.Id) -> None:
+        with filestore.lock_directory(self._directory / task_id) as directory:
+            version = _read_metadata(directory).version
+            for file_name in (_EMBEDDINGS_FILE, _IDS_FILE):
+                (directory / file_name).unlink(missing_ok=True)
+            _write_metadata(directory, _Metadata(version=version + 1))
+
+
+class _TaskMatrix:
+    """Embeddings of a task mapped for reading, which are refreshed with appended rows."""
+
+    def __init__(self, metadata: _Metadata) -> None:
+        self.version = metadata.version
+        self.count = 0
+        self.rows: dict[model.Id, int] = {}
+        self.embeddings = np.empty((0, metadata.dimension), dtype=np.float32)
+        self._ids_size = 0
+
+    def refresh(self, directory: pathlib.Path, metadata: _Metadata) -> None:
+        """Load the ids of the rows appended since the last refresh."""
+        if metadata.count == self.count:
+            return
+        new_ids = filestore.read_lines(directory / _IDS_FILE, self._ids_size, metadata.ids_size)
+        self.rows.update(zip(new_ids, range(self.count, metadata.count)))
+        self.embeddings = filestore.map_matrix(
+            directory / _EMBEDDINGS_FILE, metadata.count, metadata.dimension
+        )
+        self.count = metadata.count
+        self._ids_size = metadata.ids_size
+
+
+def create_embedding_store(
+    data_dir: pathlib.Path | str, model_identifier: str
+) -> service.EmbeddingStore:
+    """Create the store of the embeddings of a model in the data directory."""
+    # Model names may be paths or contain slashes (e.g. "sentence-transformers/...").
+    directory_name = model_identifier.strip("/").replace("/", "--")
+    return MemmapEmbeddingStore(pathlib.Path(data_dir) / "embedding_store" / directory_name)
+
+
+def _read_metadata(directory: pathlib.Path) -> _Metadata:
+    path = directory / _METADATA_FILE
+    if not path.exists():
+        return _Metadata()
+    return _Metadata(**json.loads(path.read_text()))
+
+
+def _write_metadata(directory: pathlib.Path, metadata: _Metadata) -> None:
+    filestore.replace(directory / _METADATA_FILE, json.dumps(dataclasses.asdict(metadata)).encode())
@@ -1,4 +1,5 @@
 from collections.abc import Sequence
+from typing import Literal
 
 import sentence_transformers
 import torch
@@ -6,24 +7,118 @@ import torch
 from nlpanno.application import service
 from nlpanno.domain import model
 
+EmbeddingBackend = Literal["torch", "quantized", "onnx"]
+
+
+def get_model_identifier(model_name: str, backend: EmbeddingBackend) -> str:
+    """Identify the embeddings of the model computed with the backend (e.g. for caching)."""
+    return model_name if backend == "torch" else f"{model_name}#{backend}"
+
 
 class TransformersEmbeddingService(service.EmbeddingService):
-    def __init__(self, model_name: str) -> None:
-        self._transformer = sentence_transformers.SentenceTransformer(model_name)
+    """
+    Embedding service using a sentence transformer.
+
+    Besides the default PyTorch model, the model can run on CPU with the linear layers
+    dynamically quantized to int8 ("quantized") or as an exported ONNX Runtime graph ("onnx",
+    which needs the `onnx` extra).
+
+    The texts are sorted by their number of tokens and encoded in batches of up to
+    `token_budget` (padded) tokens, so that short texts are not padded to the length of long
+    ones. The embeddings are returned in the order of the samples.
+    """
+
+    def __init__(
+        self, model_name: str, backend: EmbeddingBackend = "torch", token_budget: int = 4096
+    ) -> None:
+        self._token_budget = token_budget
+        if backend == "torch":
+            self._transformer = sentence_transformers.SentenceTransformer(model_name)
+        elif backend == "quantized":
+            self._transformer = sentence_transformers.SentenceTransformer(model_name, device="cpu")
+            torch.ao.quantization.quantize_dynamic(
+                self._transformer, {torch.nn.Linear}, dtype=torch.qint8, inplace=True
+            )
+        elif backend == "onnx":
+            self._transformer = sentence_transformers.SentenceTransformer(
+                model_name, device="cpu", backend="onnx"
+            )
+        else:
+            raise ValueError(f"Unknown embedding backend: {backend}")
 
     def embed_samples(self, samples: Sequence[model.Sample]) -> Sequence[model.Embedding]:
         texts = list(sample.text for sample in samples)
-        return self._transformer.encode(texts, convert_to_tensor=True)  # type: ignore
+        if len(texts) == 0:
+            return ()
+        token_counts = [
+            len(input_ids)
+            for input_ids in self._transformer.tokenizer(
+                texts, truncation=True, max_length=self._transformer.max_seq_length
+            )["input_ids"]
+        ]
+        batches = create_token_batches(token_counts, self._token_budget)
+        embeddings = torch.cat(
+            [
+                self._transformer.encode(
+                    [texts[index] for index in batch],
+                    batch_size=len(batch),
+                    show_progress_bar=False,
+                    convert_to_tensor=True,
+                )
+                for batch in batches
+            ]
+        )
+        order = torch.tensor(
+            [index for batch in batches for index in batch], device=embeddings.device
+        )
+        return tuple(embeddings[torch.argsort(order)])
+
 
+def create_token_batches(token_counts: Sequence[int], token_budget: int) -> list[list[int]]:
+    """
+    Group the indices of texts into batches sorted by their number of tokens.
 
-class TransformersEmbeddingAggregationService(service.EmbeddingAggregationService):
-    def aggregate_embeddings(self, embeddings: Sequence[model.Embedding]) -> model.Embedding:
-        stacked = torch.stack(list(embeddings), dim=0)
-        return torch.mean(stacked, dim=0)
+    A batch is padded to its longest text, so it holds as many texts as fit into the token
+    budget at that length (but always at least one).
+    """
+    batches: list[list[int]] = []
+    batch: list[int] = []
+    for index in sorted(range(len(token_counts)), key=token_counts.__getitem__):
+        # The texts are sorted, so the current text is the longest of the batch.
+        if len(batch) > 0 and (len(batch) + 1) * token_counts[index] > token_budget:
+            batches.append(batch)
+            batch = []
+        batch.append(index)
+    if len(batch) > 0:
+        batches.append(batch)
+    return batches
 
 
 class TransformersVectorSimilarityService(service.VectorSimilarityService):
+    def __init__(self, block_size: int = 4096) -> None:
+        self._block_size = block_size
+
     def calculate_similarity(
         self, sample_embedding: model.Embedding, class_embedding: model.Embedding
     ) -> float:
         return sentence_transformers.util.pytorch_cos_sim(class_embedding, sample_embedding).item()
+
+    def calculate_similarity_matrix(
+        self,
+        sample_embeddings: Sequence[model.Embedding] | model.Matrix,
+        class_embeddings: Sequence[model.Embedding],
+    ) -> model.Matrix:
+        if len(sample_embeddings) == 0 or len(class_embeddings) == 0:
+            return torch.empty((len(sample_embeddings), len(class_embeddings)))
+        # Cosine similarity of normalized vectors is a plain matrix product.
+        normalized_classes = torch.nn.functional.normalize(
+            torch.stack(list(class_embeddings)).float(), dim=1
+        )
+        blocks = []
+        for start in range(0, len(sample_embeddings), self._block_size):
+            block = sample_embeddings[start : start + self._block_size]
+            if not isinstance(block, torch.Tensor):
+                block = torch.stack(list(block))
+            normalized_block = torch.nn.functional.normalize(block.float(), dim=1)
+            blocks.append(normalized_block @ normalized_classes.T)
+        return torch.cat(blocks)
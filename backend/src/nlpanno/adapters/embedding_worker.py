@@ -1,11 +1,8 @@
-import logging
-import time
-
 import nlpanno.container
 from nlpanno import config
+from nlpanno.application import service
 
-# TODO: use different logger.
-_LOGGER = logging.getLogger("nlpanno")
+from . import worker
 
 
 def run() -> None:
@@ -13,11 +10,11 @@ def run() -> None:
     settings = config.ApplicationSettings()
     container = nlpanno.container.create_container(settings)
     embed_all_samples_use_case = container.embed_all_samples_use_case()
-    while True:
-        did_work = embed_all_samples_use_case.execute()
-        if not did_work:
-            _LOGGER.info("No work to do, sleeping for 10 seconds.")
-            time.sleep(10)
+    worker.run_loop(
+        embed_all_samples_use_case.execute,
+        container.notification_service(),
+        service.NotificationChannel.EMBEDDING_REQUESTED,
+    )
 
 
 if __name__ == "__main__":
@@ -1,10 +1,8 @@
-import logging
-
 import nlpanno.container
 from nlpanno import config
+from nlpanno.application import service
 
-# TODO: use different logger.
-_LOGGER = logging.getLogger("nlpanno")
+from . import worker
 
 
 def run() -> None:
@@ -12,8 +10,11 @@ def run() -> None:
     settings = config.ApplicationSettings()
     container = nlpanno.container.create_container(settings)
     estimate_samples_use_case = container.estimate_samples_use_case()
-    while True:
-        estimate_samples_use_case.execute()
+    worker.run_loop(
+        estimate_samples_use_case.execute,
+        container.notification_service(),
+        service.NotificationChannel.ESTIMATION_REQUESTED,
+    )
 
 
 if __name__ == "__main__":
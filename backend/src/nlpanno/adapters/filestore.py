@@ -0,0 +1,58 @@
+"""
+Helpers for directories of append-only files that are shared between processes.
+
+Writers lock the directory, truncate every file to the size recorded in the metadata before
+appending (which discards the writes of a writer that crashed) and replace the metadata
+atomically afterwards. Readers ignore everything beyond the sizes in the metadata, so that
+they never need the lock.
+"""
+
+import contextlib
+import fcntl
+import os
+import pathlib
+from collections.abc import Iterator
+
+import numpy as np
+
+_LOCK_FILE = "lock"
+
+
+@contextlib.contextmanager
+def lock_directory(directory: pathlib.Path) -> Iterator[pathlib.Path]:
+    """Create and lock the directory for writing (across processes)."""
+    directory.mkdir(parents=True, exist_ok=True)
+    with open(directory / _LOCK_FILE, "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield directory
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def append(path: pathlib.Path, size: int, data: bytes | np.ndarray) -> None:
+    """Append the data to the file after truncating it to the given size."""
+    with open(path, "ab") as file:
+        file.truncate(size)
+        file.write(data.tobytes() if isinstance(data, np.ndarray) else data)
+
+
+def replace(path: pathlib.Path, data: bytes) -> None:
+    """Replace the file atomically."""
+    temporary_path = path.with_name(path.name + ".tmp")
+    temporary_path.write_bytes(data)
+    os.replace(temporary_path, path)
+
+
+def map_matrix(path: pathlib.Path, rows: int, columns: int) -> np.ndarray:
+    """Map the first rows of a float32 matrix file read-only into memory."""
+    if rows == 0:
+        return np.empty((0, columns), dtype=np.float32)
+    return np.memmap(path, dtype=np.float32, mode="r", shape=(rows, columns))
+
+
+def read_lines(path: pathlib.Path, start: int, end: int) -> list[str]:
+    """Read the lines between the byte offsets of a UTF-8 text file."""
+    with open(path, "rb") as file:
+        file.seek(start)
+        return file.read(end - start).decode("utf-8").splitlines()
@@ -0,0 +1,172 @@
+"""Implementations of the notification service."""
+
+import atexit
+import logging
+import pathlib
+import select
+import socket
+import threading
+import time
+import uuid
+from typing import Any
+
+import sqlalchemy
+
+from nlpanno.application import service
+
+_LOGGER = logging.getLogger("nlpanno")
+
+
+class InProcessNotificationService(service.NotificationService):
+    """Notification service for publishers and subscribers within the same process."""
+
+    def __init__(self) -> None:
+        self._condition = threading.Condition()
+        self._pending: set[service.NotificationChannel] = set()
+
+    def publish(self, channel: service.NotificationChannel) -> None:
+        with self._condition:
+            self._pending.add(channel)
+            self._condition.notify_all()
+
+    def subscribe(self, channel: service.NotificationChannel) -> None:
+        pass
+
+    def wait(self, channel: service.NotificationChannel, timeout: float) -> bool:
+        with self._condition:
+            notified = self._condition.wait_for(lambda: channel in self._pending, timeout)
+            self._pending.discard(channel)
+        return notified
+
+
+class SocketNotificationService(service.NotificationService):
+    """
+    Notification service using Unix datagram sockets in a shared directory.
+
+    Every subscriber binds a socket in the directory. Publishers send an empty datagram to all
+    sockets of the channel. This works across processes on the same host (e.g. with SQLite).
+    """
+
+    def __init__(self, directory: pathlib.Path | str) -> None:
+        self._directory = pathlib.Path(directory).resolve()
+        self._sockets: dict[service.NotificationChannel, socket.socket] = {}
+        atexit.register(self.close)
+
+    def publish(self, channel: service.NotificationChannel) -> None:
+        if not self._directory.exists():
+            return
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sender:
+            sender.setblocking(False)
+            for path in self._directory.glob(f"{channel}.*.sock"):
+                try:
+                    sender.sendto(b"\0", str(path))
+                except BlockingIOError:
+                    # The buffer of the subscriber is full, so it has pending notifications.
+                    pass
+                except (ConnectionRefusedError, FileNotFoundError):
+                    # The subscribing process died without removing its socket.
+                    path.unlink(missing_ok=True)
+
+    def subscribe(self, channel: service.NotificationChannel) -> None:
+        if channel in self._sockets:
+            return
+        self._directory.mkdir(parents=True, exist_ok=True)
+        path = self._directory / f"{channel}.{uuid.uuid4().hex[:8]}.sock"
+        receiver = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        receiver.bind(str(path))
+        receiver.setblocking(False)
+        self._sockets[channel] = receiver
+
+    def wait(self, channel: service.NotificationChannel, timeout: float) -> bool:
+        self.subscribe(channel)
+        receiver = self._sockets[channel]
+        readable, _, _ = select.select([receiver], [], [], timeout)
+        if len(readable) == 0:
+            return False
+        # Several notifications are handled by a single wake-up.
+        while True:
+            try:
+                receiver.recv(1)
+            except BlockingIOError:
+                return True
+
+    def close(self) -> None:
+        """Remove the sockets of this process."""
+        for receiver in self._sockets.values():
+            path = receiver.getsockname()
+            receiver.close()
+            pathlib.Path(path).unlink(missing_ok=True)
+        self._sockets.clear()
+
+
+class PostgresNotificationService(service.NotificationService):
+    """Notification service using PostgreSQL's LISTEN/NOTIFY."""
+
+    def __init__(self, engine: sqlalchemy.engine.Engine) -> None:
+        self._engine = engine
+        self._listen_connection: sqlalchemy.PoolProxiedConnection | None = None
+        self._channels: set[str] = set()
+        self._pending: set[str] = set()
+
+    def publish(self, channel: service.NotificationChannel) -> None:
+        with self._engine.connect() as connection:
+            connection.execute(
+                sqlalchemy.text("SELECT pg_notify(:channel, '')"), {"channel": str(channel)}
+            )
+            connection.commit()
+
+    def subscribe(self, channel: service.NotificationChannel) -> None:
+        if channel in self._channels:
+            return
+        if self._listen_connection is None:
+            self._listen_connection = self._engine.raw_connection()
+            self._listen_connection.driver_connection.autocommit = True  # type: ignore
+        cursor = self._listen_connection.cursor()
+        cursor.execute(f'LISTEN "{channel}"')
+        cursor.close()
+        self._channels.add(channel)
+
+    def wait(self, channel: service.NotificationChannel, timeout: float) -> bool:
+        self.subscribe(channel)
+        try:
+            return self._wait(channel, timeout)
+        except Exception:
+            # E.g. the connection dropped, the next call listens again on a new connection.
+            self._close_listen_connection()
+            raise
+
+    def _wait(self, channel: service.NotificationChannel, timeout: float) -> bool:
+        assert self._listen_connection is not None
+        driver_connection: Any = self._listen_connection.driver_connection
+        deadline = time.monotonic() + timeout
+        while True:
+            driver_connection.poll()
+            self._pending.update(notify.channel for notify in driver_connection.notifies)
+            driver_connection.notifies.clear()
+            if channel in self._pending:
+                self._pending.discard(channel)
+                return True
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            select.select([driver_connection], [], [], remaining)
+
+    def _close_listen_connection(self) -> None:
+        assert self._listen_connection is not None
+        try:
+            self._listen_connection.invalidate()
+        finally:
+            self._listen_connection = None
+            self._channels.clear()
+
+
+def create_notification_service(
+    engine: sqlalchemy.engine.Engine, data_dir: pathlib.Path | str
+) -> service.NotificationService:
+    """Create the notification service fitting the database."""
+    if engine.dialect.name == "postgresql":
+        return PostgresNotificationService(engine)
+    if hasattr(socket, "AF_UNIX"):
+        return SocketNotificationService(pathlib.Path(data_dir) / "notifications")
+    _LOGGER.warning("Notifications across processes are not supported on this platform")
+    return InProcessNotificationService()
@@ -1,17 +1,31 @@
+import dataclasses
+import itertools
+import random
+import threading
+import time
+from collections.abc import Callable, Iterator, Mapping, Sequence
 from types import TracebackType
-from typing import Self
+from typing import Self, TypeVar
+
+import torch
 
 from nlpanno.application import unitofwork
 from nlpanno.domain import model, repository
 
+_T = TypeVar("_T")
+
 
 class InMemorySampleRepository(repository.SampleRepository):
     """Sample repository using an in-memory list."""
 
     def __init__(self) -> None:
         self._samples: list[model.Sample] = []
+        # Unix time until which a sample is leased by its id.
+        self._lease_expiries: dict[model.Id, float] = {}
+        self._claim_expiries: dict[model.Id, float] = {}
+        self._lease_lock = threading.Lock()
 
-    def get_by_id(self, id_: model.Id) -> model.Sample:
+    def get_by_id(self, id_: model.Id, for_update: bool = False) -> model.Sample:
         for sample in self._samples:
             if sample.id == id_:
                 return sample
@@ -24,21 +38,165 @@ class InMemorySampleRepository(repository.SampleRepository):
                 return
         raise ValueError(f"Sample with id {sample.id} not found")
 
+    def update_embeddings(self, embeddings: Mapping[model.Id, model.Embedding]) -> None:
+        for sample_id, embedding in embeddings.items():
+            self.get_by_id(sample_id).embed(embedding)
+
+    def update_estimates(
+        self,
+        sample_ids: Sequence[model.Id],
+        text_class_ids: Sequence[model.Id],
+        confidences: model.Matrix,
+    ) -> None:
+        for sample_id, sample_confidences in zip(sample_ids, confidences.tolist()):
+            self.get_by_id(sample_id).add_class_estimates(
+                tuple(
+                    model.ClassEstimate.create(text_class_id, confidence)
+                    for text_class_id, confidence in zip(text_class_ids, sample_confidences)
+                )
+            )
+
+    def replace_estimates(
+        self,
+        sample_ids: Sequence[model.Id],
+        text_class_ids: Sequence[Sequence[model.Id]],
+        confidences: model.Matrix,
+        rest_confidences: Sequence[float | None],
+    ) -> None:
+        for sample_id, sample_text_class_ids, sample_confidences, rest_confidence in zip(
+            sample_ids, text_class_ids, confidences.tolist(), rest_confidences
+        ):
+            self.get_by_id(sample_id).replace_class_estimates(
+                tuple(
+                    model.ClassEstimate.create(text_class_id, confidence)
+                    for text_class_id, confidence in zip(sample_text_class_ids, sample_confidences)
+                ),
+                rest_confidence,
+            )
+
+    def get_confidences(
+        self, sample_ids: Sequence[model.Id], text_class_ids: Sequence[model.Id]
+    ) -> model.Matrix:
+        confidences = []
+        for sample_id in sample_ids:
+            confidence_by_class = {
+                estimate.text_class_id: estimate.confidence
+                for estimate in self.get_by_id(sample_id).estimates
+            }
+            confidences.append(
+                [confidence_by_class.get(text_class_id, 0.0) for text_class_id in text_class_ids]
+            )
+        return torch.tensor(confidences).reshape(len(sample_ids), len(text_class_ids))
+
+    def remove_estimates(self, text_class_ids: Sequence[model.Id]) -> None:
+        for sample in self._samples:
+            for text_class_id in text_class_ids:
+                sample.remove_class_estimate(text_class_id)
+
+    def update_priorities(self, priorities: Mapping[model.Id, float | None]) -> None:
+        for sample_id, priority in priorities.items():
+            self.get_by_id(sample_id).prioritize(priority)
+
+    def update_labels(
+        self, task_id: model.Id, labels: Mapping[model.Id, model.TextClass | None]
+    ) -> None:
+        samples = tuple(self.get_by_id(sample_id) for sample_id in labels)
+        for sample in samples:
+            if sample.annotation_task_id != task_id:
+                raise ValueError(f"Sample with id {sample.id} not found in task {task_id}")
+        for sample in samples:
+            text_class = labels[sample.id]
+            if text_class is None:
+                sample.remove_label()
+                sample.clear_class_estimates()
+            else:
+                sample.annotate(text_class)
+            self.release(sample.id)
+
     def create(self, sample: model.Sample) -> None:
         self._samples.append(sample)
 
+    def create_many(self, samples: Sequence[model.Sample]) -> None:
+        self._samples.extend(samples)
+
+    def claim(self, query: repository.SampleQuery, lease_duration: float) -> model.Sample | None:
+        with self._lease_lock:
+            now = time.time()
+            for sample in self.find(dataclasses.replace(query, limit=None)):
+                if self._lease_expiries.get(sample.id, now) <= now:
+                    self._lease_expiries[sample.id] = now + lease_duration
+                    return sample
+        return None
+
+    def release(self, id_: model.Id) -> None:
+        with self._lease_lock:
+            self._lease_expiries.pop(id_, None)
+
+    def claim_many(
+        self, query: repository.SampleQuery, claim_duration: float
+    ) -> tuple[model.Sample, ...]:
+        claimed_samples: list[model.Sample] = []
+        with self._lease_lock:
+            now = time.time()
+            for sample in self.find(dataclasses.replace(query, limit=None)):
+                if query.limit is not None and len(claimed_samples) >= query.limit:
+                    break
+                if self._claim_expiries.get(sample.id, now) <= now:
+                    self._claim_expiries[sample.id] = now + claim_duration
+                    claimed_samples.append(sample)
+        return tuple(claimed_samples)
+
     def find(self, query: repository.SampleQuery | None = None) -> tuple[model.Sample, ...]:
         if query is None:
             return tuple(self._samples)
-        return tuple(
+        samples = tuple(
             sample for sample in self._samples if self._sample_matches_query(sample, query)
         )
+        if query.order == repository.SampleOrder.RANDOM:
+            samples = tuple(random.sample(samples, len(samples)))
+        elif query.order == repository.SampleOrder.PRIORITY:
+            samples = tuple(
+                sorted(
+                    samples,
+                    key=lambda sample: (sample.priority is None, -(sample.priority or 0.0)),
+                )
+            )
+        else:
+            samples = tuple(sorted(samples, key=lambda sample: sample.id))
+        return samples[: query.limit]
+
+    def find_ids(self, query: repository.SampleQuery | None = None) -> tuple[model.Id, ...]:
+        return tuple(sample.id for sample in self.find(query))
+
+    def iter_find(
+        self, query: repository.SampleQuery | None = None, batch_size: int = 1000
+    ) -> Iterator[model.Sample]:
+        matching_samples = (
+            sample
+            for sample in sorted(self._samples, key=lambda sample: sample.id)
+            if query is None or self._sample_matches_query(sample, query)
+        )
+        limit = None if query is None else query.limit
+        return itertools.islice(matching_samples, limit)
+
+    def count(self, query: repository.SampleQuery | None = None) -> int:
+        if query is None:
+            return len(self._samples)
+        return sum(1 for sample in self._samples if self._sample_matches_query(sample, query))
 
     def _sample_matches_query(self, sample: model.Sample, query: repository.SampleQuery) -> bool:
         label_matches = self._sample_matches_has_label_filter(sample, query)
         embedding_matches = self._sample_matches_has_embedding_filter(sample, query)
+        estimates_matches = self._sample_matches_has_estimates_filter(sample, query)
         task_id_matches = self._sample_matches_task_id_filter(sample, query)
-        return label_matches and embedding_matches and task_id_matches
+        ids_match = query.ids is None or sample.id in query.ids
+        return (
+            label_matches
+            and embedding_matches
+            and estimates_matches
+            and task_id_matches
+            and ids_match
+        )
 
     def _sample_matches_has_label_filter(
         self, sample: model.Sample, query: repository.SampleQuery
@@ -56,6 +214,14 @@ class InMemorySampleRepository(repository.SampleRepository):
         sample_has_embedding = sample.embedding is not None
         return query.has_embedding == sample_has_embedding
 
+    def _sample_matches_has_estimates_filter(
+        self, sample: model.Sample, query: repository.SampleQuery
+    ) -> bool:
+        if query.has_estimates is None:
+            return True
+        sample_has_estimates = len(sample.estimates) > 0
+        return query.has_estimates == sample_has_estimates
+
     def _sample_matches_task_id_filter(
         self, sample: model.Sample, query: repository.SampleQuery
     ) -> bool:
@@ -79,6 +245,9 @@ class InMemoryAnnotationTaskRepository(repository.AnnotationTaskRepository):
     def update(self, task: model.AnnotationTask) -> None:
         for i, existing_task in enumerate(self._tasks):
             if existing_task.id == task.id:
+                task.version = existing_task.version + 1
+                # Only changed by `increment_label_version`, the task's may be stale.
+                task.label_version = existing_task.label_version
                 self._tasks[i] = task
                 return
         raise ValueError(f"Annotation task with id {task.id} not found")
@@ -89,11 +258,46 @@ class InMemoryAnnotationTaskRepository(repository.AnnotationTaskRepository):
     def find(self) -> tuple[model.AnnotationTask, ...]:
         return tuple(self._tasks)
 
+    def get_version(self, id_: model.Id) -> int:
+        return self.get_by_id(id_).version
+
+    def increment_label_version(self, id_: model.Id) -> None:
+        task = self.get_by_id(id_)
+        task.label_version += 1
+
+
+class InMemoryClassCentroidRepository(repository.ClassCentroidRepository):
+    """Class centroid repository using an in-memory dictionary."""
+
+    def __init__(self) -> None:
+        self._centroids: dict[model.Id, model.ClassCentroid] = {}
+
+    def find(self, task_id: model.Id) -> tuple[model.ClassCentroid, ...]:
+        return tuple(
+            centroid
+            for centroid in self._centroids.values()
+            if centroid.annotation_task_id == task_id
+        )
+
+    def add_embeddings(
+        self, text_class: model.TextClass, embedding_sum: model.Embedding, count: int
+    ) -> None:
+        centroid = self._centroids.get(text_class.id)
+        if centroid is None:
+            centroid = model.ClassCentroid(
+                text_class.id,
+                text_class.annotation_task_id,
+                torch.zeros_like(embedding_sum, dtype=torch.float64),
+            )
+            self._centroids[text_class.id] = centroid
+        centroid.add(embedding_sum, count)
+
 
 class InMemoryUnitOfWork(unitofwork.UnitOfWork):
     def __init__(self) -> None:
         self._sample_repository = InMemorySampleRepository()
         self._annotation_task_repository = InMemoryAnnotationTaskRepository()
+        self._class_centroid_repository = InMemoryClassCentroidRepository()
 
     def __enter__(self) -> Self:
         return self
@@ -114,8 +318,23 @@ class InMemoryUnitOfWork(unitofwork.UnitOfWork):
     def annotation_tasks(self) -> InMemoryAnnotationTaskRepository:
         return self._annotation_task_repository
 
+    @property
+    def class_centroids(self) -> InMemoryClassCentroidRepository:
+        return self._class_centroid_repository
+
     def commit(self) -> None:
         pass
 
     def create_tables(self) -> None:
         pass
+
+
+class InMemoryAsyncUnitOfWork(unitofwork.AsyncUnitOfWork):
+    """Asyncio unit of work running the transactions on an in-memory unit of work."""
+
+    def __init__(self, unit_of_work: InMemoryUnitOfWork | None = None) -> None:
+        self._unit_of_work = InMemoryUnitOfWork() if unit_of_work is None else unit_of_work
+
+    async def run(self, transaction: Callable[[unitofwork.UnitOfWork], _T]) -> _T:
+        with self._unit_of_work as unit_of_work:
+            return transaction(unit_of_work)
@@ -0,0 +1,293 @@
+"""Migrations of existing databases to the current SQLAlchemy schema.
+
+Every migration step is idempotent, so that `migrate` can be run on any database (and re-run
+after an interruption).
+"""
+
+import json
+import logging
+
+import numpy as np
+import sqlalchemy
+
+from . import serialization
+from . import sqlalchemy as persistence
+
+_LOG = logging.getLogger("nlpanno")
+
+_DEFAULT_BATCH_SIZE = 1000
+
+
+def migrate(engine: sqlalchemy.engine.Engine, batch_size: int = _DEFAULT_BATCH_SIZE) -> None:
+    """Migrate the database to the current schema."""
+    migrate_embeddings_to_binary(engine, batch_size)
+    add_label_version(engine)
+    add_task_version(engine)
+    add_random_key(engine)
+    add_sampling_priority(engine)
+    update_priority_index(engine)
+    add_sample_lease(engine)
+    add_sample_claim(engine)
+    add_class_centroids(engine, batch_size)
+    add_unique_estimates(engine)
+    add_top_estimates(engine)
+
+
+def migrate_embeddings_to_binary(
+    engine: sqlalchemy.engine.Engine, batch_size: int = _DEFAULT_BATCH_SIZE
+) -> None:
+    """Convert JSON text embeddings of the samples table to the binary format."""
+    columns = _get_columns(engine, "samples")
+    if "embedding" not in columns and "embedding_binary" in columns:
+        _rename_column(engine, "samples", "embedding_binary", "embedding")
+        return
+    if "embedding" not in columns or not isinstance(columns["embedding"], sqlalchemy.String):
+        return
+    _LOG.info("Migrating JSON embeddings to binary embeddings")
+    if "embedding_binary" not in columns:
+        _add_column(engine, "samples", "embedding_binary", sqlalchemy.LargeBinary())
+    converted = 0
+    last_id = ""
+    while True:
+        with engine.begin() as connection:
+            rows = connection.execute(
+                sqlalchemy.text(
+                    "SELECT id, embedding FROM samples "
+                    "WHERE id > :last_id AND embedding IS NOT NULL "
+                    "AND embedding_binary IS NULL ORDER BY id LIMIT :limit"
+                ),
+                {"last_id": last_id, "limit": batch_size},
+            ).all()
+            if len(rows) == 0:
+                break
+            connection.execute(
+                sqlalchemy.text("UPDATE samples SET embedding_binary = :embedding WHERE id = :id"),
+                [{"id": id_, "embedding": _convert_json_embedding(text)} for id_, text in rows],
+            )
+        last_id = rows[-1][0]
+        converted += len(rows)
+        _LOG.info(f"Converted {converted} embeddings")
+    _drop_column(engine, "samples", "embedding")
+    _rename_column(engine, "samples", "embedding_binary", "embedding")
+
+
+def add_label_version(engine: sqlalchemy.engine.Engine) -> None:
+    """Add the label version column to the annotation tasks table."""
+    columns = _get_columns(engine, "annotation_tasks")
+    if len(columns) == 0 or "label_version" in columns:
+        return
+    _add_column(engine, "annotation_tasks", "label_version", sqlalchemy.Integer(), "0")
+
+
+def add_task_version(engine: sqlalchemy.engine.Engine) -> None:
+    """Add the version column to the annotation tasks table."""
+    columns = _get_columns(engine, "annotation_tasks")
+    if len(columns) == 0 or "version" in columns:
+        return
+    _add_column(engine, "annotation_tasks", "version", sqlalchemy.Integer(), "0")
+
+
+def add_random_key(engine: sqlalchemy.engine.Engine) -> None:
+    """Add the (indexed) random key column to the samples table."""
+    columns = _get_columns(engine, "samples")
+    if len(columns) == 0 or "random_key" in columns:
+        return
+    _add_column(engine, "samples", "random_key", sqlalchemy.Float(), "0")
+    if engine.dialect.name == "sqlite":
+        random_value = "(random() / 18446744073709551616.0 + 0.5)"
+    else:
+        random_value = "random()"
+    with engine.begin() as connection:
+        connection.execute(sqlalchemy.text(f"UPDATE samples SET random_key = {random_value}"))
+        connection.execute(
+            sqlalchemy.text(
+                "CREATE INDEX IF NOT EXISTS ix_samples_task_random_key "
+                "ON samples (annotation_task_id, random_key)"
+            )
+        )
+
+
+def add_sampling_priority(engine: sqlalchemy.engine.Engine) -> None:
+    """Add the sample priority and the task's sampling strategy columns."""
+    task_columns = _get_columns(engine, "annotation_tasks")
+    if len(task_columns) > 0 and "sampling_strategy" not in task_columns:
+        _add_column(engine, "annotation_tasks", "sampling_strategy", sqlalchemy.String())
+    sample_columns = _get_columns(engine, "samples")
+    if len(sample_columns) == 0 or "priority" in sample_columns:
+        return
+    _add_column(engine, "samples", "priority", sqlalchemy.Float())
+
+
+def update_priority_index(engine: sqlalchemy.engine.Engine) -> None:
+    """Recreate the sample priority index in the order of the claim query."""
+    inspector = sqlalchemy.inspect(engine)
+    if not inspector.has_table("samples"):
+        return
+    indexes = {index["name"]: index for index in inspector.get_indexes("samples")}
+    index = indexes.get("ix_samples_task_priority")
+    if index is not None and "id" in index["column_names"]:
+        return
+    # SQLite sorts NULL last in descending order (and rejects NULLS LAST in indexes).
+    nulls_last = " NULLS LAST" if engine.dialect.name == "postgresql" else ""
+    with engine.begin() as connection:
+        connection.execute(sqlalchemy.text("DROP INDEX IF EXISTS ix_samples_task_priority"))
+        connection.execute(
+            sqlalchemy.text(
+                "CREATE INDEX ix_samples_task_priority "
+                f"ON samples (annotation_task_id, priority DESC{nulls_last}, id)"
+            )
+        )
+
+
+def add_sample_lease(engine: sqlalchemy.engine.Engine) -> None:
+    """Add the lease expiry column to the samples table."""
+    columns = _get_columns(engine, "samples")
+    if len(columns) == 0 or "lease_expires_at" in columns:
+        return
+    _add_column(engine, "samples", "lease_expires_at", sqlalchemy.Float())
+
+
+def add_sample_claim(engine: sqlalchemy.engine.Engine) -> None:
+    """Add the worker claim expiry column to the samples table."""
+    columns = _get_columns(engine, "samples")
+    if len(columns) == 0 or "claim_expires_at" in columns:
+        return
+    _add_column(engine, "samples", "claim_expires_at", sqlalchemy.Float())
+    with engine.begin() as connection:
+        connection.execute(
+            sqlalchemy.text(
+                "CREATE INDEX IF NOT EXISTS ix_samples_unembedded "
+                "ON samples (id) WHERE embedding IS NULL"
+            )
+        )
+
+
+def add_class_centroids(
+    engine: sqlalchemy.engine.Engine, batch_size: int = _DEFAULT_BATCH_SIZE
+) -> None:
+    """Calculate the class centroids from the labeled samples (unless there already are some)."""
+    if len(_get_columns(engine, "samples")) == 0:
+        return
+    persistence.Base.metadata.tables["class_centroids"].create(engine, checkfirst=True)
+    with engine.connect() as connection:
+        if connection.execute(sqlalchemy.text("SELECT 1 FROM class_centroids LIMIT 1")).first():
+            return
+    _LOG.info("Calculating the class centroids")
+    centroids: dict[tuple[str, str], tuple[np.ndarray, int]] = {}
+    last_id = ""
+    while True:
+        with engine.connect() as connection:
+            rows = connection.execute(
+                sqlalchemy.text(
+                    "SELECT id, annotation_task_id, text_class_id, embedding FROM samples "
+                    "WHERE id > :last_id AND text_class_id IS NOT NULL "
+                    "AND embedding IS NOT NULL ORDER BY id LIMIT :limit"
+                ),
+                {"last_id": last_id, "limit": batch_size},
+            ).all()
+        if len(rows) == 0:
+            break
+        for _, task_id, text_class_id, data in rows:
+            embedding = serialization.deserialize_array(data).astype(np.float64)
+            if (task_id, text_class_id) in centroids:
+                embedding_sum, count = centroids[task_id, text_class_id]
+                centroids[task_id, text_class_id] = (embedding_sum + embedding, count + 1)
+            else:
+                centroids[task_id, text_class_id] = (embedding, 1)
+        last_id = rows[-1][0]
+    if len(centroids) == 0:
+        return
+    with engine.begin() as connection:
+        connection.execute(
+            sqlalchemy.text(
+                "INSERT INTO class_centroids "
+                "(text_class_id, annotation_task_id, embedding_sum, count) "
+                "VALUES (:text_class_id, :task_id, :embedding_sum, :count)"
+            ),
+            [
+                {
+                    "text_class_id": text_class_id,
+                    "task_id": task_id,
+                    "embedding_sum": serialization.serialize_array(embedding_sum),
+                    "count": count,
+                }
+                for (task_id, text_class_id), (embedding_sum, count) in centroids.items()
+            ],
+        )
+
+
+def _convert_json_embedding(text: str) -> bytes:
+    array = np.asarray(json.loads(text), dtype=np.float32)
+    return serialization.serialize_array(array)
+
+
+def add_unique_estimates(engine: sqlalchemy.engine.Engine) -> None:
+    """Remove duplicate estimates (of a sample for a class) and add the unique index."""
+    inspector = sqlalchemy.inspect(engine)
+    if not inspector.has_table("estimates"):
+        return
+    index_names = {index["name"] for index in inspector.get_indexes("estimates")}
+    if "ix_estimates_sample_text_class" in index_names:
+        return
+    _LOG.info("Removing duplicate estimates")
+    with engine.begin() as connection:
+        # One of the duplicates is kept (arbitrarily).
+        connection.execute(
+            sqlalchemy.text(
+                "DELETE FROM estimates WHERE id NOT IN "
+                "(SELECT MIN(id) FROM estimates GROUP BY sample_id, text_class_id)"
+            )
+        )
+        connection.execute(
+            sqlalchemy.text(
+                "CREATE UNIQUE INDEX IF NOT EXISTS ix_estimates_sample_text_class "
+                "ON estimates (sample_id, text_class_id)"
+            )
+        )
+
+
+def add_top_estimates(engine: sqlalchemy.engine.Engine) -> None:
+    """Add the task's maximum number of estimates and the sample's rest confidence columns."""
+    task_columns = _get_columns(engine, "annotation_tasks")
+    if len(task_columns) > 0 and "max_estimates" not in task_columns:
+        _add_column(engine, "annotation_tasks", "max_estimates", sqlalchemy.Integer())
+    sample_columns = _get_columns(engine, "samples")
+    if len(sample_columns) > 0 and "rest_confidence" not in sample_columns:
+        _add_column(engine, "samples", "rest_confidence", sqlalchemy.Float())
+
+
+def _get_columns(
+    engine: sqlalchemy.engine.Engine, table_name: str
+) -> dict[str, sqlalchemy.types.TypeEngine]:
+    inspector = sqlalchemy.inspect(engine)
+    if not inspector.has_table(table_name):
+        return {}
+    return {column["name"]: column["type"] for column in inspector.get_columns(table_name)}
+
+
+def _add_column(
+    engine: sqlalchemy.engine.Engine,
+    table_name: str,
+    column_name: str,
+    type_: sqlalchemy.types.TypeEngine,
+    default: str | None = None,
+) -> None:
+    definition = f"{column_name} {type_.compile(dialect=engine.dialect)}"
+    if default is not None:
+        definition += f" NOT NULL DEFAULT {default}"
+    with engine.begin() as connection:
+        connection.execute(sqlalchemy.text(f"ALTER TABLE {table_name} ADD COLUMN {definition}"))
+
+
+def _drop_column(engine: sqlalchemy.engine.Engine, table_name: str, column_name: str) -> None:
+    with engine.begin() as connection:
+        connection.execute(sqlalchemy.text(f"ALTER TABLE {table_name} DROP COLUMN {column_name}"))
+
+
+def _rename_column(
+    engine: sqlalchemy.engine.Engine, table_name: str, old_name: str, new_name: str
+) -> None:
+    with engine.begin() as connection:
+        connection.execute(
+            sqlalchemy.text(f"ALTER TABLE {table_name} RENAME COLUMN {old_name} TO {new_name}")
+        )
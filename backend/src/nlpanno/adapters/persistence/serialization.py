@@ -0,0 +1,72 @@
+"""Binary serialization of embeddings.
+
+An embedding is stored as a small fixed-size header followed by the raw vector bytes:
+
+- format version (uint8)
+- dtype code (uint8)
+- two padding bytes, so that the vector data is 8-byte aligned
+- dimension (uint32, little endian)
+"""
+
+import struct
+import threading
+import warnings
+
+import numpy as np
+import torch
+
+from nlpanno.domain import model
+
+_FORMAT_VERSION = 1
+_HEADER = struct.Struct("<BBxxI")
+_DTYPE_BY_CODE: dict[int, np.dtype] = {
+    1: np.dtype("<f4"),
+    2: np.dtype("<f2"),
+    3: np.dtype("<f8"),
+}
+_CODE_BY_DTYPE = {dtype: code for code, dtype in _DTYPE_BY_CODE.items()}
+
+# Changing the warning filters is not thread-safe, so that concurrent decoding needs a lock.
+_WARNINGS_LOCK = threading.Lock()
+
+
+def serialize_embedding(embedding: model.Embedding) -> bytes:
+    """Serialize an embedding to bytes."""
+    return serialize_array(embedding.detach().cpu().numpy())
+
+
+def deserialize_embedding(data: bytes) -> model.Embedding:
+    """
+    Deserialize an embedding from bytes.
+
+    The returned tensor shares memory with `data` and must not be modified in place.
+    """
+    array = deserialize_array(data)
+    with _WARNINGS_LOCK, warnings.catch_warnings():
+        # PyTorch warns about tensors of read-only memory like the stored bytes.
+        warnings.filterwarnings(
+            "ignore", message="The given NumPy array is not writable", category=UserWarning
+        )
+        return torch.from_numpy(array)
+
+
+def serialize_array(array: np.ndarray) -> bytes:
+    """Serialize a vector to bytes."""
+    array = array.reshape(-1)
+    dtype = array.dtype.newbyteorder("<")
+    if dtype not in _CODE_BY_DTYPE:
+        dtype = np.dtype("<f4")
+    header = _HEADER.pack(_FORMAT_VERSION, _CODE_BY_DTYPE[dtype], array.shape[0])
+    return header + array.astype(dtype, copy=False).tobytes()
+
+
+def deserialize_array(data: bytes) -> np.ndarray:
+    """Deserialize a vector from bytes without copying it."""
+    version, dtype_code, dimension = _HEADER.unpack_from(data)
+    if version != _FORMAT_VERSION:
+        raise ValueError(f"Unsupported embedding format version: {version}")
+    if dtype_code not in _DTYPE_BY_CODE:
+        raise ValueError(f"Unsupported embedding dtype code: {dtype_code}")
+    return np.frombuffer(
+        data, dtype=_DTYPE_BY_CODE[dtype_code], count=dimension, offset=_HEADER.size
+    )
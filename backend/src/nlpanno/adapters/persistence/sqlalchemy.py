@@ -1,17 +1,35 @@
-import json
+import asyncio
+import io
 import logging
+import random
+import time
+from collections.abc import Callable, Iterator, Mapping, Sequence
 from types import TracebackType
-from typing import Optional, Self
+from typing import Any, Optional, Self, TypeVar
 
+import numpy as np
 import sqlalchemy
+import sqlalchemy.dialects.postgresql
+import sqlalchemy.dialects.sqlite
+import sqlalchemy.ext.asyncio
 import torch
 from sqlalchemy import orm
 
 from nlpanno.application import unitofwork
 from nlpanno.domain import model, repository
 
+from . import serialization
+
 _LOG = logging.getLogger("nlpanno")
 
+_T = TypeVar("_T")
+
+# Number of estimates written by a single (executemany) statement.
+_ESTIMATE_BATCH_SIZE = 10000
+# Number of samples whose estimates are read by a single statement (bounded by the maximum
+# number of parameters of a statement).
+_ESTIMATE_READ_BATCH_SIZE = 500
+
 
 class Base(sqlalchemy.orm.DeclarativeBase):
     """Base class for all SQLAlchemy models."""
@@ -50,18 +68,45 @@ class AnnotationTask(Base):
     id: orm.Mapped[str] = orm.mapped_column(primary_key=True)
     text_classes: orm.Mapped[list[TextClass]] = orm.relationship()
     name: orm.Mapped[str]
+    label_version: orm.Mapped[int] = orm.mapped_column(default=0, server_default="0")
+    version: orm.Mapped[int] = orm.mapped_column(default=0, server_default="0")
+    sampling_strategy: orm.Mapped[Optional[str]]
+    max_estimates: orm.Mapped[Optional[int]]
 
     def to_domain(self) -> model.AnnotationTask:
+        sampling_strategy = (
+            None
+            if self.sampling_strategy is None
+            else model.SamplingStrategy(self.sampling_strategy)
+        )
         return model.AnnotationTask(
             id=self.id,
             name=self.name,
             text_classes=tuple(text_class.to_domain() for text_class in self.text_classes),
+            label_version=self.label_version,
+            version=self.version,
+            sampling_strategy=sampling_strategy,
+            max_estimates=self.max_estimates,
         )
 
     @classmethod
     def from_domain(cls, task: model.AnnotationTask) -> Self:
         text_classes = list(TextClass.from_domain(text_class) for text_class in task.text_classes)
-        return cls(id=task.id, name=task.name, text_classes=text_classes)
+        return cls(
+            id=task.id,
+            name=task.name,
+            text_classes=text_classes,
+            label_version=task.label_version,
+            version=task.version,
+            sampling_strategy=(
+                None if task.sampling_strategy is None else task.sampling_strategy.value
+            ),
+            max_estimates=task.max_estimates,
+        )
+
+
+def _is_not_postgresql(*args: object, dialect: sqlalchemy.Dialect, **kwargs: object) -> bool:
+    return dialect.name != "postgresql"
 
 
 class Sample(Base):
@@ -75,27 +120,69 @@ class Sample(Base):
         sqlalchemy.ForeignKey("text_classes.id")
     )
     text_class: orm.Mapped[Optional[TextClass]] = orm.relationship()
-    embedding: orm.Mapped[Optional[str]]
-    estimates: orm.Mapped[list["ClassEstimate"]] = orm.relationship()
+    embedding: orm.Mapped[Optional[bytes]] = orm.mapped_column(sqlalchemy.LargeBinary)
+    estimates: orm.Mapped[list["ClassEstimate"]] = orm.relationship(cascade="all, delete-orphan")
+    rest_confidence: orm.Mapped[Optional[float]] = orm.mapped_column()
     annotation_task_id: orm.Mapped[str] = orm.mapped_column(
         sqlalchemy.ForeignKey("annotation_tasks.id")
     )
+    # Uniformly distributed in [0, 1) to pick random samples with an index lookup.
+    random_key: orm.Mapped[float] = orm.mapped_column(default=random.random)
+    priority: orm.Mapped[Optional[float]] = orm.mapped_column()
+    # Unix time until which the sample is leased to an annotator (not part of the domain model).
+    lease_expires_at: orm.Mapped[Optional[float]] = orm.mapped_column()
+    # Unix time until which the sample is claimed by a worker (not part of the domain model).
+    claim_expires_at: orm.Mapped[Optional[float]] = orm.mapped_column()
 
-    def to_domain(self) -> model.Sample:
-        embedding = None if self.embedding is None else torch.tensor(json.loads(self.embedding))
+    __table_args__ = (
+        sqlalchemy.Index("ix_samples_task_random_key", annotation_task_id, random_key),
+        # Matches the claim order, SQLite sorts NULL last in descending order (and rejects NULLS
+        # LAST in indexes).
+        sqlalchemy.Index(
+            "ix_samples_task_priority", annotation_task_id, priority.desc().nulls_last(), id
+        ).ddl_if(dialect="postgresql"),
+        sqlalchemy.Index(
+            "ix_samples_task_priority", annotation_task_id, priority.desc(), id
+        ).ddl_if(callable_=_is_not_postgresql),
+        # Lets embedding workers find the samples without embedding without a table scan.
+        sqlalchemy.Index(
+            "ix_samples_unembedded",
+            id,
+            sqlite_where=embedding.is_(None),
+            postgresql_where=embedding.is_(None),
+        ),
+    )
+
+    def to_domain(self, with_embedding: bool = True, with_estimates: bool = True) -> model.Sample:
+        """Map to the domain, skipping the embedding or estimates (e.g. if they are not loaded)."""
+        embedding = (
+            None
+            if not with_embedding or self.embedding is None
+            else serialization.deserialize_embedding(self.embedding)
+        )
         text_class = None if self.text_class is None else self.text_class.to_domain()
+        estimates = (
+            tuple(estimate.to_domain() for estimate in self.estimates) if with_estimates else ()
+        )
         return model.Sample(
             id=self.id,
             text=self.text,
             text_class=text_class,
             embedding=embedding,
-            estimates=tuple(estimate.to_domain() for estimate in self.estimates),
+            estimates=estimates,
+            rest_confidence=self.rest_confidence if with_estimates else None,
             annotation_task_id=self.annotation_task_id,
+            priority=self.priority,
+            changed_fields=set(),
         )
 
     @classmethod
     def from_domain(cls, sample: model.Sample) -> Self:
-        embedding = None if sample.embedding is None else json.dumps(sample.embedding.tolist())
+        embedding = (
+            None
+            if sample.embedding is None
+            else serialization.serialize_embedding(sample.embedding)
+        )
         text_class = None if sample.text_class is None else TextClass.from_domain(sample.text_class)
         return cls(
             id=sample.id,
@@ -103,7 +190,9 @@ class Sample(Base):
             text_class=text_class,
             embedding=embedding,
             estimates=list(ClassEstimate.from_domain(estimate) for estimate in sample.estimates),
+            rest_confidence=sample.rest_confidence,
             annotation_task_id=sample.annotation_task_id,
+            priority=sample.priority,
         )
 
 
@@ -117,6 +206,11 @@ class ClassEstimate(Base):
     confidence: orm.Mapped[float]
     sample_id: orm.Mapped[str] = orm.mapped_column(sqlalchemy.ForeignKey("samples.id"))
 
+    __table_args__ = (
+        # A sample has at most one estimate per class, which bulk upserts use as conflict target.
+        sqlalchemy.Index("ix_estimates_sample_text_class", sample_id, text_class_id, unique=True),
+    )
+
     def to_domain(self) -> model.ClassEstimate:
         return model.ClassEstimate(
             id=self.id,
@@ -133,14 +227,52 @@ class ClassEstimate(Base):
         )
 
 
+class ClassCentroid(Base):
+    """Model for the centroid of a class."""
+
+    __tablename__ = "class_centroids"
+
+    text_class_id: orm.Mapped[str] = orm.mapped_column(
+        sqlalchemy.ForeignKey("text_classes.id"), primary_key=True
+    )
+    annotation_task_id: orm.Mapped[str] = orm.mapped_column(
+        sqlalchemy.ForeignKey("annotation_tasks.id"), index=True
+    )
+    embedding_sum: orm.Mapped[bytes] = orm.mapped_column(sqlalchemy.LargeBinary)
+    count: orm.Mapped[int]
+
+    def to_domain(self) -> model.ClassCentroid:
+        return model.ClassCentroid(
+            text_class_id=self.text_class_id,
+            annotation_task_id=self.annotation_task_id,
+            embedding_sum=serialization.deserialize_embedding(self.embedding_sum),
+            count=self.count,
+        )
+
+    @classmethod
+    def from_domain(cls, centroid: model.ClassCentroid) -> Self:
+        return cls(
+            text_class_id=centroid.text_class_id,
+            annotation_task_id=centroid.annotation_task_id,
+            embedding_sum=serialization.serialize_embedding(centroid.embedding_sum),
+            count=centroid.count,
+        )
+
+
 class SQLAlchemySampleRepository(repository.SampleRepository):
     """Sample repository using SQLAlchemy."""
 
     def __init__(self, session: orm.Session) -> None:
         self._session = session
 
-    def get_by_id(self, sample_id: model.Id) -> model.Sample:
-        persistence_sample = self._session.get(Sample, sample_id)
+    def get_by_id(self, sample_id: model.Id, for_update: bool = False) -> model.Sample:
+        persistence_sample = self._session.get(
+            Sample,
+            sample_id,
+            options=self._loader_options(None),
+            # Only the sample, PostgreSQL cannot lock the nullable side of the outer join.
+            with_for_update={"of": Sample} if for_update else None,
+        )
         if persistence_sample is None:
             raise ValueError(f"Sample with id {sample_id} not found")
         return persistence_sample.to_domain()
@@ -150,18 +282,520 @@ class SQLAlchemySampleRepository(repository.SampleRepository):
         return tuple(persistence_sample.to_domain() for persistence_sample in persistence_samples)
 
     def update(self, sample: model.Sample) -> None:
-        persistence_sample = Sample.from_domain(sample)
-        self._session.merge(persistence_sample)
+        if sample.changed_fields is None:
+            # Samples that were not loaded (e.g. created anew) are merged as a whole.
+            self._session.merge(Sample.from_domain(sample))
+            return
+        changed_fields = sample.changed_fields
+        values: dict[str, Any] = {}
+        if model.SampleField.LABEL in changed_fields:
+            values["text_class_id"] = None if sample.text_class is None else sample.text_class.id
+        if model.SampleField.EMBEDDING in changed_fields:
+            values["embedding"] = (
+                None
+                if sample.embedding is None
+                else serialization.serialize_embedding(sample.embedding)
+            )
+        if model.SampleField.PRIORITY in changed_fields:
+            values["priority"] = sample.priority
+        if model.SampleField.ESTIMATES in changed_fields:
+            values["rest_confidence"] = sample.rest_confidence
+        if len(values) > 0:
+            self._session.execute(
+                sqlalchemy.update(Sample)
+                .where(Sample.id == sample.id)
+                .values(**values)
+                .execution_options(synchronize_session=False)
+            )
+        if model.SampleField.ESTIMATES in changed_fields:
+            self._write_estimates(sample)
+        if len(changed_fields) > 0:
+            # A sample loaded by this session would show the old state otherwise.
+            loaded_sample = self._session.identity_map.get(orm.util.identity_key(Sample, sample.id))
+            if loaded_sample is not None:
+                self._session.expire(loaded_sample)
+        changed_fields.clear()
+
+    def _write_estimates(self, sample: model.Sample) -> None:
+        """Delete the removed estimates of the sample and insert or update the others."""
+        estimate_ids = tuple(estimate.id for estimate in sample.estimates)
+        self._session.execute(
+            sqlalchemy.delete(ClassEstimate)
+            .where(ClassEstimate.sample_id == sample.id, ClassEstimate.id.not_in(estimate_ids))
+            .execution_options(synchronize_session=False)
+        )
+        if len(estimate_ids) == 0:
+            return
+        rows = [
+            {
+                "id": estimate.id,
+                "text_class_id": estimate.text_class_id,
+                "confidence": estimate.confidence,
+                "sample_id": sample.id,
+            }
+            for estimate in sample.estimates
+        ]
+        insert = _get_upsert_insert(self._session.get_bind().dialect.name)
+        if insert is None:
+            for row in rows:
+                self._session.merge(ClassEstimate(**row))
+            return
+        statement = insert(ClassEstimate).values(rows)
+        self._session.execute(
+            statement.on_conflict_do_update(
+                index_elements=[ClassEstimate.id],
+                set_={"confidence": statement.excluded.confidence},
+            ).execution_options(synchronize_session=False)
+        )
+
+    def update_embeddings(self, embeddings: Mapping[model.Id, model.Embedding]) -> None:
+        if len(embeddings) == 0:
+            return
+        # Executed on the connection, so that all samples are updated by a single executemany.
+        self._session.connection().execute(
+            sqlalchemy.update(Sample)
+            .where(Sample.id == sqlalchemy.bindparam("sample_id"))
+            .values(embedding=sqlalchemy.bindparam("embedding_data")),
+            [
+                {
+                    "sample_id": sample_id,
+                    "embedding_data": serialization.serialize_embedding(embedding),
+                }
+                for sample_id, embedding in embeddings.items()
+            ],
+        )
+
+    def update_estimates(
+        self,
+        sample_ids: Sequence[model.Id],
+        text_class_ids: Sequence[model.Id],
+        confidences: model.Matrix,
+    ) -> None:
+        if len(sample_ids) == 0 or len(text_class_ids) == 0:
+            return
+        # Core statements with plain rows, because ORM objects per estimate dominate the time.
+        connection = self._session.connection()
+        insert = _get_upsert_insert(connection.dialect.name)
+        if insert is None:
+            statement: Any = sqlalchemy.insert(ClassEstimate)
+        else:
+            statement = insert(ClassEstimate)
+            statement = statement.on_conflict_do_update(
+                index_elements=[ClassEstimate.sample_id, ClassEstimate.text_class_id],
+                set_={"confidence": statement.excluded.confidence},
+            )
+        confidence_rows = confidences.detach().cpu().double().numpy().tolist()
+        samples_per_batch = max(1, _ESTIMATE_BATCH_SIZE // len(text_class_ids))
+        for start in range(0, len(sample_ids), samples_per_batch):
+            batch_sample_ids = sample_ids[start : start + samples_per_batch]
+            if insert is None:
+                connection.execute(
+                    sqlalchemy.delete(ClassEstimate).where(
+                        ClassEstimate.sample_id.in_(batch_sample_ids),
+                        ClassEstimate.text_class_id.in_(text_class_ids),
+                    )
+                )
+            connection.execute(
+                statement,
+                [
+                    {
+                        # Only used by inserted estimates, existing ones keep their id.
+                        "id": f"{sample_id}/{text_class_id}",
+                        "text_class_id": text_class_id,
+                        "confidence": confidence,
+                        "sample_id": sample_id,
+                    }
+                    for sample_id, sample_confidences in zip(
+                        batch_sample_ids, confidence_rows[start : start + samples_per_batch]
+                    )
+                    for text_class_id, confidence in zip(text_class_ids, sample_confidences)
+                ],
+            )
+
+    def replace_estimates(
+        self,
+        sample_ids: Sequence[model.Id],
+        text_class_ids: Sequence[Sequence[model.Id]],
+        confidences: model.Matrix,
+        rest_confidences: Sequence[float | None],
+    ) -> None:
+        if len(sample_ids) == 0:
+            return
+        connection = self._session.connection()
+        confidence_rows = confidences.detach().cpu().double().numpy().tolist()
+        samples_per_batch = max(1, _ESTIMATE_BATCH_SIZE // max(1, confidences.shape[1]))
+        for start in range(0, len(sample_ids), samples_per_batch):
+            end = start + samples_per_batch
+            batch_sample_ids = sample_ids[start:end]
+            connection.execute(
+                sqlalchemy.delete(ClassEstimate).where(
+                    ClassEstimate.sample_id.in_(batch_sample_ids)
+                )
+            )
+            estimate_rows = [
+                {
+                    "id": f"{sample_id}/{text_class_id}",
+                    "text_class_id": text_class_id,
+                    "confidence": confidence,
+                    "sample_id": sample_id,
+                }
+                for sample_id, sample_text_class_ids, sample_confidences in zip(
+                    batch_sample_ids, text_class_ids[start:end], confidence_rows[start:end]
+                )
+                for text_class_id, confidence in zip(sample_text_class_ids, sample_confidences)
+            ]
+            if len(estimate_rows) > 0:
+                connection.execute(sqlalchemy.insert(ClassEstimate), estimate_rows)
+            connection.execute(
+                sqlalchemy.update(Sample)
+                .where(Sample.id == sqlalchemy.bindparam("sample_id"))
+                .values(rest_confidence=sqlalchemy.bindparam("rest_confidence_value")),
+                [
+                    {"sample_id": sample_id, "rest_confidence_value": rest_confidence}
+                    for sample_id, rest_confidence in zip(
+                        batch_sample_ids, rest_confidences[start:end]
+                    )
+                ],
+            )
+
+    def get_confidences(
+        self, sample_ids: Sequence[model.Id], text_class_ids: Sequence[model.Id]
+    ) -> model.Matrix:
+        confidences = np.zeros((len(sample_ids), len(text_class_ids)), dtype=np.float32)
+        if len(sample_ids) == 0 or len(text_class_ids) == 0:
+            return torch.from_numpy(confidences)
+        rows = {sample_id: row for row, sample_id in enumerate(sample_ids)}
+        columns = {text_class_id: column for column, text_class_id in enumerate(text_class_ids)}
+        for start in range(0, len(sample_ids), _ESTIMATE_READ_BATCH_SIZE):
+            estimates = self._session.execute(
+                sqlalchemy.select(
+                    ClassEstimate.sample_id, ClassEstimate.text_class_id, ClassEstimate.confidence
+                ).where(
+                    ClassEstimate.sample_id.in_(
+                        sample_ids[start : start + _ESTIMATE_READ_BATCH_SIZE]
+                    ),
+                    ClassEstimate.text_class_id.in_(text_class_ids),
+                )
+            )
+            for sample_id, text_class_id, confidence in estimates:
+                confidences[rows[sample_id], columns[text_class_id]] = confidence
+        return torch.from_numpy(confidences)
+
+    def remove_estimates(self, text_class_ids: Sequence[model.Id]) -> None:
+        if len(text_class_ids) == 0:
+            return
+        self._session.execute(
+            sqlalchemy.delete(ClassEstimate)
+            .where(ClassEstimate.text_class_id.in_(text_class_ids))
+            .execution_options(synchronize_session=False)
+        )
+
+    def update_priorities(self, priorities: Mapping[model.Id, float | None]) -> None:
+        if len(priorities) == 0:
+            return
+        # Executed on the connection, so that all samples are updated by a single executemany.
+        self._session.connection().execute(
+            sqlalchemy.update(Sample)
+            .where(Sample.id == sqlalchemy.bindparam("sample_id"))
+            .values(priority=sqlalchemy.bindparam("priority_value")),
+            [
+                {"sample_id": sample_id, "priority_value": priority}
+                for sample_id, priority in priorities.items()
+            ],
+        )
+
+    def update_labels(
+        self, task_id: model.Id, labels: Mapping[model.Id, model.TextClass | None]
+    ) -> None:
+        sample_ids = tuple(labels.keys())
+        found_ids = set(
+            self._session.scalars(
+                sqlalchemy.select(Sample.id).where(
+                    Sample.id.in_(sample_ids), Sample.annotation_task_id == task_id
+                )
+            )
+        )
+        for sample_id in sample_ids:
+            if sample_id not in found_ids:
+                raise ValueError(f"Sample with id {sample_id} not found in task {task_id}")
+        # Executed on the connection, so that all samples are updated by a single executemany.
+        self._session.connection().execute(
+            sqlalchemy.update(Sample)
+            .where(Sample.id == sqlalchemy.bindparam("sample_id"))
+            .values(text_class_id=sqlalchemy.bindparam("text_class_id"), lease_expires_at=None),
+            [
+                {
+                    "sample_id": sample_id,
+                    "text_class_id": None if text_class is None else text_class.id,
+                }
+                for sample_id, text_class in labels.items()
+            ],
+        )
+        unlabeled_ids = tuple(
+            sample_id for sample_id, text_class in labels.items() if text_class is None
+        )
+        if len(unlabeled_ids) > 0:
+            self._session.execute(
+                sqlalchemy.delete(ClassEstimate)
+                .where(ClassEstimate.sample_id.in_(unlabeled_ids))
+                .execution_options(synchronize_session=False)
+            )
 
     def create(self, sample: model.Sample) -> None:
         persistence_sample = Sample.from_domain(sample)
         self._session.add(persistence_sample)
 
+    def create_many(self, samples: Sequence[model.Sample]) -> None:
+        sample_rows = [
+            {
+                "id": sample.id,
+                "text": sample.text,
+                "text_class_id": None if sample.text_class is None else sample.text_class.id,
+                "embedding": (
+                    None
+                    if sample.embedding is None
+                    else serialization.serialize_embedding(sample.embedding)
+                ),
+                "annotation_task_id": sample.annotation_task_id,
+                "random_key": random.random(),
+                "priority": sample.priority,
+            }
+            for sample in samples
+        ]
+        estimate_rows = [
+            {
+                "id": estimate.id,
+                "text_class_id": estimate.text_class_id,
+                "confidence": estimate.confidence,
+                "sample_id": sample.id,
+            }
+            for sample in samples
+            for estimate in sample.estimates
+        ]
+        # The ORM is bypassed, because building ORM objects dominates the time of bulk inserts.
+        # Pending ORM changes (e.g. new text classes) are flushed first to satisfy foreign keys.
+        self._session.flush()
+        connection = self._session.connection()
+        if connection.dialect.name == "postgresql":
+            self._copy_rows(connection, Sample.__tablename__, sample_rows)
+            self._copy_rows(connection, ClassEstimate.__tablename__, estimate_rows)
+            return
+        if len(sample_rows) > 0:
+            connection.execute(sqlalchemy.insert(Sample), sample_rows)
+        if len(estimate_rows) > 0:
+            connection.execute(sqlalchemy.insert(ClassEstimate), estimate_rows)
+
+    @staticmethod
+    def _copy_rows(
+        connection: sqlalchemy.Connection, table_name: str, rows: Sequence[dict]
+    ) -> None:
+        """Insert the rows with PostgreSQL's COPY, which is faster than an INSERT."""
+        if len(rows) == 0:
+            return
+        column_names = tuple(rows[0].keys())
+        buffer = io.StringIO()
+        for row in rows:
+            buffer.write(",".join(_format_csv_value(value) for value in row.values()))
+            buffer.write("\n")
+        buffer.seek(0)
+        driver_connection: Any = connection.connection.driver_connection
+        with driver_connection.cursor() as cursor:
+            cursor.copy_expert(
+                f"COPY {table_name} ({', '.join(column_names)}) FROM STDIN WITH (FORMAT csv)",
+                buffer,
+            )
+
+    def claim(self, query: repository.SampleQuery, lease_duration: float) -> model.Sample | None:
+        now = time.time()
+        select_statement = self._apply_filters(sqlalchemy.select(Sample.id), query)
+        select_statement = select_statement.where(self._is_available(now))
+        candidate_statements: tuple[sqlalchemy.sql.Select, ...]
+        if query.order == repository.SampleOrder.RANDOM:
+            pivot = random.random()
+            select_statement = select_statement.order_by(Sample.random_key)
+            candidate_statements = (
+                select_statement.where(Sample.random_key >= pivot),
+                select_statement.where(Sample.random_key < pivot),
+            )
+        elif query.order == repository.SampleOrder.PRIORITY:
+            candidate_statements = (
+                select_statement.order_by(Sample.priority.desc().nulls_last(), Sample.id),
+            )
+        else:
+            candidate_statements = (select_statement.order_by(Sample.id),)
+        for candidate_statement in candidate_statements:
+            # Samples locked by concurrent claims are skipped on PostgreSQL. SQLite ignores the
+            # locking clause, but serializes the UPDATE statements anyway.
+            candidate_id = (
+                candidate_statement.limit(1).with_for_update(skip_locked=True).scalar_subquery()
+            )
+            claimed_id = self._session.scalars(
+                sqlalchemy.update(Sample)
+                .where(Sample.id == candidate_id, self._is_available(now))
+                .values(lease_expires_at=now + lease_duration)
+                .returning(Sample.id)
+                .execution_options(synchronize_session=False)
+            ).one_or_none()
+            if claimed_id is not None:
+                return self._get_by_id(claimed_id, query)
+        return None
+
+    def release(self, sample_id: model.Id) -> None:
+        self._session.execute(
+            sqlalchemy.update(Sample)
+            .where(Sample.id == sample_id)
+            .values(lease_expires_at=None)
+            .execution_options(synchronize_session=False)
+        )
+
+    def claim_many(
+        self, query: repository.SampleQuery, claim_duration: float
+    ) -> tuple[model.Sample, ...]:
+        now = time.time()
+        is_unclaimed = sqlalchemy.or_(
+            Sample.claim_expires_at.is_(None), Sample.claim_expires_at <= now
+        )
+        candidate_ids = (
+            self._apply_filters(sqlalchemy.select(Sample.id), query)
+            .where(is_unclaimed)
+            .order_by(Sample.id)
+            .limit(query.limit)
+            .with_for_update(skip_locked=True)
+        )
+        claimed_ids = self._session.scalars(
+            sqlalchemy.update(Sample)
+            .where(Sample.id.in_(candidate_ids), is_unclaimed)
+            .values(claim_expires_at=now + claim_duration)
+            .returning(Sample.id)
+            .execution_options(synchronize_session=False)
+        ).all()
+        if len(claimed_ids) == 0:
+            return ()
+        persistence_samples = self._session.scalars(
+            sqlalchemy.select(Sample)
+            .where(Sample.id.in_(claimed_ids))
+            .options(*self._loader_options(query))
+            .order_by(Sample.id)
+        ).all()
+        return self._to_domain(persistence_samples, query)
+
+    def _get_by_id(self, sample_id: model.Id, query: repository.SampleQuery) -> model.Sample:
+        persistence_sample = self._session.scalars(
+            sqlalchemy.select(Sample)
+            .where(Sample.id == sample_id)
+            .options(*self._loader_options(query))
+        ).one()
+        return persistence_sample.to_domain(query.with_embedding, query.with_estimates)
+
+    @staticmethod
+    def _loader_options(query: repository.SampleQuery | None) -> list[orm.interfaces.LoaderOption]:
+        """
+        Load the relationships eagerly (with a constant number of statements instead of one per
+        sample) and defer what the loading plan of the query excludes.
+        """
+        options: list[orm.interfaces.LoaderOption] = [orm.joinedload(Sample.text_class)]
+        if query is None or query.with_estimates:
+            options.append(orm.selectinload(Sample.estimates))
+        if query is not None and not query.with_embedding:
+            options.append(orm.defer(Sample.embedding))
+        return options
+
+    @staticmethod
+    def _to_domain(
+        persistence_samples: Sequence[Sample], query: repository.SampleQuery | None
+    ) -> tuple[model.Sample, ...]:
+        if query is None:
+            return tuple(
+                persistence_sample.to_domain() for persistence_sample in persistence_samples
+            )
+        return tuple(
+            persistence_sample.to_domain(query.with_embedding, query.with_estimates)
+            for persistence_sample in persistence_samples
+        )
+
+    @staticmethod
+    def _is_available(now: float) -> sqlalchemy.ColumnElement[bool]:
+        return sqlalchemy.or_(Sample.lease_expires_at.is_(None), Sample.lease_expires_at <= now)
+
     def find(self, query: repository.SampleQuery | None = None) -> tuple[model.Sample, ...]:
-        select_statement = sqlalchemy.select(Sample)
+        select_statement = sqlalchemy.select(Sample).options(*self._loader_options(query))
+        return self._to_domain(self._find(select_statement, query), query)
+
+    def find_ids(self, query: repository.SampleQuery | None = None) -> tuple[model.Id, ...]:
+        return tuple(self._find(sqlalchemy.select(Sample.id), query))
+
+    def _find(
+        self, select_statement: sqlalchemy.sql.Select, query: repository.SampleQuery | None
+    ) -> Sequence[Any]:
         select_statement = self._apply_filters(select_statement, query)
-        persistence_samples = self._session.scalars(select_statement).all()
-        return tuple(persistence_sample.to_domain() for persistence_sample in persistence_samples)
+        if query is not None and query.for_update:
+            select_statement = select_statement.with_for_update(of=Sample)
+        if query is not None and query.order == repository.SampleOrder.RANDOM:
+            return self._find_random(select_statement, query.limit)
+        select_statement = self._apply_order_and_limit(select_statement, query)
+        return self._session.scalars(select_statement).all()
+
+    def _find_random(self, statement: sqlalchemy.sql.Select, limit: int | None) -> Sequence[Any]:
+        """
+        Find samples in random order.
+
+        Instead of sorting all samples by a random value, the samples following a random pivot
+        in the (indexed) random key order are selected, wrapping around at the end.
+        """
+        pivot = random.random()
+        statement = statement.order_by(Sample.random_key).limit(limit)
+        persistence_samples = list(
+            self._session.scalars(statement.where(Sample.random_key >= pivot)).all()
+        )
+        if limit is None or len(persistence_samples) < limit:
+            remaining = None if limit is None else limit - len(persistence_samples)
+            persistence_samples.extend(
+                self._session.scalars(statement.where(Sample.random_key < pivot).limit(remaining))
+            )
+        return persistence_samples
+
+    def iter_find(
+        self, query: repository.SampleQuery | None = None, batch_size: int = 1000
+    ) -> Iterator[model.Sample]:
+        # Keyset pagination: every batch continues after the largest id of the previous one.
+        select_statement = self._apply_filters(
+            sqlalchemy.select(Sample).options(*self._loader_options(query)), query
+        )
+        remaining = None if query is None else query.limit
+        last_id: model.Id | None = None
+        while remaining is None or remaining > 0:
+            limit = batch_size if remaining is None else min(batch_size, remaining)
+            batch_statement = select_statement.order_by(Sample.id).limit(limit)
+            if last_id is not None:
+                batch_statement = batch_statement.where(Sample.id > last_id)
+            persistence_samples = self._session.scalars(batch_statement).all()
+            if len(persistence_samples) == 0:
+                return
+            samples = self._to_domain(persistence_samples, query)
+            # Keep the memory of the session constant while iterating (the loaded estimates are
+            # expunged with their samples).
+            for persistence_sample in persistence_samples:
+                self._session.expunge(persistence_sample)
+            last_id = samples[-1].id
+            if remaining is not None:
+                remaining -= len(samples)
+            yield from samples
+
+    def count(self, query: repository.SampleQuery | None = None) -> int:
+        count_statement = sqlalchemy.select(sqlalchemy.func.count(Sample.id))
+        count_statement = self._apply_filters(count_statement, query)
+        return self._session.scalars(count_statement).one()
+
+    def _apply_order_and_limit(
+        self, statement: sqlalchemy.sql.Select, query: repository.SampleQuery | None
+    ) -> sqlalchemy.sql.Select:
+        if query is None:
+            return statement
+        if query.order == repository.SampleOrder.PRIORITY:
+            statement = statement.order_by(Sample.priority.desc().nulls_last(), Sample.id)
+        elif query.limit is not None:
+            statement = statement.order_by(Sample.id)
+        return statement.limit(query.limit)
 
     def _apply_filters(
         self, statement: sqlalchemy.sql.Select, query: repository.SampleQuery | None
@@ -170,7 +804,9 @@ class SQLAlchemySampleRepository(repository.SampleRepository):
             return statement
         statement = self._apply_filter_has_label(statement, query)
         statement = self._apply_filter_has_embedding(statement, query)
+        statement = self._apply_filter_has_estimates(statement, query)
         statement = self._apply_filter_task_id(statement, query)
+        statement = self._apply_filter_ids(statement, query)
         return statement
 
     def _apply_filter_has_label(
@@ -191,6 +827,15 @@ class SQLAlchemySampleRepository(repository.SampleRepository):
             return statement.where(Sample.embedding.is_(None))
         return statement
 
+    def _apply_filter_has_estimates(
+        self, statement: sqlalchemy.sql.Select, query: repository.SampleQuery
+    ) -> sqlalchemy.sql.Select:
+        if query.has_estimates is True:
+            return statement.where(Sample.estimates.any())
+        elif query.has_estimates is False:
+            return statement.where(~Sample.estimates.any())
+        return statement
+
     def _apply_filter_task_id(
         self, statement: sqlalchemy.sql.Select, query: repository.SampleQuery
     ) -> sqlalchemy.sql.Select:
@@ -198,6 +843,34 @@ class SQLAlchemySampleRepository(repository.SampleRepository):
             return statement.where(Sample.annotation_task_id == query.task_id)
         return statement
 
+    def _apply_filter_ids(
+        self, statement: sqlalchemy.sql.Select, query: repository.SampleQuery
+    ) -> sqlalchemy.sql.Select:
+        if query.ids is not None:
+            return statement.where(Sample.id.in_(query.ids))
+        return statement
+
+
+def _get_upsert_insert(dialect_name: str) -> Callable[..., Any] | None:
+    """Get the insert construct supporting ON CONFLICT DO UPDATE of the dialect (if any)."""
+    if dialect_name == "postgresql":
+        return sqlalchemy.dialects.postgresql.insert
+    if dialect_name == "sqlite":
+        return sqlalchemy.dialects.sqlite.insert
+    return None
+
+
+def _format_csv_value(value: str | bytes | float | None) -> str:
+    """Format a value for PostgreSQL's COPY in CSV format."""
+    # Unquoted empty values are NULL, quoted ones are empty strings.
+    if value is None:
+        return ""
+    if isinstance(value, bytes):
+        value = "\\x" + value.hex()
+    if isinstance(value, str):
+        return '"' + value.replace('"', '""') + '"'
+    return repr(value)
+
 
 class SQLAlchemyAnnotationTaskRepository(repository.AnnotationTaskRepository):
     """Annotation task repository using SQLAlchemy."""
@@ -212,8 +885,11 @@ class SQLAlchemyAnnotationTaskRepository(repository.AnnotationTaskRepository):
         return persistence_task.to_domain()
 
     def update(self, task: model.AnnotationTask) -> None:
-        persistence_task = AnnotationTask.from_domain(task)
-        self._session.merge(persistence_task)
+        persistence_task = self._session.merge(AnnotationTask.from_domain(task))
+        # Incremented by the database, so that concurrent updates get different versions.
+        persistence_task.version = AnnotationTask.version + 1  # type: ignore[assignment]
+        # Only changed by `increment_label_version`, the label version of the task may be stale.
+        persistence_task.label_version = AnnotationTask.label_version  # type: ignore[assignment]
 
     def create(self, task: model.AnnotationTask) -> None:
         persistence_task = AnnotationTask.from_domain(task)
@@ -223,6 +899,72 @@ class SQLAlchemyAnnotationTaskRepository(repository.AnnotationTaskRepository):
         persistence_tasks = self._session.query(AnnotationTask).all()
         return tuple(persistence_task.to_domain() for persistence_task in persistence_tasks)
 
+    def get_version(self, task_id: model.Id) -> int:
+        version = self._session.scalar(
+            sqlalchemy.select(AnnotationTask.version).where(AnnotationTask.id == task_id)
+        )
+        if version is None:
+            raise ValueError(f"Annotation task with id {task_id} not found")
+        return version
+
+    def increment_label_version(self, task_id: model.Id) -> None:
+        self._session.execute(
+            sqlalchemy.update(AnnotationTask)
+            .where(AnnotationTask.id == task_id)
+            .values(label_version=AnnotationTask.label_version + 1)
+        )
+
+
+class SQLAlchemyClassCentroidRepository(repository.ClassCentroidRepository):
+    """Class centroid repository using SQLAlchemy."""
+
+    def __init__(self, session: orm.Session) -> None:
+        self._session = session
+
+    def find(self, task_id: model.Id) -> tuple[model.ClassCentroid, ...]:
+        persistence_centroids = self._session.scalars(
+            sqlalchemy.select(ClassCentroid).where(ClassCentroid.annotation_task_id == task_id)
+        ).all()
+        return tuple(
+            persistence_centroid.to_domain() for persistence_centroid in persistence_centroids
+        )
+
+    def add_embeddings(
+        self, text_class: model.TextClass, embedding_sum: model.Embedding, count: int
+    ) -> None:
+        insert = _get_upsert_insert(self._session.get_bind().dialect.name)
+        if insert is not None:
+            # Creates the centroid without failing if a concurrent transaction creates it, too.
+            self._session.execute(
+                insert(ClassCentroid)
+                .values(
+                    text_class_id=text_class.id,
+                    annotation_task_id=text_class.annotation_task_id,
+                    embedding_sum=serialization.serialize_embedding(
+                        torch.zeros_like(embedding_sum, dtype=torch.float64)
+                    ),
+                    count=0,
+                )
+                .on_conflict_do_nothing(index_elements=[ClassCentroid.text_class_id])
+            )
+        # Locks the row on PostgreSQL, so that concurrent additions are not lost.
+        persistence_centroid = self._session.get(ClassCentroid, text_class.id, with_for_update=True)
+        if persistence_centroid is None:
+            centroid = model.ClassCentroid(
+                text_class.id,
+                text_class.annotation_task_id,
+                torch.zeros_like(embedding_sum, dtype=torch.float64),
+            )
+            centroid.add(embedding_sum, count)
+            self._session.add(ClassCentroid.from_domain(centroid))
+            return
+        centroid = persistence_centroid.to_domain()
+        centroid.add(embedding_sum, count)
+        persistence_centroid.embedding_sum = serialization.serialize_embedding(
+            centroid.embedding_sum
+        )
+        persistence_centroid.count = centroid.count
+
 
 class SQLAlchemyUnitOfWork(unitofwork.UnitOfWork):
     """Database session using SQLAlchemy."""
@@ -230,6 +972,13 @@ class SQLAlchemyUnitOfWork(unitofwork.UnitOfWork):
     def __init__(self, engine: sqlalchemy.engine.Engine) -> None:
         self._engine = engine
 
+    @classmethod
+    def from_session(cls, session: orm.Session) -> Self:
+        """Create a unit of work in a session that is opened and closed by the caller."""
+        unit_of_work = cls(session.get_bind().engine)
+        unit_of_work._session = session
+        return unit_of_work
+
     def __enter__(self) -> Self:
         self._session = sqlalchemy.orm.Session(self._engine)
         return self
@@ -254,6 +1003,10 @@ class SQLAlchemyUnitOfWork(unitofwork.UnitOfWork):
     def samples(self) -> SQLAlchemySampleRepository:
         return SQLAlchemySampleRepository(self._session)
 
+    @property
+    def class_centroids(self) -> SQLAlchemyClassCentroidRepository:
+        return SQLAlchemyClassCentroidRepository(self._session)
+
     def commit(self) -> None:
         _LOG.info("Committing session")
         self._session.commit()
@@ -261,3 +1014,72 @@ class SQLAlchemyUnitOfWork(unitofwork.UnitOfWork):
     def create_tables(self) -> None:
         _LOG.info("Creating tables")
         Base.metadata.create_all(self._engine)
+
+
+class SQLAlchemyAsyncUnitOfWork(unitofwork.AsyncUnitOfWork):
+    """
+    Asyncio unit of work using SQLAlchemy's asyncio extension.
+
+    A transaction runs the synchronous repositories through `AsyncSession.run_sync`, which
+    awaits the asyncio database driver (asyncpg) whenever they wait for the database, so the
+    event loop keeps serving other requests in the meantime.
+    """
+
+    def __init__(self, engine: sqlalchemy.ext.asyncio.AsyncEngine) -> None:
+        self._engine = engine
+
+    async def run(self, transaction: Callable[[unitofwork.UnitOfWork], _T]) -> _T:
+        async with sqlalchemy.ext.asyncio.AsyncSession(self._engine) as session:
+            try:
+                return await session.run_sync(
+                    lambda sync_session: transaction(
+                        SQLAlchemyUnitOfWork.from_session(sync_session)
+                    )
+                )
+            finally:
+                await session.rollback()
+
+
+class SQLAlchemyThreadedAsyncUnitOfWork(unitofwork.AsyncUnitOfWork):
+    """
+    Asyncio unit of work running every transaction in a worker thread.
+
+    Used for SQLite, which waits for the disk rather than for the network. Its asyncio driver
+    (aiosqlite) runs every database call in a thread of its own anyway, which costs more than
+    running the whole transaction in one thread and halved the throughput of the API.
+    """
+
+    def __init__(self, engine: sqlalchemy.engine.Engine) -> None:
+        self._engine = engine
+
+    async def run(self, transaction: Callable[[unitofwork.UnitOfWork], _T]) -> _T:
+        def run_transaction() -> _T:
+            with SQLAlchemyUnitOfWork(self._engine) as unit_of_work:
+                return transaction(unit_of_work)
+
+        return await asyncio.to_thread(run_transaction)
+
+
+def create_async_unit_of_work(
+    engine: sqlalchemy.engine.Engine,
+    async_engine_factory: Callable[[], sqlalchemy.ext.asyncio.AsyncEngine],
+) -> unitofwork.AsyncUnitOfWork:
+    """Create the asyncio unit of work fitting the database of the (synchronous) engine."""
+    if engine.dialect.name == "sqlite":
+        return SQLAlchemyThreadedAsyncUnitOfWork(engine)
+    return SQLAlchemyAsyncUnitOfWork(async_engine_factory())
+
+
+# SQLite has none, see `SQLAlchemyThreadedAsyncUnitOfWork`.
+_ASYNC_DRIVERS = {"postgresql": "asyncpg"}
+
+
+def get_async_database_url(database_url: str) -> str:
+    """Get the URL of the database with the asyncio driver of its dialect."""
+    url = sqlalchemy.engine.make_url(database_url)
+    backend = url.get_backend_name()
+    if backend not in _ASYNC_DRIVERS:
+        raise ValueError(f"No asyncio driver for the database {backend}")
+    return url.set(drivername=f"{backend}+{_ASYNC_DRIVERS[backend]}").render_as_string(
+        hide_password=False
+    )
@@ -1,13 +1,80 @@
-import random
-from collections.abc import Sequence
+import abc
+
+import torch
 
 from nlpanno.application import service
-from nlpanno.domain import model
+from nlpanno.domain import model, repository
 
 
 class RandomSamplingService(service.SamplingService):
-    def sample(self, samples: Sequence[model.Sample]) -> model.Id | None:
-        if len(samples) == 0:
-            return None
-        id_ = random.sample(samples, 1)[0].id
-        return id_
+    def create_query(self, task_id: model.Id) -> repository.SampleQuery:
+        return repository.SampleQuery(
+            has_label=False, task_id=task_id, order=repository.SampleOrder.RANDOM, limit=1
+        )
+
+
+class UncertaintySamplingService(service.SamplingService, abc.ABC):
+    """
+    Base class for sampling the sample with the most uncertain class estimates.
+
+    The confidences (cosine similarities) are turned into a probability distribution with a
+    softmax. The priority of a sample is a measure of the uncertainty of that distribution.
+    """
+
+    def __init__(self, temperature: float = 0.05) -> None:
+        self._temperature = temperature
+
+    def create_query(self, task_id: model.Id) -> repository.SampleQuery:
+        return repository.SampleQuery(
+            has_label=False, task_id=task_id, order=repository.SampleOrder.PRIORITY, limit=1
+        )
+
+    def uses_priorities(self) -> bool:
+        return True
+
+    def calculate_priorities(self, confidences: model.Matrix) -> model.Matrix:
+        if confidences.shape[1] == 0:
+            return torch.zeros(confidences.shape[0])
+        probabilities = torch.softmax(confidences.float() / self._temperature, dim=1)
+        return self._calculate_uncertainties(probabilities)
+
+    @abc.abstractmethod
+    def _calculate_uncertainties(self, probabilities: torch.Tensor) -> torch.Tensor:
+        raise NotImplementedError()
+
+
+class LeastConfidenceSamplingService(UncertaintySamplingService):
+    """Prefer samples whose most probable class has the lowest probability."""
+
+    def _calculate_uncertainties(self, probabilities: torch.Tensor) -> torch.Tensor:
+        return 1.0 - probabilities.max(dim=1).values
+
+
+class MarginSamplingService(UncertaintySamplingService):
+    """Prefer samples with the smallest margin between the two most probable classes."""
+
+    def _calculate_uncertainties(self, probabilities: torch.Tensor) -> torch.Tensor:
+        if probabilities.shape[1] < 2:
+            return 1.0 - probabilities[:, 0]
+        top_two = probabilities.topk(2, dim=1).values
+        return 1.0 - (top_two[:, 0] - top_two[:, 1])
+
+
+class EntropySamplingService(UncertaintySamplingService):
+    """Prefer samples with the highest entropy of the class probabilities."""
+
+    def _calculate_uncertainties(self, probabilities: torch.Tensor) -> torch.Tensor:
+        return -(probabilities * torch.log(probabilities.clamp_min(1e-12))).sum(dim=1)
+
+
+def create_sampling_service(strategy: model.SamplingStrategy) -> service.SamplingService:
+    """Create the sampling service implementing the strategy."""
+    if strategy == model.SamplingStrategy.RANDOM:
+        return RandomSamplingService()
+    if strategy == model.SamplingStrategy.LEAST_CONFIDENCE:
+        return LeastConfidenceSamplingService()
+    if strategy == model.SamplingStrategy.MARGIN:
+        return MarginSamplingService()
+    if strategy == model.SamplingStrategy.ENTROPY:
+        return EntropySamplingService()
+    raise ValueError(f"Unknown sampling strategy: {strategy}")
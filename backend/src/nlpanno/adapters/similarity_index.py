@@ -0,0 +1,320 @@
+"""Approximate nearest neighbor index of the sample embeddings."""
+
+import dataclasses
+import json
+import logging
+import pathlib
+import threading
+from collections.abc import Mapping
+
+import numpy as np
+
+from nlpanno.application import service
+from nlpanno.domain import model
+
+from . import filestore
+
+_LOG = logging.getLogger("nlpanno")
+
+_METADATA_FILE = "metadata.json"
+_VECTORS_FILE = "vectors.f32"
+_IDS_FILE = "ids.txt"
+_LISTS_FILE = "lists.i32"
+_CENTROIDS_FILE = "centroids.f32"
+
+# Number of vectors compared to the centroids at once (bounds the size of the score matrix).
+_BLOCK_SIZE = 65536
+_KMEANS_ITERATIONS = 10
+_TRAINING_VECTORS_PER_CLUSTER = 32
+
+
+@dataclasses.dataclass
+class _Metadata:
+    """State of the files of a task's index, which is only valid up to these sizes."""
+
+    dimension: int = 0
+    count: int = 0
+    ids_size: int = 0
+    # Number of vectors the clusters were trained with (0 if the index is not trained yet).
+    trained_count: int = 0
+    # Incremented whenever the clusters (and thereby the lists of all vectors) change.
+    version: int = 0
+
+
+class IVFSimilarityIndex(service.SimilarityIndex):
+    """
+    Inverted file (IVF) index of the normalized embeddings of each task, stored in a directory.
+
+    The embeddings are clustered with spherical k-means and every embedding is listed under its
+    closest cluster centroid. A search only compares the query to the embeddings listed under
+    the `probes` centroids closest to the query. Tasks with fewer than `min_training_size`
+    embeddings are searched exhaustively. The clusters are trained again whenever the number of
+    embeddings quadrupled.
+
+    The files of a task are appended to (see `filestore`), so that embedding workers can add
+    embeddings while other processes (e.g. the API) search.
+    """
+
+    def __init__(
+        self,
+        directory: pathlib.Path | str,
+        probes: int = 16,
+        min_training_size: int = 10000,
+    ) -> None:
+        self._directory = pathlib.Path(directory)
+        self._probes = probes
+        self._min_training_size = min_training_size
+        self._task_indexes: dict[model.Id, _TaskIndex] = {}
+        self._task_indexes_lock = threading.Lock()
+
+    def add(self, task_id: model.Id, embeddings: Mapping[model.Id, model.Embedding]) -> None:
+        if len(embeddings) == 0:
+            return
+        vectors = _normalize(
+            np.stack(
+                [embedding.detach().cpu().float().numpy() for embedding in embeddings.values()]
+            )
+        )
+        ids = "".join(f"{sample_id}\n" for sample_id in embeddings).encode("utf-8")
+        with filestore.lock_directory(self._directory / task_id) as directory:
+            metadata = _read_metadata(directory)
+            if metadata.count == 0:
+                metadata.dimension = vectors.shape[1]
+            elif vectors.shape[1] != metadata.dimension:
+                raise ValueError(
+                    f"Embedding dimension {vectors.shape[1]} does not match the dimension "
+                    f"{metadata.dimension} of the index of task {task_id}"
+                )
+            centroids = _read_centroids(directory, metadata)
+            if centroids is None:
+                lists = np.full(len(vectors), -1, dtype=np.int32)
+            else:
+                lists = _assign(vectors, centroids)
+            filestore.append(
+                directory / _VECTORS_FILE, metadata.count * metadata.dimension * 4, vectors
+            )
+            filestore.append(directory / _IDS_FILE, metadata.ids_size, ids)
+            filestore.append(directory / _LISTS_FILE, metadata.count * 4, lists)
+            metadata.count += len(vectors)
+            metadata.ids_size += len(ids)
+            if self._needs_training(metadata):
+                self._train(directory, metadata)
+            _write_metadata(directory, metadata)
+
+    def search(
+        self, task_id: model.Id, embedding: model.Embedding, k: int
+    ) -> list[tuple[model.Id, float]]:
+        directory = self._directory / task_id
+        metadata = _read_metadata(directory)
+        with self._task_indexes_lock:
+            task_index = self._task_indexes.get(task_id)
+            if (
+                task_index is None
+                or task_index.version != metadata.version
+                or task_index.count > metadata.count
+            ):
+                task_index = _TaskIndex.load(directory, metadata)
+            else:
+                task_index = task_index.refresh(directory, metadata)
+            self._task_indexes[task_id] = task_index
+        query = _normalize(embedding.detach().cpu().float().numpy().reshape(1, -1))[0]
+        if task_index.count == 0 or len(query) != task_index.dimension:
+            return []
+        return task_index.search(query, k, self._probes)
+
+    def clear(self, task_id: model.Id) -> None:
+        with filestore.lock_directory(self._directory / task_id) as directory:
+            version = _read_metadata(directory).version
+            for file_name in (_VECTORS_FILE, _IDS_FILE, _LISTS_FILE, _CENTROIDS_FILE):
+                (directory / file_name).unlink(missing_ok=True)
+            _write_metadata(directory, _Metadata(version=version + 1))
+
+    def _needs_training(self, metadata: _Metadata) -> bool:
+        if metadata.trained_count == 0:
+            return metadata.count >= self._min_training_size
+        return metadata.count >= 4 * metadata.trained_count
+
+    def _train(self, directory: pathlib.Path, metadata: _Metadata) -> None:
+        """Cluster the vectors and list all vectors under their closest centroid again."""
+        _LOG.info(f"Training the similarity index of {directory.name} ({metadata.count} vectors)")
+        vectors = _map_vectors(directory, metadata)
+        rng = np.random.default_rng()
+        clusters = max(1, int(np.sqrt(metadata.count)))
+        training_size = min(metadata.count, clusters * _TRAINING_VECTORS_PER_CLUSTER)
+        training_rows = np.sort(rng.choice(metadata.count, training_size, replace=False))
+        centroids = _kmeans(np.asarray(vectors[training_rows]), clusters, rng)
+        lists = np.concatenate(
+            [
+                _assign(np.asarray(vectors[start : start + _BLOCK_SIZE]), centroids)
+                for start in range(0, metadata.count, _BLOCK_SIZE)
+            ]
+        )
+        filestore.replace(directory / _CENTROIDS_FILE, centroids.tobytes())
+        filestore.replace(directory / _LISTS_FILE, lists.tobytes())
+        metadata.trained_count = metadata.count
+        metadata.version += 1
+
+
+@dataclasses.dataclass(frozen=True)
+class _TaskIndex:
+    """
+    Snapshot of a task's index loaded for searching.
+
+    Snapshots are never changed, refreshing creates a new one with the appended vectors. So a
+    search can use a snapshot while another thread refreshes it.
+    """
+
+    version: int
+    dimension: int
+    count: int
+    ids_size: int
+    ids: tuple[model.Id, ...]
+    lists: np.ndarray
+    vectors: np.ndarray
+    centroids: np.ndarray | None
+    # The rows up to `sorted_count` ordered by list, with the start of every list.
+    sorted_count: int
+    order: np.ndarray
+    offsets: np.ndarray
+
+    @classmethod
+    def load(cls, directory: pathlib.Path, metadata: _Metadata) -> "_TaskIndex":
+        """Load the index of a task."""
+        empty_task_index = cls(
+            version=metadata.version,
+            dimension=metadata.dimension,
+            count=0,
+            ids_size=0,
+            ids=(),
+            lists=np.empty(0, dtype=np.int32),
+            vectors=np.empty((0, metadata.dimension), dtype=np.float32),
+            centroids=_read_centroids(directory, metadata),
+            sorted_count=0,
+            order=np.empty(0, dtype=np.int64),
+            offsets=np.zeros(1, dtype=np.int64),
+        )
+        return empty_task_index.refresh(directory, metadata)
+
+    def refresh(self, directory: pathlib.Path, metadata: _Metadata) -> "_TaskIndex":
+        """Get a snapshot with the vectors appended since this one."""
+        if metadata.count == self.count:
+            return self
+        new_ids = filestore.read_lines(directory / _IDS_FILE, self.ids_size, metadata.ids_size)
+        new_lists = np.fromfile(
+            directory / _LISTS_FILE,
+            dtype=np.int32,
+            count=metadata.count - self.count,
+            offset=self.count * 4,
+        )
+        task_index = dataclasses.replace(
+            self,
+            count=metadata.count,
+            ids_size=metadata.ids_size,
+            ids=self.ids + tuple(new_ids),
+            lists=np.concatenate([self.lists, new_lists]),
+            vectors=_map_vectors(directory, metadata),
+        )
+        # The appended rows are searched by filtering their lists until they are sorted in.
+        if (
+            task_index.centroids is not None
+            and task_index.count - task_index.sorted_count > task_index.count // 8
+        ):
+            return task_index._sort_lists()
+        return task_index
+
+    def search(self, query: np.ndarray, k: int, probes: int) -> list[tuple[model.Id, float]]:
+        """Find the rows most similar to the (normalized) query."""
+        if self.centroids is None:
+            rows = np.arange(self.count)
+        else:
+            probes = min(probes, len(self.centroids))
+            probed = np.argpartition(-(self.centroids @ query), probes - 1)[:probes]
+            tail = np.arange(self.sorted_count, self.count)
+            rows = np.concatenate(
+                [self.order[self.offsets[list_] : self.offsets[list_ + 1]] for list_ in probed]
+                + [tail[np.isin(self.lists[self.sorted_count :], probed)]]
+            )
+            # Reading the memory map in order is faster.
+            rows.sort()
+        scores = self.vectors[rows] @ query
+        # Twice as many candidates, because a sample may have been added more than once.
+        candidates = min(len(scores), 2 * k)
+        if candidates == 0:
+            return []
+        top = np.argpartition(-scores, candidates - 1)[:candidates]
+        top = top[np.argsort(-scores[top])]
+        neighbors: list[tuple[model.Id, float]] = []
+        found_ids = set()
+        for index in top:
+            sample_id = self.ids[rows[index]]
+            if sample_id not in found_ids:
+                found_ids.add(sample_id)
+                neighbors.append((sample_id, float(scores[index])))
+            if len(neighbors) == k:
+                break
+        return neighbors
+
+    def _sort_lists(self) -> "_TaskIndex":
+        assert self.centroids is not None
+        order = np.argsort(self.lists, kind="stable")
+        return dataclasses.replace(
+            self,
+            sorted_count=self.count,
+            order=order,
+            offsets=np.searchsorted(self.lists[order], np.arange(len(self.centroids) + 1)),
+        )
+
+
+def create_similarity_index(data_dir: pathlib.Path | str, probes: int) -> service.SimilarityIndex:
+    """Create the similarity index in the data directory."""
+    return IVFSimilarityIndex(pathlib.Path(data_dir) / "similarity_index", probes)
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return (vectors / np.maximum(norms, 1e-12)).astype(np.float32)
+
+
+def _assign(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """Get the index of the closest centroid of every vector."""
+    return np.concatenate(
+        [
+            np.argmax(vectors[start : start + _BLOCK_SIZE] @ centroids.T, axis=1)
+            for start in range(0, len(vectors), _BLOCK_SIZE)
+        ]
+    ).astype(np.int32)
+
+
+def _kmeans(vectors: np.ndarray, clusters: int, rng: np.random.Generator) -> np.ndarray:
+    """Cluster the normalized vectors with spherical k-means and return the centroids."""
+    centroids = vectors[rng.choice(len(vectors), clusters, replace=False)]
+    for _ in range(_KMEANS_ITERATIONS):
+        assignments = _assign(vectors, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, vectors)
+        # Empty clusters keep their centroid.
+        is_empty = np.bincount(assignments, minlength=clusters) == 0
+        centroids = np.where(is_empty[:, np.newaxis], centroids, _normalize(sums))
+    return centroids
+
+
+def _read_metadata(directory: pathlib.Path) -> _Metadata:
+    path = directory / _METADATA_FILE
+    if not path.exists():
+        return _Metadata()
+    return _Metadata(**json.loads(path.read_text()))
+
+
+def _write_metadata(directory: pathlib.Path, metadata: _Metadata) -> None:
+    filestore.replace(directory / _METADATA_FILE, json.dumps(dataclasses.asdict(metadata)).encode())
+
+
+def _read_centroids(directory: pathlib.Path, metadata: _Metadata) -> np.ndarray | None:
+    if metadata.trained_count == 0:
+        return None
+    centroids = np.fromfile(directory / _CENTROIDS_FILE, dtype=np.float32)
+    return centroids.reshape(-1, metadata.dimension)
+
+
+def _map_vectors(directory: pathlib.Path, metadata: _Metadata) -> np.ndarray:
+    return filestore.map_matrix(directory / _VECTORS_FILE, metadata.count, metadata.dimension)
@@ -0,0 +1,61 @@
+"""In-process cache for annotation tasks."""
+
+import collections
+import threading
+
+from nlpanno.application import service
+from nlpanno.domain import model
+
+
+class LRUAnnotationTaskCache(service.AnnotationTaskCache):
+    """
+    Cache of the most recently used annotation tasks of the process.
+
+    A cached task is only returned for its own version, so that tasks updated by other processes
+    are loaded again. If the cache holds more than `max_entries` tasks, the least recently used
+    ones are evicted.
+
+    Cached tasks are shared between requests and must not be changed. Their label version is
+    the one they were loaded with, because it does not change the version of a task.
+    """
+
+    def __init__(self, max_entries: int = 128) -> None:
+        self._max_entries = max_entries
+        self._tasks: collections.OrderedDict[model.Id, model.AnnotationTask] = (
+            collections.OrderedDict()
+        )
+        # Transactions of the API run in threads.
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def hit_rate(self) -> float:
+        """Share of the lookups that were answered from the cache."""
+        requests = self.hits + self.misses
+        if requests == 0:
+            return 0.0
+        return self.hits / requests
+
+    def get(self, task_id: model.Id, version: int) -> model.AnnotationTask | None:
+        with self._lock:
+            task = self._tasks.get(task_id)
+            if task is None or task.version != version:
+                self.misses += 1
+                return None
+            self._tasks.move_to_end(task_id)
+            self.hits += 1
+            return task
+
+    def put(self, task: model.AnnotationTask) -> None:
+        if self._max_entries <= 0:
+            return
+        with self._lock:
+            cached_task = self._tasks.get(task.id)
+            # A concurrent request may have cached a newer version meanwhile.
+            if cached_task is not None and cached_task.version > task.version:
+                return
+            self._tasks[task.id] = task
+            self._tasks.move_to_end(task.id)
+            while len(self._tasks) > self._max_entries:
+                self._tasks.popitem(last=False)
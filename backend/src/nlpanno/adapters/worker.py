@@ -0,0 +1,46 @@
+"""Main loop shared by the workers."""
+
+import logging
+import time
+from collections.abc import Callable
+
+from nlpanno.application import service
+
+_LOGGER = logging.getLogger("nlpanno")
+
+_MIN_TIMEOUT = 1.0
+_MAX_TIMEOUT = 300.0
+
+
+def run_loop(
+    execute: Callable[[], bool],
+    notification_service: service.NotificationService,
+    channel: service.NotificationChannel,
+) -> None:
+    """
+    Execute the work repeatedly.
+
+    As long as there is work, it is executed without pause. Otherwise, the loop blocks until a
+    notification arrives on the channel. The timeout of the wait doubles with every idle
+    iteration (and after failures), so that missed notifications are still picked up eventually.
+    If waiting fails (e.g. because the connection to the database dropped), the loop sleeps for
+    the timeout instead.
+    """
+    notification_service.subscribe(channel)
+    timeout = _MIN_TIMEOUT
+    while True:
+        try:
+            did_work = execute()
+        except Exception:
+            _LOGGER.exception(f"Work failed, retrying in up to {timeout:.0f} seconds.")
+            did_work = False
+        if did_work:
+            timeout = _MIN_TIMEOUT
+            continue
+        _LOGGER.debug(f"No work to do, waiting up to {timeout:.0f} seconds.")
+        try:
+            notification_service.wait(channel, timeout)
+        except Exception:
+            _LOGGER.exception(f"Waiting failed, retrying in {timeout:.0f} seconds.")
+            time.sleep(timeout)
+        timeout = min(2 * timeout, _MAX_TIMEOUT)
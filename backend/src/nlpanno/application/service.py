@@ -1,7 +1,8 @@
+import enum
 from abc import ABC, abstractmethod
-from collections.abc import Sequence
+from collections.abc import Callable, Mapping, Sequence
 
-from nlpanno.domain import model
+from nlpanno.domain import model, repository
 
 
 class EmbeddingService(ABC):
@@ -10,9 +11,40 @@ class EmbeddingService(ABC):
         raise NotImplementedError()
 
 
-class EmbeddingAggregationService(ABC):
+class EmbeddingStore(ABC):
+    """Store of the sample embeddings of each task, which processes can read without copies."""
+
+    @abstractmethod
+    def add(self, task_id: model.Id, embeddings: Mapping[model.Id, model.Embedding]) -> None:
+        """Add the embeddings of samples (by sample id) of a task, replacing earlier ones."""
+        raise NotImplementedError()
+
+    @abstractmethod
+    def get(self, task_id: model.Id, sample_ids: Sequence[model.Id]) -> model.Matrix | None:
+        """
+        Get the embeddings of samples of a task as the rows of a matrix.
+
+        Returns None if the embedding of any of the samples is not stored.
+        """
+        raise NotImplementedError()
+
     @abstractmethod
-    def aggregate_embeddings(self, embeddings: Sequence[model.Embedding]) -> model.Embedding:
+    def clear(self, task_id: model.Id) -> None:
+        """Remove all embeddings of a task."""
+        raise NotImplementedError()
+
+
+class AnnotationTaskCache(ABC):
+    """Cache of annotation tasks, which are read on every request but rarely change."""
+
+    @abstractmethod
+    def get(self, task_id: model.Id, version: int) -> model.AnnotationTask | None:
+        """Get the cached task if it has the given (current) version."""
+        raise NotImplementedError()
+
+    @abstractmethod
+    def put(self, task: model.AnnotationTask) -> None:
+        """Cache a task (as of its version)."""
         raise NotImplementedError()
 
 
@@ -23,8 +55,102 @@ class VectorSimilarityService(ABC):
     ) -> float:
         raise NotImplementedError()
 
+    @abstractmethod
+    def calculate_similarity_matrix(
+        self,
+        sample_embeddings: Sequence[model.Embedding] | model.Matrix,
+        class_embeddings: Sequence[model.Embedding],
+    ) -> model.Matrix:
+        """
+        Calculate the similarities of all samples (rows) to all classes (columns).
+
+        The sample embeddings are either a sequence of embeddings or the rows of a matrix.
+        """
+        raise NotImplementedError()
+
 
 class SamplingService(ABC):
     @abstractmethod
-    def sample(self, samples: Sequence[model.Sample]) -> model.Id | None:
+    def create_query(self, task_id: model.Id) -> repository.SampleQuery:
+        """
+        Create a query that lets the repository pick the next sample.
+
+        The first sample found by the query (that is not leased) is used as the next sample.
+        """
+        raise NotImplementedError()
+
+    def calculate_priorities(self, confidences: model.Matrix) -> model.Matrix | None:
+        """
+        Calculate the priorities of samples from their class confidences (one row per sample).
+
+        The priorities are persisted with the samples, so that queries can order by them.
+        Strategies that do not use priorities return None.
+        """
+        return None
+
+    def uses_priorities(self) -> bool:
+        """Whether the strategy calculates priorities (so that they need to be updated)."""
+        return False
+
+
+SamplingServiceFactory = Callable[[model.SamplingStrategy], SamplingService]
+
+
+class SimilarityIndex(ABC):
+    """Index for finding the samples of a task with the most similar embeddings."""
+
+    @abstractmethod
+    def add(self, task_id: model.Id, embeddings: Mapping[model.Id, model.Embedding]) -> None:
+        """
+        Add the embeddings of samples (by sample id) to the index of a task.
+
+        Adding the embedding of a sample again is allowed, but does not replace the first one.
+        """
+        raise NotImplementedError()
+
+    @abstractmethod
+    def search(
+        self, task_id: model.Id, embedding: model.Embedding, k: int
+    ) -> list[tuple[model.Id, float]]:
+        """
+        Find (approximately) the k samples of a task with the highest cosine similarity.
+
+        Returns the sample ids with their similarities, most similar first.
+        """
+        raise NotImplementedError()
+
+    @abstractmethod
+    def clear(self, task_id: model.Id) -> None:
+        """Remove all embeddings from the index of a task."""
+        raise NotImplementedError()
+
+
+class NotificationChannel(enum.StrEnum):
+    """Channels for notifying workers about new work."""
+
+    EMBEDDING_REQUESTED = "nlpanno_embedding"
+    ESTIMATION_REQUESTED = "nlpanno_estimation"
+
+
+class NotificationService(ABC):
+    """Service for notifying other processes (e.g. workers) about new work."""
+
+    @abstractmethod
+    def publish(self, channel: NotificationChannel) -> None:
+        """Notify all subscribers of the channel."""
+        raise NotImplementedError()
+
+    @abstractmethod
+    def subscribe(self, channel: NotificationChannel) -> None:
+        """Start receiving notifications of the channel."""
+        raise NotImplementedError()
+
+    @abstractmethod
+    def wait(self, channel: NotificationChannel, timeout: float) -> bool:
+        """
+        Block until a notification of the channel arrives or the timeout expires.
+
+        Notifications published since the last call are not lost. Returns whether a
+        notification was received.
+        """
         raise NotImplementedError()
@@ -1,9 +1,12 @@
 import abc
+from collections.abc import Callable
 from types import TracebackType
-from typing import Self
+from typing import Self, TypeVar
 
 from nlpanno.domain import repository
 
+_T = TypeVar("_T")
+
 
 class UnitOfWork(abc.ABC):
     """Base class for a unit of work."""
@@ -31,6 +34,11 @@ class UnitOfWork(abc.ABC):
     def annotation_tasks(self) -> repository.AnnotationTaskRepository:
         raise NotImplementedError()
 
+    @property
+    @abc.abstractmethod
+    def class_centroids(self) -> repository.ClassCentroidRepository:
+        raise NotImplementedError()
+
     @abc.abstractmethod
     def commit(self) -> None:
         raise NotImplementedError()
@@ -38,3 +46,18 @@ class UnitOfWork(abc.ABC):
     @abc.abstractmethod
     def create_tables(self) -> None:
         raise NotImplementedError()
+
+
+class AsyncUnitOfWork(abc.ABC):
+    """
+    Base class for a unit of work used by asyncio code (e.g. the API).
+
+    The repositories are synchronous, so a transaction is a function that gets an entered unit
+    of work (and commits it). Implementations run the transaction without blocking the event
+    loop while it waits for the database.
+    """
+
+    @abc.abstractmethod
+    async def run(self, transaction: Callable[[UnitOfWork], _T]) -> _T:
+        """Run the transaction and return its result; uncommitted changes are rolled back."""
+        raise NotImplementedError()
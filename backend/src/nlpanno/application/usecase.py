@@ -1,142 +1,925 @@
-import collections
+import asyncio
+import dataclasses
+import functools
+import itertools
 import logging
+import time
+from collections.abc import Iterable, Iterator, Mapping, Sequence
+from typing import TypeVar
+
+import torch
 
 from nlpanno.application import service, unitofwork
 from nlpanno.domain import model, repository
 
 _LOGGER = logging.getLogger(__name__)
 
+_ESTIMATION_BLOCK_SIZE = 4096
+
+_T = TypeVar("_T")
+
 
 class GetNextSampleUseCase:
+    """
+    Get the next sample to annotate.
+
+    The sample is leased for `lease_duration` seconds, so that concurrent annotators of the same
+    task get different samples. The lease is released when the sample is annotated.
+    """
+
     def __init__(
-        self, sampling_service: service.SamplingService, unit_of_work: unitofwork.UnitOfWork
+        self,
+        sampling_service_factory: service.SamplingServiceFactory,
+        default_sampling_strategy: model.SamplingStrategy,
+        unit_of_work: unitofwork.UnitOfWork,
+        lease_duration: float = 300.0,
     ) -> None:
-        self._sampling_service = sampling_service
+        self._sampling_service_factory = sampling_service_factory
+        self._default_sampling_strategy = default_sampling_strategy
         self._unit_of_work = unit_of_work
+        self._lease_duration = lease_duration
 
     def execute(self, task_id: model.Id) -> model.Sample | None:
         with self._unit_of_work as unit_of_work:
-            unlabeled_samples = unit_of_work.samples.find(
-                repository.SampleQuery(has_label=False, task_id=task_id)
+            sample, _ = _claim_next_sample(
+                unit_of_work,
+                self._sampling_service_factory,
+                self._default_sampling_strategy,
+                self._lease_duration,
+                task_id,
             )
-            sample_id = self._sampling_service.sample(unlabeled_samples)
-            if sample_id is None:
-                return None
-            sample = unit_of_work.samples.get_by_id(sample_id)
         return sample
 
 
+class AsyncGetNextSampleUseCase:
+    """
+    Get the next sample to annotate (see `GetNextSampleUseCase`) in asyncio code.
+
+    The sample is returned with its task, which is loaded in the same transaction anyway.
+    """
+
+    def __init__(
+        self,
+        sampling_service_factory: service.SamplingServiceFactory,
+        default_sampling_strategy: model.SamplingStrategy,
+        unit_of_work: unitofwork.AsyncUnitOfWork,
+        lease_duration: float = 300.0,
+        task_cache: service.AnnotationTaskCache | None = None,
+    ) -> None:
+        self._sampling_service_factory = sampling_service_factory
+        self._default_sampling_strategy = default_sampling_strategy
+        self._unit_of_work = unit_of_work
+        self._lease_duration = lease_duration
+        self._task_cache = task_cache
+
+    async def execute(self, task_id: model.Id) -> tuple[model.Sample | None, model.AnnotationTask]:
+        return await self._unit_of_work.run(
+            functools.partial(
+                _claim_next_sample,
+                sampling_service_factory=self._sampling_service_factory,
+                default_sampling_strategy=self._default_sampling_strategy,
+                lease_duration=self._lease_duration,
+                task_id=task_id,
+                task_cache=self._task_cache,
+            )
+        )
+
+
 class AnnotateSampleUseCase:
-    def __init__(self, unit_of_work: unitofwork.UnitOfWork) -> None:
+    def __init__(
+        self,
+        unit_of_work: unitofwork.UnitOfWork,
+        notification_service: service.NotificationService,
+    ) -> None:
         self._unit_of_work = unit_of_work
+        self._notification_service = notification_service
 
     def execute(self, sample_id: model.Id, text_class_id: model.Id | None) -> model.Sample:
         with self._unit_of_work as unit_of_work:
-            sample = unit_of_work.samples.get_by_id(sample_id)
-            if text_class_id is None:
-                sample.remove_label()
-            else:
-                annotation_task = unit_of_work.annotation_tasks.get_by_id(sample.annotation_task_id)
-                text_class = annotation_task.get_text_class_by_id(text_class_id)
-                sample.annotate(text_class)
-            unit_of_work.samples.update(sample)
-            unit_of_work.commit()
+            sample, _ = _annotate_sample(unit_of_work, sample_id, text_class_id)
+        self._notification_service.publish(service.NotificationChannel.ESTIMATION_REQUESTED)
         return sample
 
 
+class AsyncAnnotateSampleUseCase:
+    """
+    Annotate a sample (see `AnnotateSampleUseCase`) in asyncio code.
+
+    The sample is returned with its task, which is loaded in the same transaction anyway.
+    """
+
+    def __init__(
+        self,
+        unit_of_work: unitofwork.AsyncUnitOfWork,
+        notification_service: service.NotificationService,
+        task_cache: service.AnnotationTaskCache | None = None,
+    ) -> None:
+        self._unit_of_work = unit_of_work
+        self._notification_service = notification_service
+        self._task_cache = task_cache
+
+    async def execute(
+        self, sample_id: model.Id, text_class_id: model.Id | None
+    ) -> tuple[model.Sample, model.AnnotationTask]:
+        sample, annotation_task = await self._unit_of_work.run(
+            functools.partial(
+                _annotate_sample,
+                sample_id=sample_id,
+                text_class_id=text_class_id,
+                task_cache=self._task_cache,
+            )
+        )
+        # Publishing may need a database round trip (e.g. NOTIFY on PostgreSQL).
+        await asyncio.to_thread(
+            self._notification_service.publish, service.NotificationChannel.ESTIMATION_REQUESTED
+        )
+        return sample, annotation_task
+
+
+class AnnotateSamplesUseCase:
+    """Annotate many samples of a task in a single transaction."""
+
+    def __init__(
+        self,
+        unit_of_work: unitofwork.UnitOfWork,
+        notification_service: service.NotificationService,
+    ) -> None:
+        self._unit_of_work = unit_of_work
+        self._notification_service = notification_service
+
+    def execute(self, task_id: model.Id, labels: Mapping[model.Id, model.Id | None]) -> None:
+        """Set the text classes (by id) of the samples (by id); None removes the label."""
+        if len(labels) == 0:
+            return
+        with self._unit_of_work as unit_of_work:
+            _annotate_samples(unit_of_work, task_id, labels)
+        self._notification_service.publish(service.NotificationChannel.ESTIMATION_REQUESTED)
+
+
+class AsyncAnnotateSamplesUseCase:
+    """Annotate many samples of a task (see `AnnotateSamplesUseCase`) in asyncio code."""
+
+    def __init__(
+        self,
+        unit_of_work: unitofwork.AsyncUnitOfWork,
+        notification_service: service.NotificationService,
+        task_cache: service.AnnotationTaskCache | None = None,
+    ) -> None:
+        self._unit_of_work = unit_of_work
+        self._notification_service = notification_service
+        self._task_cache = task_cache
+
+    async def execute(self, task_id: model.Id, labels: Mapping[model.Id, model.Id | None]) -> None:
+        """Set the text classes (by id) of the samples (by id); None removes the label."""
+        if len(labels) == 0:
+            return
+        await self._unit_of_work.run(
+            functools.partial(
+                _annotate_samples, task_id=task_id, labels=labels, task_cache=self._task_cache
+            )
+        )
+        await asyncio.to_thread(
+            self._notification_service.publish, service.NotificationChannel.ESTIMATION_REQUESTED
+        )
+
+
+class CreateAnnotationTaskUseCase:
+    def __init__(self, unit_of_work: unitofwork.UnitOfWork) -> None:
+        self._unit_of_work = unit_of_work
+
+    def execute(self, name: str, max_estimates: int | None = None) -> model.AnnotationTask:
+        with self._unit_of_work as unit_of_work:
+            annotation_task = model.AnnotationTask.create(name, max_estimates)
+            unit_of_work.annotation_tasks.create(annotation_task)
+            unit_of_work.commit()
+        return annotation_task
+
+
+class ImportSamplesUseCase:
+    """
+    Import samples into a task in bounded batches.
+
+    Every batch is inserted with bulk inserts and committed on its own, so that memory usage
+    does not depend on the number of samples. Text classes are created for unknown labels.
+    """
+
+    def __init__(
+        self,
+        unit_of_work: unitofwork.UnitOfWork,
+        notification_service: service.NotificationService,
+        batch_size: int = 10000,
+    ) -> None:
+        self._unit_of_work = unit_of_work
+        self._notification_service = notification_service
+        self._batch_size = batch_size
+
+    def execute(
+        self,
+        task_id: model.Id,
+        records: Iterable[tuple[str, str | None]],
+        annotate: bool = True,
+    ) -> Iterator[int]:
+        """
+        Import the records (text and optional label) and yield the size of each batch.
+
+        If `annotate` is False, the labels only define the text classes of the task, but the
+        samples are left unlabeled.
+        """
+        for batch in _batched(records, self._batch_size):
+            with self._unit_of_work as unit_of_work:
+                annotation_task = unit_of_work.annotation_tasks.get_by_id(task_id)
+                text_classes = self._get_or_create_text_classes(
+                    unit_of_work, annotation_task, {label for _, label in batch if label}
+                )
+                samples = []
+                for text, label in batch:
+                    sample = model.Sample.create(task_id, text)
+                    if annotate and label:
+                        sample.annotate(text_classes[label])
+                    samples.append(sample)
+                unit_of_work.samples.create_many(samples)
+                unit_of_work.commit()
+            self._notification_service.publish(service.NotificationChannel.EMBEDDING_REQUESTED)
+            yield len(batch)
+
+    def _get_or_create_text_classes(
+        self,
+        unit_of_work: unitofwork.UnitOfWork,
+        annotation_task: model.AnnotationTask,
+        names: set[str],
+    ) -> dict[str, model.TextClass]:
+        text_classes = {text_class.name: text_class for text_class in annotation_task.text_classes}
+        new_names = names - text_classes.keys()
+        for name in sorted(new_names):
+            text_classes[name] = annotation_task.create_text_class(name)
+        if len(new_names) > 0:
+            unit_of_work.annotation_tasks.update(annotation_task)
+        return text_classes
+
+
 class EmbedAllSamplesUseCase:
+    """
+    Embed all samples that do not have an embedding yet.
+
+    The samples are processed in chunks that are claimed, embedded and committed one after the
+    other, so that memory usage does not depend on the number of samples and a crash only loses
+    the work of the current chunk. Claiming lets several workers embed disjoint chunks; the
+    chunks of crashed workers are claimed again after `claim_duration` seconds.
+
+    The embeddings are added to the embedding store and the similarity index (if any) before
+    they are committed, so that a crash can only add an embedding to them twice, but never
+    lose it.
+    """
+
     def __init__(
-        self, embedding_service: service.EmbeddingService, unit_of_work: unitofwork.UnitOfWork
+        self,
+        embedding_service: service.EmbeddingService,
+        unit_of_work: unitofwork.UnitOfWork,
+        notification_service: service.NotificationService,
+        chunk_size: int = 256,
+        claim_duration: float = 600.0,
+        similarity_index: service.SimilarityIndex | None = None,
+        embedding_store: service.EmbeddingStore | None = None,
     ) -> None:
         self._embedding_service = embedding_service
         self._unit_of_work = unit_of_work
+        self._notification_service = notification_service
+        self._chunk_size = chunk_size
+        self._claim_duration = claim_duration
+        self._similarity_index = similarity_index
+        self._embedding_store = embedding_store
 
     def execute(self) -> bool:
+        """Embed the samples and return whether any work was done."""
         with self._unit_of_work as unit_of_work:
-            samples = unit_of_work.samples.find(repository.SampleQuery(has_embedding=False))
+            remaining = unit_of_work.samples.count(repository.SampleQuery(has_embedding=False))
+        if remaining == 0:
+            return False
+        _LOGGER.info(f"Embedding {remaining} samples")
+        start_time = time.perf_counter()
+        embedded = 0
+        for chunk_size in self._embed_chunks():
+            # Estimation can already start with the committed chunks.
+            self._notification_service.publish(service.NotificationChannel.ESTIMATION_REQUESTED)
+            embedded += chunk_size
+            remaining = max(remaining - chunk_size, 0)
+            rate = embedded / (time.perf_counter() - start_time)
+            _LOGGER.info(
+                f"Embedded {embedded} samples ({rate:.1f} samples/s), {remaining} remaining"
+            )
+        return embedded > 0
+
+    def _embed_chunks(self) -> Iterator[int]:
+        """Embed and commit the samples chunk by chunk and yield the size of each chunk."""
+        query = repository.SampleQuery(has_embedding=False, limit=self._chunk_size)
+        while True:
+            # The claim is committed right away, so that concurrent workers skip the samples.
+            with self._unit_of_work as unit_of_work:
+                samples = unit_of_work.samples.claim_many(query, self._claim_duration)
+                unit_of_work.commit()
             if len(samples) == 0:
-                return False
+                return
             embeddings = self._embedding_service.embed_samples(samples)
-            for sample, embedding in zip(samples, embeddings):
-                sample.embed(embedding)
-                unit_of_work.samples.update(sample)
-            unit_of_work.commit()
-        return True
+            if self._embedding_store is not None:
+                _add_by_task(self._embedding_store, samples, embeddings)
+            if self._similarity_index is not None:
+                _add_by_task(self._similarity_index, samples, embeddings)
+            with self._unit_of_work as unit_of_work:
+                self._save_embeddings(unit_of_work, samples, embeddings)
+                unit_of_work.commit()
+            yield len(samples)
+
+    def _save_embeddings(
+        self,
+        unit_of_work: unitofwork.UnitOfWork,
+        samples: Sequence[model.Sample],
+        embeddings: Sequence[model.Embedding],
+    ) -> None:
+        unit_of_work.samples.update_embeddings(
+            {sample.id: embedding for sample, embedding in zip(samples, embeddings)}
+        )
+        # Newly embedded labeled samples move the class centroids. The labels are loaded again
+        # (and locked), because the samples may have been annotated since they were claimed.
+        labeled_samples = unit_of_work.samples.find(
+            repository.SampleQuery(
+                has_label=True,
+                ids=tuple(sample.id for sample in samples),
+                with_estimates=False,
+                for_update=True,
+            )
+        )
+        _update_class_centroids(
+            unit_of_work,
+            (
+                change
+                for sample in labeled_samples
+                for change in _get_centroid_changes(sample.embedding, None, sample.text_class)
+            ),
+        )
+        for task_id in {sample.annotation_task_id for sample in labeled_samples}:
+            unit_of_work.annotation_tasks.increment_label_version(task_id)
+
+
+@dataclasses.dataclass
+class _ClassCentroid:
+    """Centroid of the embeddings of a class' labeled samples."""
+
+    embedding: model.Embedding
+    # Incremented whenever the centroid moves beyond the tolerance.
+    version: int = 0
 
 
 class EstimateSamplesUseCase:
+    """
+    Estimate the classes of the unlabeled samples by the similarity to the class centroids.
+
+    The use case remembers the label version of each task and the centroids of its classes, so
+    that repeated executions only do work if labels changed or samples were newly embedded.
+    The centroids are maintained incrementally by the annotation and embedding use cases, so
+    that a changed label only costs the similarities to the moved centroids. The embeddings of
+    the samples are read from the embedding store (if any) as one matrix per block.
+
+    For tasks with a maximum number of estimates, only the top estimates of each sample are
+    stored. Then all similarities are calculated again if any centroid moved, because a class
+    without a stored estimate may have become one of the top classes.
+    """
+
     def __init__(
         self,
-        embedding_aggregation_service: service.EmbeddingAggregationService,
         vector_similarity_service: service.VectorSimilarityService,
+        sampling_service_factory: service.SamplingServiceFactory,
         unit_of_work: unitofwork.UnitOfWork,
+        default_sampling_strategy: model.SamplingStrategy = model.SamplingStrategy.RANDOM,
+        centroid_tolerance: float = 0.0,
+        embedding_store: service.EmbeddingStore | None = None,
     ) -> None:
-        self._embedding_aggregation_service = embedding_aggregation_service
         self._vector_similarity_service = vector_similarity_service
+        self._sampling_service_factory = sampling_service_factory
         self._unit_of_work = unit_of_work
+        self._default_sampling_strategy = default_sampling_strategy
+        self._centroid_tolerance = centroid_tolerance
+        self._embedding_store = embedding_store
+        self._label_versions: dict[model.Id, int] = {}
+        self._max_estimates: dict[model.Id, int | None] = {}
+        self._centroids: dict[model.Id, dict[model.Id, _ClassCentroid]] = {}
 
-    def execute(self) -> None:
+    def execute(self) -> bool:
+        """Update the estimates and return whether any work was done."""
+        did_work = False
         with self._unit_of_work as unit_of_work:
-            class_embeddings = self._calculate_class_embeddings(unit_of_work)
-            query = repository.SampleQuery(has_label=False, has_embedding=True)
-            samples = unit_of_work.samples.find(query)
-            for sample in samples:
-                _LOGGER.debug(f"Estimating sample {sample.id}")
-                assert sample.embedding is not None
-                class_estimates = self._calculate_class_estimates(
-                    sample.embedding, class_embeddings
-                )
-                sample.add_class_estimates(class_estimates)
-                unit_of_work.samples.update(sample)
+            for annotation_task in unit_of_work.annotation_tasks.find():
+                did_work = self._estimate_task(unit_of_work, annotation_task) or did_work
             unit_of_work.commit()
+        return did_work
 
-    def _calculate_class_embeddings(
-        self, unit_of_work: unitofwork.UnitOfWork
-    ) -> dict[str, model.Embedding]:
-        samples = unit_of_work.samples.find(
-            repository.SampleQuery(has_embedding=True, has_label=True)
+    def _estimate_task(
+        self, unit_of_work: unitofwork.UnitOfWork, annotation_task: model.AnnotationTask
+    ) -> bool:
+        task_id = annotation_task.id
+        sampling_service = self._sampling_service_factory(
+            annotation_task.sampling_strategy or self._default_sampling_strategy
+        )
+        max_estimates = annotation_task.max_estimates
+        changed_class_ids: Sequence[model.Id] = ()
+        removed_class_ids: Sequence[model.Id] = ()
+        if self._label_versions.get(task_id) != annotation_task.label_version:
+            changed_class_ids, removed_class_ids = self._update_centroids(unit_of_work, task_id)
+            self._label_versions[task_id] = annotation_task.label_version
+        all_class_ids = tuple(self._centroids.get(task_id, {}).keys())
+        if self._max_estimates.get(task_id, max_estimates) != max_estimates or (
+            max_estimates is not None and len(changed_class_ids) + len(removed_class_ids) > 0
+        ):
+            changed_class_ids = all_class_ids
+        self._max_estimates[task_id] = max_estimates
+        # Samples that were estimated before only need the estimates of the changed classes.
+        estimated_query = repository.SampleQuery(
+            has_label=False, has_embedding=True, has_estimates=True, task_id=task_id
+        )
+        did_work = self._estimate_samples(
+            unit_of_work,
+            estimated_query,
+            task_id,
+            sampling_service,
+            max_estimates,
+            changed_class_ids,
+            removed_class_ids,
+        )
+        # Newly embedded (or unlabeled) samples need the estimates of all classes.
+        unestimated_query = repository.SampleQuery(
+            has_label=False, has_embedding=True, has_estimates=False, task_id=task_id
+        )
+        return (
+            self._estimate_samples(
+                unit_of_work,
+                unestimated_query,
+                task_id,
+                sampling_service,
+                max_estimates,
+                all_class_ids,
+            )
+            or did_work
+        )
+
+    def _estimate_samples(
+        self,
+        unit_of_work: unitofwork.UnitOfWork,
+        query: repository.SampleQuery,
+        task_id: model.Id,
+        sampling_service: service.SamplingService,
+        max_estimates: int | None,
+        class_ids: Sequence[model.Id],
+        removed_class_ids: Sequence[model.Id] = (),
+    ) -> bool:
+        if len(class_ids) == 0 and len(removed_class_ids) == 0:
+            return False
+        unit_of_work.samples.remove_estimates(removed_class_ids)
+        # Only the ids of the samples are needed (and the embeddings if there is no store).
+        query = dataclasses.replace(
+            query, with_embedding=self._embedding_store is None, with_estimates=False
+        )
+        samples = unit_of_work.samples.iter_find(query, _ESTIMATION_BLOCK_SIZE)
+        did_work = False
+        for block in _batched(samples, _ESTIMATION_BLOCK_SIZE):
+            _LOGGER.debug(f"Estimating {len(block)} samples of task {task_id}")
+            sample_ids = tuple(sample.id for sample in block)
+            confidences = self._estimate_block(unit_of_work, task_id, block, class_ids)
+            if max_estimates is None:
+                unit_of_work.samples.update_estimates(sample_ids, class_ids, confidences)
+            else:
+                unit_of_work.samples.replace_estimates(
+                    sample_ids, *_select_top_estimates(class_ids, confidences, max_estimates)
+                )
+            self._prioritize_block(
+                unit_of_work, task_id, sample_ids, class_ids, confidences, sampling_service
+            )
+            did_work = True
+        return did_work
+
+    def _estimate_block(
+        self,
+        unit_of_work: unitofwork.UnitOfWork,
+        task_id: model.Id,
+        samples: Sequence[model.Sample],
+        class_ids: Sequence[model.Id],
+    ) -> model.Matrix:
+        """Calculate the confidences of the samples (rows) for the classes (columns)."""
+        if len(class_ids) == 0:
+            return torch.zeros(len(samples), 0)
+        centroids = self._centroids[task_id]
+        sample_embeddings = self._load_sample_embeddings(unit_of_work, task_id, samples)
+        return self._vector_similarity_service.calculate_similarity_matrix(
+            sample_embeddings, tuple(centroids[class_id].embedding for class_id in class_ids)
+        )
+
+    def _load_sample_embeddings(
+        self,
+        unit_of_work: unitofwork.UnitOfWork,
+        task_id: model.Id,
+        samples: Sequence[model.Sample],
+    ) -> Sequence[model.Embedding] | model.Matrix:
+        sample_ids = tuple(sample.id for sample in samples)
+        if self._embedding_store is None:
+            embeddings = {sample.id: sample.embedding for sample in samples}
+        else:
+            matrix = self._embedding_store.get(task_id, sample_ids)
+            if matrix is not None:
+                return matrix
+            # Samples embedded before the store existed (or by another model) are only in the
+            # database.
+            embeddings = {
+                sample.id: sample.embedding
+                for sample in unit_of_work.samples.find(
+                    repository.SampleQuery(ids=sample_ids, with_estimates=False)
+                )
+            }
+        sample_embeddings = []
+        for sample_id in sample_ids:
+            embedding = embeddings.get(sample_id)
+            assert embedding is not None
+            sample_embeddings.append(embedding)
+        return sample_embeddings
+
+    def _prioritize_block(
+        self,
+        unit_of_work: unitofwork.UnitOfWork,
+        task_id: model.Id,
+        sample_ids: Sequence[model.Id],
+        class_ids: Sequence[model.Id],
+        confidences: model.Matrix,
+        sampling_service: service.SamplingService,
+    ) -> None:
+        if not sampling_service.uses_priorities():
+            # E.g. random sampling, the confidences need not be read and priorities not written.
+            return
+        all_class_ids = tuple(self._centroids[task_id].keys())
+        if tuple(class_ids) != all_class_ids:
+            # The estimates of the other classes did not change and are read (with the ones
+            # just written).
+            confidences = unit_of_work.samples.get_confidences(sample_ids, all_class_ids)
+        priorities = sampling_service.calculate_priorities(confidences)
+        unit_of_work.samples.update_priorities(
+            dict(
+                zip(
+                    sample_ids,
+                    [None] * len(sample_ids) if priorities is None else priorities.tolist(),
+                )
+            )
         )
-        embeddings_by_class: dict[str, list[model.Embedding]] = collections.defaultdict(list)
 
-        for sample in samples:
-            assert sample.embedding is not None
-            assert sample.text_class is not None
-            embeddings_by_class[sample.text_class.id].append(sample.embedding)
+    def _update_centroids(
+        self, unit_of_work: unitofwork.UnitOfWork, task_id: model.Id
+    ) -> tuple[tuple[model.Id, ...], tuple[model.Id, ...]]:
+        """Recalculate the centroids and return the ids of the changed and removed classes."""
+        previous_centroids = self._centroids.get(task_id, {})
+        centroids: dict[model.Id, _ClassCentroid] = {}
+        changed_class_ids = []
+        for class_id, embedding in self._load_class_embeddings(unit_of_work, task_id).items():
+            previous_centroid = previous_centroids.get(class_id)
+            if previous_centroid is None:
+                centroids[class_id] = _ClassCentroid(embedding)
+                changed_class_ids.append(class_id)
+            elif self._centroid_moved(previous_centroid.embedding, embedding):
+                centroids[class_id] = _ClassCentroid(embedding, previous_centroid.version + 1)
+                changed_class_ids.append(class_id)
+            else:
+                centroids[class_id] = previous_centroid
+        removed_class_ids = tuple(
+            class_id for class_id in previous_centroids if class_id not in centroids
+        )
+        self._centroids[task_id] = centroids
+        return tuple(changed_class_ids), removed_class_ids
+
+    def _centroid_moved(self, previous: model.Embedding, current: model.Embedding) -> bool:
+        similarity = self._vector_similarity_service.calculate_similarity(current, previous)
+        return 1.0 - similarity > self._centroid_tolerance
 
+    def _load_class_embeddings(
+        self, unit_of_work: unitofwork.UnitOfWork, task_id: model.Id
+    ) -> dict[str, model.Embedding]:
         return {
-            text_class: self._embedding_aggregation_service.aggregate_embeddings(embeddings)
-            for text_class, embeddings in embeddings_by_class.items()
+            centroid.text_class_id: centroid.mean()
+            for centroid in unit_of_work.class_centroids.find(task_id)
+            if centroid.count > 0
         }
 
-    def _calculate_class_estimates(
-        self, sample_embedding: model.Embedding, class_embeddings: dict[str, model.Embedding]
-    ) -> tuple[model.ClassEstimate, ...]:
-        class_estimates = []
-        for text_class, class_embedding in class_embeddings.items():
-            similarity = self._vector_similarity_service.calculate_similarity(
-                sample_embedding, class_embedding
-            )
-            class_estimate = model.ClassEstimate.create(
-                text_class_id=text_class, confidence=similarity
-            )
-            class_estimates.append(class_estimate)
-        return tuple(class_estimates)
 
+def _select_top_estimates(
+    class_ids: Sequence[model.Id], confidences: model.Matrix, max_estimates: int
+) -> tuple[list[tuple[model.Id, ...]], model.Matrix, list[float | None]]:
+    """
+    Select the most confident classes of each sample (row) with their confidences.
 
-class FetchAnnotationTaskUseCase:
-    def __init__(self, unit_of_work: unitofwork.UnitOfWork) -> None:
-        # TODO: this should probably go directly through the repository.
+    Also returns the mean confidence of the other classes of each sample (None if there are no
+    other classes).
+    """
+    k = min(max_estimates, len(class_ids))
+    top_confidences, top_indices = torch.topk(confidences, k, dim=1)
+    top_class_ids = [tuple(class_ids[index] for index in row) for row in top_indices.tolist()]
+    rest_count = len(class_ids) - k
+    if rest_count == 0:
+        return top_class_ids, top_confidences, [None] * len(top_class_ids)
+    rest_confidences = (confidences.sum(dim=1) - top_confidences.sum(dim=1)) / rest_count
+    return top_class_ids, top_confidences, rest_confidences.tolist()
+
+
+class AsyncFindSimilarSamplesUseCase:
+    """Find the samples of the same task with the embeddings most similar to a sample's."""
+
+    def __init__(
+        self, unit_of_work: unitofwork.AsyncUnitOfWork, similarity_index: service.SimilarityIndex
+    ) -> None:
         self._unit_of_work = unit_of_work
+        self._similarity_index = similarity_index
 
-    def execute(self, task_id: model.Id) -> model.AnnotationTask:
-        with self._unit_of_work as unit_of_work:
-            return unit_of_work.annotation_tasks.get_by_id(task_id)
+    async def execute(self, sample_id: model.Id, k: int) -> list[tuple[model.Sample, float]]:
+        """Find up to k similar samples with their similarities (none if not embedded yet)."""
+        sample = await self._unit_of_work.run(
+            lambda unit_of_work: unit_of_work.samples.get_by_id(sample_id)
+        )
+        if sample.embedding is None:
+            return []
+        # The search reads the index files and computes the similarities outside the event loop.
+        neighbors = await asyncio.to_thread(_search_neighbors, self._similarity_index, sample, k)
+        neighbor_ids = tuple(neighbor_id for neighbor_id, _ in neighbors)
+        samples_by_id = await self._unit_of_work.run(
+            functools.partial(_find_samples_by_id, sample_ids=neighbor_ids)
+        )
+        return _join_neighbors(neighbors, samples_by_id)
 
 
-class FetchAllAnnotationTasksUseCase:
-    def __init__(self, unit_of_work: unitofwork.UnitOfWork) -> None:
+class RebuildSimilarityIndexUseCase:
+    """Rebuild the similarity index of every task from the embedded samples."""
+
+    def __init__(
+        self,
+        unit_of_work: unitofwork.UnitOfWork,
+        similarity_index: service.SimilarityIndex,
+        batch_size: int = 10000,
+    ) -> None:
         self._unit_of_work = unit_of_work
+        self._similarity_index = similarity_index
+        self._batch_size = batch_size
 
-    def execute(self) -> list[model.AnnotationTask]:
-        with self._unit_of_work as unit_of_work:
-            return list(unit_of_work.annotation_tasks.find())
+    def execute(self) -> Iterator[int]:
+        """Rebuild the index and yield the number of samples of each added batch."""
+        return _rebuild_by_task(self._unit_of_work, self._similarity_index, self._batch_size)
+
+
+class RebuildEmbeddingStoreUseCase:
+    """Rebuild the embedding store of every task from the embedded samples."""
+
+    def __init__(
+        self,
+        unit_of_work: unitofwork.UnitOfWork,
+        embedding_store: service.EmbeddingStore,
+        batch_size: int = 10000,
+    ) -> None:
+        self._unit_of_work = unit_of_work
+        self._embedding_store = embedding_store
+        self._batch_size = batch_size
+
+    def execute(self) -> Iterator[int]:
+        """Rebuild the store and yield the number of samples of each added batch."""
+        return _rebuild_by_task(self._unit_of_work, self._embedding_store, self._batch_size)
+
+
+class AsyncFetchAnnotationTaskUseCase:
+    def __init__(
+        self,
+        unit_of_work: unitofwork.AsyncUnitOfWork,
+        task_cache: service.AnnotationTaskCache | None = None,
+    ) -> None:
+        self._unit_of_work = unit_of_work
+        self._task_cache = task_cache
+
+    async def execute(self, task_id: model.Id) -> model.AnnotationTask:
+        return await self._unit_of_work.run(
+            functools.partial(_get_annotation_task, task_id=task_id, task_cache=self._task_cache)
+        )
+
+
+class AsyncFetchAllAnnotationTasksUseCase:
+    def __init__(self, unit_of_work: unitofwork.AsyncUnitOfWork) -> None:
+        self._unit_of_work = unit_of_work
+
+    async def execute(self) -> list[model.AnnotationTask]:
+        return await self._unit_of_work.run(
+            lambda unit_of_work: list(unit_of_work.annotation_tasks.find())
+        )
+
+
+def _get_annotation_task(
+    unit_of_work: unitofwork.UnitOfWork,
+    task_id: model.Id,
+    task_cache: service.AnnotationTaskCache | None = None,
+) -> model.AnnotationTask:
+    """Get the task from the cache if it is up to date, otherwise load (and cache) it."""
+    if task_cache is None:
+        return unit_of_work.annotation_tasks.get_by_id(task_id)
+    # Cheaper than loading the task with its text classes.
+    version = unit_of_work.annotation_tasks.get_version(task_id)
+    annotation_task = task_cache.get(task_id, version)
+    if annotation_task is None:
+        annotation_task = unit_of_work.annotation_tasks.get_by_id(task_id)
+        task_cache.put(annotation_task)
+    return annotation_task
+
+
+def _claim_next_sample(
+    unit_of_work: unitofwork.UnitOfWork,
+    sampling_service_factory: service.SamplingServiceFactory,
+    default_sampling_strategy: model.SamplingStrategy,
+    lease_duration: float,
+    task_id: model.Id,
+    task_cache: service.AnnotationTaskCache | None = None,
+) -> tuple[model.Sample | None, model.AnnotationTask]:
+    """Lease the next sample picked by the sampling strategy of the task."""
+    annotation_task = _get_annotation_task(unit_of_work, task_id, task_cache)
+    sampling_service = sampling_service_factory(
+        annotation_task.sampling_strategy or default_sampling_strategy
+    )
+    # The annotator needs the text, the label and the estimates of the sample.
+    query = dataclasses.replace(sampling_service.create_query(task_id), with_embedding=False)
+    sample = unit_of_work.samples.claim(query, lease_duration)
+    unit_of_work.commit()
+    return sample, annotation_task
+
+
+def _annotate_sample(
+    unit_of_work: unitofwork.UnitOfWork,
+    sample_id: model.Id,
+    text_class_id: model.Id | None,
+    task_cache: service.AnnotationTaskCache | None = None,
+) -> tuple[model.Sample, model.AnnotationTask]:
+    """Label (or unlabel) the sample, release its lease and update the class centroids."""
+    # Locked, so that the centroid changes are derived from the current label and embedding.
+    sample = unit_of_work.samples.get_by_id(sample_id, for_update=True)
+    previous_text_class = sample.text_class
+    annotation_task = _get_annotation_task(unit_of_work, sample.annotation_task_id, task_cache)
+    if text_class_id is None:
+        sample.remove_label()
+        # The estimates went stale while the sample was labeled.
+        sample.clear_class_estimates()
+    else:
+        text_class = annotation_task.get_text_class_by_id(text_class_id)
+        sample.annotate(text_class)
+    unit_of_work.samples.update(sample)
+    _update_class_centroids(
+        unit_of_work,
+        _get_centroid_changes(sample.embedding, previous_text_class, sample.text_class),
+    )
+    unit_of_work.samples.release(sample_id)
+    unit_of_work.annotation_tasks.increment_label_version(sample.annotation_task_id)
+    unit_of_work.commit()
+    return sample, annotation_task
+
+
+def _annotate_samples(
+    unit_of_work: unitofwork.UnitOfWork,
+    task_id: model.Id,
+    labels: Mapping[model.Id, model.Id | None],
+    task_cache: service.AnnotationTaskCache | None = None,
+) -> None:
+    """Label (or unlabel) the samples of the task and update the class centroids."""
+    annotation_task = _get_annotation_task(unit_of_work, task_id, task_cache)
+    text_classes = {
+        sample_id: (
+            None if text_class_id is None else annotation_task.get_text_class_by_id(text_class_id)
+        )
+        for sample_id, text_class_id in labels.items()
+    }
+    # All samples are locked (not only the embedded ones), so that the centroid changes are
+    # derived from the current labels and embeddings.
+    samples = unit_of_work.samples.find(
+        repository.SampleQuery(
+            task_id=task_id, ids=tuple(labels), with_estimates=False, for_update=True
+        )
+    )
+    # Collected before updating the labels, which may change the found samples in place.
+    centroid_changes = [
+        change
+        for sample in samples
+        for change in _get_centroid_changes(
+            sample.embedding, sample.text_class, text_classes[sample.id]
+        )
+    ]
+    unit_of_work.samples.update_labels(task_id, text_classes)
+    _update_class_centroids(unit_of_work, centroid_changes)
+    unit_of_work.annotation_tasks.increment_label_version(task_id)
+    unit_of_work.commit()
+
+
+def _search_neighbors(
+    similarity_index: service.SimilarityIndex, sample: model.Sample, k: int
+) -> list[tuple[model.Id, float]]:
+    """Search the k samples most similar to the (embedded) sample, excluding itself."""
+    assert sample.embedding is not None
+    # One more, because the sample itself is usually the most similar one.
+    return [
+        (neighbor_id, similarity)
+        for neighbor_id, similarity in similarity_index.search(
+            sample.annotation_task_id, sample.embedding, k + 1
+        )
+        if neighbor_id != sample.id
+    ][:k]
+
+
+def _find_samples_by_id(
+    unit_of_work: unitofwork.UnitOfWork, sample_ids: Sequence[model.Id]
+) -> dict[model.Id, model.Sample]:
+    return {
+        sample.id: sample
+        for sample in unit_of_work.samples.find(
+            repository.SampleQuery(ids=tuple(sample_ids), with_embedding=False)
+        )
+    }
+
+
+def _join_neighbors(
+    neighbors: Sequence[tuple[model.Id, float]], samples_by_id: Mapping[model.Id, model.Sample]
+) -> list[tuple[model.Sample, float]]:
+    """Pair the found samples with their similarities (skipping samples deleted meanwhile)."""
+    return [
+        (samples_by_id[neighbor_id], similarity)
+        for neighbor_id, similarity in neighbors
+        if neighbor_id in samples_by_id
+    ]
+
+
+def _add_by_task(
+    target: service.SimilarityIndex | service.EmbeddingStore,
+    samples: Sequence[model.Sample],
+    embeddings: Sequence[model.Embedding],
+) -> None:
+    """Add the embeddings of the samples to the similarity index or store of their tasks."""
+    embeddings_by_task: dict[model.Id, dict[model.Id, model.Embedding]] = {}
+    for sample, embedding in zip(samples, embeddings):
+        embeddings_by_task.setdefault(sample.annotation_task_id, {})[sample.id] = embedding
+    for task_id, task_embeddings in embeddings_by_task.items():
+        target.add(task_id, task_embeddings)
+
+
+def _rebuild_by_task(
+    unit_of_work: unitofwork.UnitOfWork,
+    target: service.SimilarityIndex | service.EmbeddingStore,
+    batch_size: int,
+) -> Iterator[int]:
+    """Clear and refill the similarity index or store of every task in batches."""
+    with unit_of_work:
+        task_ids = tuple(
+            annotation_task.id for annotation_task in unit_of_work.annotation_tasks.find()
+        )
+    for task_id in task_ids:
+        target.clear(task_id)
+        with unit_of_work:
+            samples = unit_of_work.samples.iter_find(
+                repository.SampleQuery(has_embedding=True, task_id=task_id, with_estimates=False),
+                batch_size,
+            )
+            for batch in _batched(samples, batch_size):
+                embeddings = []
+                for sample in batch:
+                    assert sample.embedding is not None
+                    embeddings.append(sample.embedding)
+                _add_by_task(target, batch, embeddings)
+                yield len(batch)
+
+
+def _get_centroid_changes(
+    embedding: model.Embedding | None,
+    previous_text_class: model.TextClass | None,
+    text_class: model.TextClass | None,
+) -> Iterator[tuple[model.TextClass, model.Embedding, int]]:
+    """Get the embeddings to remove (-1) from or add (1) to the class centroids on relabeling."""
+    if embedding is None:
+        return
+    previous_id = None if previous_text_class is None else previous_text_class.id
+    if previous_id == (None if text_class is None else text_class.id):
+        return
+    if previous_text_class is not None:
+        yield previous_text_class, embedding, -1
+    if text_class is not None:
+        yield text_class, embedding, 1
+
+
+def _update_class_centroids(
+    unit_of_work: unitofwork.UnitOfWork,
+    changes: Iterable[tuple[model.TextClass, model.Embedding, int]],
+) -> None:
+    """Apply the changes, adding up the changes of each class before updating its centroid."""
+    sums: dict[model.Id, tuple[model.TextClass, model.Embedding, int]] = {}
+    for text_class, embedding, sign in changes:
+        if text_class.id in sums:
+            _, embedding_sum, count = sums[text_class.id]
+        else:
+            embedding_sum, count = torch.zeros_like(embedding, dtype=torch.float64), 0
+        sums[text_class.id] = (text_class, embedding_sum + sign * embedding.double(), count + sign)
+    for text_class, embedding_sum, count in sums.values():
+        unit_of_work.class_centroids.add_embeddings(text_class, embedding_sum, count)
+
+
+def _batched(items: Iterable[_T], size: int) -> Iterator[tuple[_T, ...]]:
+    """Split the items into tuples of the given size (the last one may be shorter)."""
+    iterator = iter(items)
+    while batch := tuple(itertools.islice(iterator, size)):
+        yield batch
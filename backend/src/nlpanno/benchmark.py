@@ -0,0 +1,217 @@
+"""Benchmarks of the background workers, the embedding service and the API."""
+
+import dataclasses
+import http.client
+import json
+import multiprocessing
+import pathlib
+import tempfile
+import threading
+import time
+import urllib.parse
+from collections.abc import Sequence
+
+import sqlalchemy
+import torch
+
+from nlpanno.adapters import notification
+from nlpanno.adapters.persistence import sqlalchemy as persistence
+from nlpanno.application import service, usecase
+from nlpanno.domain import model
+
+
+@dataclasses.dataclass(frozen=True)
+class EmbeddingWorkersResult:
+    """Result of embedding all samples with several worker processes."""
+
+    workers: int
+    seconds: float
+    # Number of embeddings computed by all workers (more than the samples if work was repeated).
+    embedded: int
+
+
+@dataclasses.dataclass(frozen=True)
+class EmbeddingParity:
+    """Cosine similarities between the embeddings of a reference and a candidate model."""
+
+    mean_cosine: float
+    min_cosine: float
+
+
+@dataclasses.dataclass(frozen=True)
+class LoadTestResult:
+    """Result of letting concurrent clients annotate through the API."""
+
+    requests: int
+    errors: int
+    requests_per_second: float
+    p50_seconds: float
+    p99_seconds: float
+
+
+class _SimulatedEmbeddingService(service.EmbeddingService):
+    """Embedding service that waits instead of running a model (e.g. on a GPU or remotely)."""
+
+    def __init__(self, seconds_per_sample: float) -> None:
+        self._seconds_per_sample = seconds_per_sample
+        self.embedded = 0
+
+    def embed_samples(self, samples: Sequence[model.Sample]) -> Sequence[model.Embedding]:
+        time.sleep(self._seconds_per_sample * len(samples))
+        self.embedded += len(samples)
+        return tuple(torch.rand(384) for _ in samples)
+
+
+def benchmark_embedding_workers(
+    worker_counts: Sequence[int],
+    samples: int = 5000,
+    seconds_per_sample: float = 0.001,
+    chunk_size: int = 64,
+) -> list[EmbeddingWorkersResult]:
+    """Embed the samples of a fresh SQLite database with each number of worker processes."""
+    results = []
+    for workers in worker_counts:
+        with tempfile.TemporaryDirectory() as directory:
+            database_url = f"sqlite:///{pathlib.Path(directory) / 'benchmark.db'}"
+            _create_samples(database_url, samples)
+            start_time = time.perf_counter()
+            with multiprocessing.Pool(workers) as pool:
+                embedded = pool.starmap(
+                    _run_embedding_worker,
+                    [(database_url, seconds_per_sample, chunk_size)] * workers,
+                )
+            seconds = time.perf_counter() - start_time
+        results.append(EmbeddingWorkersResult(workers, seconds, sum(embedded)))
+    return results
+
+
+def _create_samples(database_url: str, samples: int) -> None:
+    unit_of_work = persistence.SQLAlchemyUnitOfWork(sqlalchemy.create_engine(database_url))
+    annotation_task = model.AnnotationTask.create("benchmark")
+    with unit_of_work:
+        unit_of_work.create_tables()
+        unit_of_work.annotation_tasks.create(annotation_task)
+        unit_of_work.samples.create_many(
+            tuple(model.Sample.create(annotation_task.id, f"text {i}") for i in range(samples))
+        )
+        unit_of_work.commit()
+
+
+def _run_embedding_worker(database_url: str, seconds_per_sample: float, chunk_size: int) -> int:
+    embedding_service = _SimulatedEmbeddingService(seconds_per_sample)
+    use_case = usecase.EmbedAllSamplesUseCase(
+        embedding_service,
+        persistence.SQLAlchemyUnitOfWork(sqlalchemy.create_engine(database_url)),
+        notification.InProcessNotificationService(),
+        chunk_size,
+    )
+    use_case.execute()
+    return embedding_service.embedded
+
+
+def measure_embedding_throughput(
+    embedding_service: service.EmbeddingService,
+    samples: Sequence[model.Sample],
+    batch_size: int = 64,
+) -> float:
+    """Measure the number of samples embedded per second (after a warm-up batch)."""
+    embedding_service.embed_samples(samples[:batch_size])
+    start_time = time.perf_counter()
+    for start in range(0, len(samples), batch_size):
+        embedding_service.embed_samples(samples[start : start + batch_size])
+    return len(samples) / (time.perf_counter() - start_time)
+
+
+def compare_embeddings(
+    reference: service.EmbeddingService,
+    candidate: service.EmbeddingService,
+    samples: Sequence[model.Sample],
+) -> EmbeddingParity:
+    """Compare the embeddings of the candidate to the ones of the reference service."""
+    reference_embeddings = torch.stack(list(reference.embed_samples(samples))).float().cpu()
+    candidate_embeddings = torch.stack(list(candidate.embed_samples(samples))).float().cpu()
+    cosines = torch.nn.functional.cosine_similarity(reference_embeddings, candidate_embeddings)
+    return EmbeddingParity(cosines.mean().item(), cosines.min().item())
+
+
+def load_test_api(base_url: str, task_id: model.Id, clients: int, seconds: float) -> LoadTestResult:
+    """
+    Let the clients get and annotate the next sample of the task in a loop for some seconds.
+
+    The clients label the samples they get with their most confident class and then restore the
+    original label, so that the samples of the task are never used up and keep their labels.
+    Relabeling still clears the estimates of the samples, which the estimation worker
+    recalculates.
+    """
+    url = urllib.parse.urlsplit(base_url)
+    deadline = time.monotonic() + seconds
+    latencies: list[float] = []
+    errors = [0]
+    lock = threading.Lock()
+
+    def run_client() -> None:
+        connection = http.client.HTTPConnection(url.netloc, timeout=60)
+        client_latencies = []
+        client_errors = 0
+        while time.monotonic() < deadline:
+            status, body, latency = _request(
+                connection, "GET", f"{url.path}/api/tasks/{task_id}/nextSample"
+            )
+            client_latencies.append(latency)
+            if status != 200:
+                client_errors += 1
+                continue
+            sample = json.loads(body)
+            if sample is None or len(sample["availableTextClasses"]) == 0:
+                continue
+            original_text_class_id = (
+                None if sample["textClass"] is None else sample["textClass"]["id"]
+            )
+            for text_class_id in (sample["availableTextClasses"][0]["id"], original_text_class_id):
+                status, _, latency = _request(
+                    connection,
+                    "PATCH",
+                    f"{url.path}/api/samples/{sample['id']}",
+                    json.dumps({"textClassId": text_class_id}),
+                )
+                client_latencies.append(latency)
+                client_errors += status != 200
+        connection.close()
+        with lock:
+            latencies.extend(client_latencies)
+            errors[0] += client_errors
+
+    start_time = time.monotonic()
+    threads = [threading.Thread(target=run_client) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - start_time
+    latencies.sort()
+    if len(latencies) == 0:
+        return LoadTestResult(0, errors[0], 0.0, 0.0, 0.0)
+    return LoadTestResult(
+        len(latencies),
+        errors[0],
+        len(latencies) / elapsed,
+        latencies[len(latencies) // 2],
+        latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))],
+    )
+
+
+def _request(
+    connection: http.client.HTTPConnection, method: str, path: str, body: str | None = None
+) -> tuple[int, bytes, float]:
+    """Send a request and return the status, the body and the latency in seconds."""
+    headers = {} if body is None else {"Content-Type": "application/json"}
+    start_time = time.perf_counter()
+    try:
+        connection.request(method, path, body, headers)
+        response = connection.getresponse()
+        data = response.read()
+    except (OSError, http.client.HTTPException):
+        # Reconnects with the next request.
+        connection.close()
+        return 0, b"", time.perf_counter() - start_time
+    return response.status, data, time.perf_counter() - start_time
@@ -1,17 +1,41 @@
 """Example script to annotate MTOP data aided by mean embeddings."""
 
+import itertools
+import pathlib
+from typing import Optional
+
+import rich.progress
+import torch
 import typer
 
 import nlpanno.adapters.annotation_api.main
+import nlpanno.adapters.embedding_transformers
 import nlpanno.adapters.embedding_worker
 import nlpanno.adapters.estimation_worker
+import nlpanno.adapters.persistence.migrations
+import nlpanno.benchmark
+import nlpanno.config
+import nlpanno.container
 import nlpanno.logging
+from nlpanno import datasets
+from nlpanno.domain import model
 
 # TODO: think about how to configure logging in a better way
 nlpanno.logging.configure_logging()
 
 app = typer.Typer()
 
+_BENCHMARK_TEXTS = (
+    "Wake me up at seven tomorrow morning",
+    "What is the weather like in Berlin this weekend?",
+    "Send a message to Anna that I will be late",
+    "Spiele etwas entspannte Musik",
+    "Erinnere mich morgen an den Zahnarzttermin",
+    "Quelle est la recette des crêpes ?",
+    "Annule mon rendez-vous de jeudi",
+    "¿Cuánto tiempo tardo en llegar al aeropuerto?",
+)
+
 
 @app.command()
 def start_annotation_server() -> None:
@@ -31,5 +55,183 @@ def start_estimation_worker() -> None:
     nlpanno.adapters.estimation_worker.run()
 
 
+@app.command()
+def migrate_database(batch_size: int = 1000) -> None:
+    """Migrate an existing database to the current schema."""
+    container = nlpanno.container.create_container()
+    nlpanno.adapters.persistence.migrations.migrate(container.database_engine(), batch_size)
+
+
+@app.command("import")
+def import_samples(
+    path: pathlib.Path,
+    record_format: Optional[datasets.RecordFormat] = None,
+    task_id: Optional[str] = None,
+    task_name: Optional[str] = None,
+    text_field: str = "text",
+    label_field: str = "label",
+    annotate: bool = True,
+    batch_size: int = 10000,
+    workers: int = 1,
+    max_estimates: Optional[int] = None,
+) -> None:
+    """
+    Import samples from a JSONL, CSV or TSV file (or an MTOP directory).
+
+    The samples are added to the task with the given id or to a new task (named after the file
+    by default). Labels are imported as annotations and unknown labels become text classes.
+    MTOP files are parsed by the given number of worker processes. A new task only stores the
+    given number of most confident class estimates per sample (all by default).
+    """
+    container = nlpanno.container.create_container()
+    unit_of_work = container.unit_of_work()
+    with unit_of_work:
+        unit_of_work.create_tables()
+        unit_of_work.commit()
+    if task_id is None:
+        annotation_task = container.create_annotation_task_use_case().execute(
+            task_name or path.stem, max_estimates
+        )
+        task_id = annotation_task.id
+    records = datasets.read_records(path, record_format, text_field, label_field, workers)
+    import_samples_use_case = container.import_samples_use_case(batch_size=batch_size)
+    with rich.progress.Progress(
+        rich.progress.SpinnerColumn(),
+        rich.progress.TextColumn("{task.description}"),
+        rich.progress.TextColumn("{task.completed} samples"),
+        rich.progress.TimeElapsedColumn(),
+    ) as progress:
+        progress_task = progress.add_task(f"Importing into task {task_id}", total=None)
+        batch_sizes = import_samples_use_case.execute(
+            task_id, ((record.text, record.label) for record in records), annotate
+        )
+        for imported in batch_sizes:
+            progress.advance(progress_task, imported)
+
+
+@app.command()
+def rebuild_similarity_index(batch_size: int = 10000) -> None:
+    """
+    Rebuild the similarity index of all tasks from the embeddings in the database.
+
+    Needed for samples embedded before the index existed. Stop the embedding workers first,
+    because embeddings they add during the rebuild may be lost.
+    """
+    container = nlpanno.container.create_container()
+    use_case = container.rebuild_similarity_index_use_case(batch_size=batch_size)
+    with rich.progress.Progress(
+        rich.progress.SpinnerColumn(),
+        rich.progress.TextColumn("{task.description}"),
+        rich.progress.TextColumn("{task.completed} samples"),
+        rich.progress.TimeElapsedColumn(),
+    ) as progress:
+        progress_task = progress.add_task("Indexing embeddings", total=None)
+        for indexed in use_case.execute():
+            progress.advance(progress_task, indexed)
+
+
+@app.command()
+def rebuild_embedding_store(batch_size: int = 10000) -> None:
+    """
+    Rebuild the embedding store of all tasks from the embeddings in the database.
+
+    Needed for samples embedded before the store existed, which are otherwise estimated with
+    the embeddings from the database. Stop the embedding workers first, because embeddings they
+    add during the rebuild may be lost.
+    """
+    container = nlpanno.container.create_container()
+    use_case = container.rebuild_embedding_store_use_case(batch_size=batch_size)
+    with rich.progress.Progress(
+        rich.progress.SpinnerColumn(),
+        rich.progress.TextColumn("{task.description}"),
+        rich.progress.TextColumn("{task.completed} samples"),
+        rich.progress.TimeElapsedColumn(),
+    ) as progress:
+        progress_task = progress.add_task("Storing embeddings", total=None)
+        for stored in use_case.execute():
+            progress.advance(progress_task, stored)
+
+
+@app.command()
+def benchmark_api(
+    task_id: str, url: str = "http://localhost:8000", clients: int = 64, seconds: float = 30.0
+) -> None:
+    """
+    Measure the requests per second and latencies of the running annotation server.
+
+    The clients get the next sample of the task, label it and restore its label in a loop. The
+    labels are kept, but the estimates of the samples are recalculated afterwards.
+    """
+    result = nlpanno.benchmark.load_test_api(url, task_id, clients, seconds)
+    typer.echo(
+        f"{result.requests} requests ({result.errors} errors): "
+        f"{result.requests_per_second:.1f} requests/s, "
+        f"p50 {result.p50_seconds * 1000:.1f} ms, p99 {result.p99_seconds * 1000:.1f} ms"
+    )
+
+
+@app.command()
+def benchmark_embedding_workers(
+    max_workers: int = 4, samples: int = 5000, seconds_per_sample: float = 0.001
+) -> None:
+    """
+    Measure how embedding throughput scales with the number of embedding worker processes.
+
+    The workers embed the samples of a temporary SQLite database with a simulated model that
+    takes the given time per sample, so that only the coordination of the workers is measured.
+    """
+    results = nlpanno.benchmark.benchmark_embedding_workers(
+        range(1, max_workers + 1), samples, seconds_per_sample
+    )
+    for result in results:
+        throughput = samples / result.seconds
+        speedup = results[0].seconds / result.seconds
+        typer.echo(
+            f"{result.workers} workers: {result.seconds:.2f} s, {throughput:.0f} samples/s, "
+            f"speedup {speedup:.2f}, {result.embedded} embeddings for {samples} samples"
+        )
+
+
+@app.command()
+def benchmark_embedding_backend(
+    backend: str = "quantized",
+    path: Optional[pathlib.Path] = None,
+    samples: int = 512,
+    min_cosine: float = 0.99,
+) -> None:
+    """
+    Compare an embedding backend with the default PyTorch model.
+
+    The texts are read from the given file (in any format of the import command) or default to
+    built-in sentences. Fails if the cosine similarity between the embeddings of a text falls
+    below `min_cosine`.
+    """
+    settings = nlpanno.config.ApplicationSettings()
+    if path is None:
+        texts = tuple(itertools.islice(itertools.cycle(_BENCHMARK_TEXTS), samples))
+    else:
+        records = datasets.read_records(path)
+        texts = tuple(record.text for record in itertools.islice(records, samples))
+    benchmark_samples = tuple(model.Sample.create("benchmark", text) for text in texts)
+    cores = torch.get_num_threads()
+    reference = nlpanno.adapters.embedding_transformers.TransformersEmbeddingService(
+        settings.embedding_model_name
+    )
+    candidate = nlpanno.adapters.embedding_transformers.TransformersEmbeddingService(
+        settings.embedding_model_name,
+        backend,  # type: ignore
+    )
+    for name, embedding_service in (("torch", reference), (backend, candidate)):
+        throughput = nlpanno.benchmark.measure_embedding_throughput(
+            embedding_service, benchmark_samples
+        )
+        typer.echo(f"{name}: {throughput:.1f} samples/s, {throughput / cores:.1f} per core")
+    parity = nlpanno.benchmark.compare_embeddings(reference, candidate, benchmark_samples)
+    typer.echo(f"cosine similarity: mean {parity.mean_cosine:.4f}, min {parity.min_cosine:.4f}")
+    if parity.min_cosine < min_cosine:
+        typer.echo(f"The {backend} backend deviates from the PyTorch model", err=True)
+        raise typer.Exit(code=1)
+
+
 if __name__ == "__main__":
     app()
@@ -1,5 +1,9 @@
+from typing import Literal
+
 import pydantic_settings
 
+from nlpanno.domain import model
+
 
 class ApplicationSettings(pydantic_settings.BaseSettings):
     """Settings for the application."""
@@ -8,7 +12,29 @@ class ApplicationSettings(pydantic_settings.BaseSettings):
     model_config = pydantic_settings.SettingsConfigDict(env_prefix="NLPANNO_")
 
     database_url: str = "sqlite:///samples.db"
+    # Directory for local runtime files (e.g. notification sockets).
+    data_dir: str = ".nlpanno"
     embedding_model_name: str = "distiluse-base-multilingual-cased-v1"
+    # "torch", "quantized" (int8 on CPU) or "onnx" (ONNX Runtime on CPU, needs the onnx extra).
+    embedding_backend: Literal["torch", "quantized", "onnx"] = "torch"
+    # Maximum number of (padded) tokens the embedding model encodes in one batch.
+    embedding_token_budget: int = 4096
+    # Number of samples that are embedded and committed together.
+    embedding_chunk_size: int = 256
+    # Seconds after which samples claimed by a (crashed) embedding worker are claimed again.
+    embedding_claim_seconds: float = 600.0
+    # Maximum number of embeddings in the cache of the data directory (0 disables the cache).
+    embedding_cache_max_entries: int = 1_000_000
+    # Number of clusters of the similarity index compared to a query (more is slower but exact).
+    similarity_index_probes: int = 16
+    # Cosine distance a class centroid has to move before its estimates are rewritten.
+    estimation_centroid_tolerance: float = 1e-4
+    # Used for annotation tasks that do not define their own sampling strategy.
+    sampling_strategy: model.SamplingStrategy = model.SamplingStrategy.RANDOM
+    # Seconds a sample handed out for annotation is reserved for the annotator.
+    sample_lease_seconds: float = 300.0
+    # Maximum number of annotation tasks cached by the API (0 disables the cache).
+    task_cache_max_entries: int = 128
     port: int = 8000
     host: str = "0.0.0.0"
     # TODO: Add dataset options.
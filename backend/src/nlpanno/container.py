@@ -1,10 +1,16 @@
 import dependency_injector.containers
 import dependency_injector.providers
 import sqlalchemy
+import sqlalchemy.ext.asyncio
 
+import nlpanno.adapters.embedding_cache
+import nlpanno.adapters.embedding_store
 import nlpanno.adapters.embedding_transformers
+import nlpanno.adapters.notification
 import nlpanno.adapters.persistence.sqlalchemy
 import nlpanno.adapters.sampling
+import nlpanno.adapters.similarity_index
+import nlpanno.adapters.task_cache
 import nlpanno.application.unitofwork
 import nlpanno.application.usecase
 import nlpanno.config
@@ -28,63 +34,167 @@ class Container(dependency_injector.containers.DeclarativeContainer):
         database_engine,
     )
 
+    # Used by the API, so that requests waiting for the database do not occupy threads.
+    async_database_engine = dependency_injector.providers.Singleton(
+        sqlalchemy.ext.asyncio.create_async_engine,
+        dependency_injector.providers.Callable(
+            nlpanno.adapters.persistence.sqlalchemy.get_async_database_url,
+            config.database_url,
+        ),
+    )
+
+    async_unit_of_work = dependency_injector.providers.Factory(
+        nlpanno.adapters.persistence.sqlalchemy.create_async_unit_of_work,
+        database_engine,
+        async_database_engine.provider,
+    )
+
     ###
     # Services
     ###
 
-    embedding_service = dependency_injector.providers.Factory(
+    _transformers_embedding_service = dependency_injector.providers.Factory(
         nlpanno.adapters.embedding_transformers.TransformersEmbeddingService,
         config.embedding_model_name,
+        config.embedding_backend,
+        config.embedding_token_budget,
     )
 
-    embedding_aggregation_service = dependency_injector.providers.Factory(
-        nlpanno.adapters.embedding_transformers.TransformersEmbeddingAggregationService,
+    _embedding_model_identifier = dependency_injector.providers.Callable(
+        nlpanno.adapters.embedding_transformers.get_model_identifier,
+        config.embedding_model_name,
+        config.embedding_backend,
     )
 
-    sampling_service = dependency_injector.providers.Factory(
-        nlpanno.adapters.sampling.RandomSamplingService,
+    embedding_service = dependency_injector.providers.Factory(
+        nlpanno.adapters.embedding_cache.create_embedding_service,
+        _transformers_embedding_service,
+        _embedding_model_identifier,
+        config.data_dir,
+        config.embedding_cache_max_entries,
+    )
+
+    embedding_store = dependency_injector.providers.Singleton(
+        nlpanno.adapters.embedding_store.create_embedding_store,
+        config.data_dir,
+        _embedding_model_identifier,
+    )
+
+    annotation_task_cache = dependency_injector.providers.Singleton(
+        nlpanno.adapters.task_cache.LRUAnnotationTaskCache,
+        config.task_cache_max_entries,
+    )
+
+    sampling_service_factory = dependency_injector.providers.Object(
+        nlpanno.adapters.sampling.create_sampling_service,
     )
 
     vector_similarity_service = dependency_injector.providers.Factory(
         nlpanno.adapters.embedding_transformers.TransformersVectorSimilarityService,
     )
 
+    similarity_index = dependency_injector.providers.Singleton(
+        nlpanno.adapters.similarity_index.create_similarity_index,
+        config.data_dir,
+        config.similarity_index_probes,
+    )
+
+    notification_service = dependency_injector.providers.Singleton(
+        nlpanno.adapters.notification.create_notification_service,
+        database_engine,
+        config.data_dir,
+    )
+
     ###
     # Use cases
     ###
 
-    get_next_sample_use_case = dependency_injector.providers.Factory(
-        nlpanno.application.usecase.GetNextSampleUseCase,
-        sampling_service,
+    create_annotation_task_use_case = dependency_injector.providers.Factory(
+        nlpanno.application.usecase.CreateAnnotationTaskUseCase,
         unit_of_work,
     )
 
-    annotate_sample_use_case = dependency_injector.providers.Factory(
-        nlpanno.application.usecase.AnnotateSampleUseCase,
+    import_samples_use_case = dependency_injector.providers.Factory(
+        nlpanno.application.usecase.ImportSamplesUseCase,
         unit_of_work,
+        notification_service,
     )
 
     embed_all_samples_use_case = dependency_injector.providers.Factory(
         nlpanno.application.usecase.EmbedAllSamplesUseCase,
         embedding_service,
         unit_of_work,
+        notification_service,
+        config.embedding_chunk_size,
+        config.embedding_claim_seconds,
+        similarity_index,
+        embedding_store,
     )
 
     estimate_samples_use_case = dependency_injector.providers.Factory(
         nlpanno.application.usecase.EstimateSamplesUseCase,
-        embedding_aggregation_service,
         vector_similarity_service,
+        sampling_service_factory,
         unit_of_work,
+        config.sampling_strategy,
+        config.estimation_centroid_tolerance,
+        embedding_store,
     )
 
-    fetch_annotation_task_use_case = dependency_injector.providers.Factory(
-        nlpanno.application.usecase.FetchAnnotationTaskUseCase,
+    rebuild_similarity_index_use_case = dependency_injector.providers.Factory(
+        nlpanno.application.usecase.RebuildSimilarityIndexUseCase,
         unit_of_work,
+        similarity_index,
     )
 
-    fetch_all_annotation_tasks_use_case = dependency_injector.providers.Factory(
-        nlpanno.application.usecase.FetchAllAnnotationTasksUseCase,
+    rebuild_embedding_store_use_case = dependency_injector.providers.Factory(
+        nlpanno.application.usecase.RebuildEmbeddingStoreUseCase,
         unit_of_work,
+        embedding_store,
+    )
+
+    ###
+    # Asyncio use cases (for the API)
+    ###
+
+    async_get_next_sample_use_case = dependency_injector.providers.Factory(
+        nlpanno.application.usecase.AsyncGetNextSampleUseCase,
+        sampling_service_factory,
+        config.sampling_strategy,
+        async_unit_of_work,
+        config.sample_lease_seconds,
+        annotation_task_cache,
+    )
+
+    async_annotate_sample_use_case = dependency_injector.providers.Factory(
+        nlpanno.application.usecase.AsyncAnnotateSampleUseCase,
+        async_unit_of_work,
+        notification_service,
+        annotation_task_cache,
+    )
+
+    async_annotate_samples_use_case = dependency_injector.providers.Factory(
+        nlpanno.application.usecase.AsyncAnnotateSamplesUseCase,
+        async_unit_of_work,
+        notification_service,
+        annotation_task_cache,
+    )
+
+    async_find_similar_samples_use_case = dependency_injector.providers.Factory(
+        nlpanno.application.usecase.AsyncFindSimilarSamplesUseCase,
+        async_unit_of_work,
+        similarity_index,
+    )
+
+    async_fetch_annotation_task_use_case = dependency_injector.providers.Factory(
+        nlpanno.application.usecase.AsyncFetchAnnotationTaskUseCase,
+        async_unit_of_work,
+        annotation_task_cache,
+    )
+
+    async_fetch_all_annotation_tasks_use_case = dependency_injector.providers.Factory(
+        nlpanno.application.usecase.AsyncFetchAllAnnotationTasksUseCase,
+        async_unit_of_work,
     )
 
 
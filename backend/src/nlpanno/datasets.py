@@ -1,6 +1,13 @@
 """Utilities for loading common datasets."""
 
+import abc
+import concurrent.futures
+import csv
 import dataclasses
+import enum
+import functools
+import itertools
+import json
 import logging
 import pathlib
 from collections.abc import Iterator
@@ -10,12 +17,146 @@ from nlpanno.domain import model
 _LOG = logging.getLogger("nlpanno")
 
 
-@dataclasses.dataclass
-class Dataset:
-    """Base class for datasets."""
+class RecordFormat(enum.Enum):
+    """File formats that records can be read from."""
 
-    task_config: model.AnnotationTask
-    samples: tuple[model.Sample, ...]
+    JSONL = "jsonl"
+    CSV = "csv"
+    TSV = "tsv"
+    # Directory with the *.txt files of the MTOP dataset.
+    MTOP = "mtop"
+
+
+@dataclasses.dataclass(frozen=True)
+class Record:
+    """A text with an optional label (the name of its class)."""
+
+    text: str
+    label: str | None = None
+
+
+def read_records(
+    path: pathlib.Path | str,
+    record_format: RecordFormat | None = None,
+    text_field: str = "text",
+    label_field: str = "label",
+    workers: int = 1,
+) -> Iterator[Record]:
+    """
+    Read records lazily from a file.
+
+    If no format is given, it is inferred from the suffix of the file (a directory is read as
+    MTOP). For JSONL, CSV and TSV, the text and the (optional) label are read from the given
+    fields; CSV and TSV files need a header row. MTOP files are parsed by `workers` processes.
+    """
+    path = pathlib.Path(path)
+    if not path.exists():
+        raise ValueError(f"Path does not exist: '{path}'")
+    if record_format is None:
+        record_format = _infer_record_format(path)
+    if record_format == RecordFormat.MTOP:
+        for text, label in _iter_parsed_mtop_lines(path, workers):
+            yield Record(text, label)
+        return
+    with open(path, encoding="utf-8", newline="") as input_file:
+        if record_format == RecordFormat.JSONL:
+            rows: Iterator[dict] = (json.loads(line) for line in input_file if line.strip())
+        else:
+            delimiter = "\t" if record_format == RecordFormat.TSV else ","
+            rows = csv.DictReader(input_file, delimiter=delimiter)
+        for row in rows:
+            if text_field not in row:
+                raise ValueError(f"Record without field '{text_field}': {row}")
+            yield Record(row[text_field], row.get(label_field) or None)
+
+
+def _infer_record_format(path: pathlib.Path) -> RecordFormat:
+    if path.is_dir():
+        return RecordFormat.MTOP
+    suffix = path.suffix.lower().lstrip(".")
+    if suffix in ("json", "ndjson"):
+        return RecordFormat.JSONL
+    try:
+        return RecordFormat(suffix)
+    except ValueError:
+        raise ValueError(f"Cannot infer the format of '{path}', please specify it") from None
+
+
+def _iter_mtop_lines(path: pathlib.Path) -> Iterator[str]:
+    for data_file_path in sorted(path.glob("*.txt")):
+        with open(data_file_path, encoding="utf-8") as input_file:
+            yield from input_file
+
+
+def _parse_mtop_line(line: str) -> tuple[str, str]:
+    """Parse the text and the class name from a line of an MTOP data file."""
+    _, text_class, _, text, *_ = line.split("\t", 4)
+    return text, _parse_mtop_class_name(text_class)
+
+
+def _parse_mtop_class_name(text_class: str) -> str:
+    return text_class[3:].replace("_", " ").lower()
+
+
+def _parse_mtop_file(path: pathlib.Path) -> list[tuple[str, str]]:
+    """Parse all lines of an MTOP data file (run in worker processes)."""
+    with open(path, encoding="utf-8") as input_file:
+        return [_parse_mtop_line(line) for line in input_file]
+
+
+def _iter_parsed_mtop_lines(path: pathlib.Path, workers: int = 1) -> Iterator[tuple[str, str]]:
+    """
+    Iterate over the texts and class names of the MTOP data files in the directory.
+
+    With more than one worker, the files are parsed in parallel processes (in file order).
+    """
+    if workers <= 1:
+        yield from (_parse_mtop_line(line) for line in _iter_mtop_lines(path))
+        return
+    data_file_paths = sorted(path.glob("*.txt"))
+    _LOG.info(f"Parsing {len(data_file_paths)} MTOP files with {workers} processes")
+    executor = concurrent.futures.ProcessPoolExecutor(workers)
+    try:
+        for parsed_lines in executor.map(_parse_mtop_file, data_file_paths):
+            yield from parsed_lines
+    finally:
+        # Files that are not needed anymore (e.g. because of a limit) are not parsed.
+        executor.shutdown(cancel_futures=True)
+
+
+class Dataset(abc.ABC):
+    """
+    Base class for datasets.
+
+    The samples and class names are read lazily, so that large datasets can be streamed.
+    """
+
+    def __init__(self, name: str) -> None:
+        self._name = name
+        self._task_id = model.create_id()
+
+    @abc.abstractmethod
+    def iter_class_names(self) -> Iterator[str]:
+        """Iterate over the names of the text classes (possibly with duplicates)."""
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def iter_samples(self) -> Iterator[model.Sample]:
+        """Iterate over the samples of the dataset."""
+        raise NotImplementedError()
+
+    @functools.cached_property
+    def task_config(self) -> model.AnnotationTask:
+        """Annotation task with the text classes of the dataset."""
+        annotation_task = model.AnnotationTask(id=self._task_id, name=self._name)
+        for class_name in sorted(set(self.iter_class_names())):
+            annotation_task.create_text_class(class_name)
+        return annotation_task
+
+    @functools.cached_property
+    def samples(self) -> tuple[model.Sample, ...]:
+        """All samples of the dataset (prefer `iter_samples` for large datasets)."""
+        return tuple(self.iter_samples())
 
 
 class MTOP(Dataset):
@@ -26,55 +167,28 @@ class MTOP(Dataset):
     """
 
     def __init__(
-        self, path: pathlib.Path | str, add_class_to_text: bool = False, limit: int | None = None
+        self,
+        path: pathlib.Path | str,
+        add_class_to_text: bool = False,
+        limit: int | None = None,
+        workers: int = 1,
     ) -> None:
+        super().__init__("MTOP")
         self._add_class_to_text = add_class_to_text
         self._limit = limit
+        self._workers = workers
         self._path = path if isinstance(path, pathlib.Path) else pathlib.Path(path)
         if not self._path.exists():
             raise ValueError(f"Path does not exist: '{self._path}'")
-        samples, task_config = self._read_data()
-        _LOG.info(f"Samples: {len(samples)}")
-        super().__init__(task_config, samples)
-
-    def _read_data(self) -> tuple[tuple[model.Sample, ...], model.AnnotationTask]:
-        """Load data from disk."""
-        annotation_task = model.AnnotationTask.create("MTOP")
-        samples: list[model.Sample] = []
-        text_classes: set[str] = set()
-        for line in self._read_lines():
-            _LOG.info(f"Line: {line}")
-            if self._limit_hit(samples):
-                break
-            text, text_class = self._parse_line(line)
-            sample = model.Sample.create(
-                annotation_task_id=annotation_task.id,
-                text=text,
-            )
-            samples.append(sample)
-            text_classes.add(text_class)
-        sorted_text_classes = tuple(sorted(text_classes))
-        for text_class in sorted_text_classes:
-            annotation_task.create_text_class(text_class)
-        return tuple(samples), annotation_task
-
-    def _limit_hit(self, samples: list[model.Sample]) -> bool:
-        """Check if the limit has been hit."""
-        if self._limit is None:
-            return False
-        return len(samples) >= self._limit
-
-    def _read_lines(self) -> Iterator[str]:
-        """Read lines from the given file."""
-        data_file_paths = list(self._path.glob("*.txt"))
-        for data_file_path in data_file_paths:
-            with open(data_file_path, encoding="utf-8") as input_file:
-                yield from input_file
-
-    def _parse_line(self, line: str) -> tuple[str, str]:
-        """Parse a line from the data file."""
-        _, text_class, _, text, *_ = line.split("\t")
-        text_class = text_class[3:].replace("_", " ").lower()
-        if self._add_class_to_text:
-            text += f" ({text_class})"
-        return text, text_class
+
+    def iter_class_names(self) -> Iterator[str]:
+        # Only the class column is split off, which is much cheaper than parsing the lines.
+        lines = itertools.islice(_iter_mtop_lines(self._path), self._limit)
+        return (_parse_mtop_class_name(line.split("\t", 2)[1]) for line in lines)
+
+    def iter_samples(self) -> Iterator[model.Sample]:
+        parsed_lines = _iter_parsed_mtop_lines(self._path, self._workers)
+        for text, text_class in itertools.islice(parsed_lines, self._limit):
+            if self._add_class_to_text:
+                text += f" ({text_class})"
+            yield model.Sample.create(annotation_task_id=self._task_id, text=text)
@@ -1,4 +1,5 @@
 import dataclasses
+import enum
 import uuid
 from typing import Optional, Self
 
@@ -6,6 +7,7 @@ import torch
 
 Id = str
 Embedding = torch.Tensor
+Matrix = torch.Tensor
 
 
 # TODO: Move to another place.
@@ -14,6 +16,25 @@ def create_id() -> Id:
     return str(uuid.uuid4())
 
 
+class SamplingStrategy(enum.Enum):
+    """Strategy for choosing the next sample to annotate."""
+
+    RANDOM = "random"
+    # Uncertainty sampling based on the class estimates.
+    LEAST_CONFIDENCE = "least_confidence"
+    MARGIN = "margin"
+    ENTROPY = "entropy"
+
+
+class SampleField(enum.Enum):
+    """Field of a sample that is written separately when it changed."""
+
+    LABEL = "label"
+    EMBEDDING = "embedding"
+    ESTIMATES = "estimates"
+    PRIORITY = "priority"
+
+
 @dataclasses.dataclass
 class Entity:
     """Base class for all entities."""
@@ -48,12 +69,41 @@ class ClassEstimate(Entity):
         return cls(id=create_id(), text_class_id=text_class_id, confidence=confidence)
 
 
+@dataclasses.dataclass
+class ClassCentroid:
+    """Running sum of the embeddings of a class' labeled samples."""
+
+    text_class_id: Id
+    annotation_task_id: Id
+    # In double precision, so that adding and removing embeddings does not accumulate errors.
+    embedding_sum: Embedding
+    count: int = 0
+
+    def add(self, embedding_sum: Embedding, count: int) -> None:
+        """Add the sum of `count` embeddings (negative to remove embeddings)."""
+        self.embedding_sum = self.embedding_sum + embedding_sum.double()
+        self.count += count
+
+    def mean(self) -> Embedding:
+        """Mean of the embeddings (the class embedding)."""
+        return (self.embedding_sum / self.count).float()
+
+
 @dataclasses.dataclass
 class AnnotationTask(Entity):
     """Data structure for task metadata."""
 
     name: str
     text_classes: tuple[TextClass, ...] = ()
+    # Incremented whenever the labels of the task's samples change.
+    label_version: int = 0
+    # Incremented whenever the task itself (e.g. its text classes) is updated.
+    version: int = 0
+    # If None, the default strategy of the application is used.
+    sampling_strategy: Optional[SamplingStrategy] = None
+    # If set, only the estimates of the most confident classes are stored per sample (and the
+    # mean confidence of the other classes as rest confidence). Must be at least 1.
+    max_estimates: Optional[int] = None
     # TODO: add samples?
     # Would need to find a solution not to load all samples in memory.
 
@@ -64,8 +114,10 @@ class AnnotationTask(Entity):
         raise ValueError(f"Text class with id {id_} not found.")
 
     @classmethod
-    def create(cls, name: str = "task") -> Self:
-        return cls(id=create_id(), name=name, text_classes=())
+    def create(cls, name: str = "task", max_estimates: Optional[int] = None) -> Self:
+        if max_estimates is not None and max_estimates < 1:
+            raise ValueError(f"Invalid maximum number of estimates {max_estimates}.")
+        return cls(id=create_id(), name=name, text_classes=(), max_estimates=max_estimates)
 
     def create_text_class(self, name: str) -> TextClass:
         text_class = TextClass.create(name, self.id)
@@ -82,6 +134,15 @@ class Sample(Entity):
     text_class: Optional[TextClass] = None
     embedding: Optional[Embedding] = None
     estimates: tuple[ClassEstimate, ...] = ()
+    # Confidence of the classes without an estimate if only the top estimates are stored.
+    rest_confidence: Optional[float] = None
+    # How valuable annotating the sample is (higher is more valuable).
+    priority: Optional[float] = None
+    # Fields changed by the methods since the sample was loaded, so that repositories only write
+    # those. None if unknown (e.g. for samples that were not loaded), then all fields are written.
+    changed_fields: Optional[set[SampleField]] = dataclasses.field(
+        default=None, compare=False, repr=False, kw_only=True
+    )
 
     @classmethod
     def create(cls, annotation_task_id: Id, text: str) -> Self:
@@ -90,14 +151,18 @@ class Sample(Entity):
     def annotate(self, text_class: TextClass | None) -> None:
         # TODO: Add annotation service that checks that the text class is valid.
         self.text_class = text_class
+        self._mark_changed(SampleField.LABEL)
 
     def remove_label(self) -> None:
         self.text_class = None
+        self._mark_changed(SampleField.LABEL)
 
     def embed(self, embedding: Embedding) -> None:
         self.embedding = embedding
+        self._mark_changed(SampleField.EMBEDDING)
 
     def add_class_estimate(self, class_estimate: ClassEstimate) -> None:
+        self._mark_changed(SampleField.ESTIMATES)
         for existing_class_estimate in self.estimates:
             if existing_class_estimate.text_class_id == class_estimate.text_class_id:
                 existing_class_estimate.update(class_estimate.confidence)
@@ -107,3 +172,31 @@ class Sample(Entity):
     def add_class_estimates(self, class_estimates: tuple[ClassEstimate, ...]) -> None:
         for class_estimate in class_estimates:
             self.add_class_estimate(class_estimate)
+
+    def remove_class_estimate(self, text_class_id: Id) -> None:
+        estimates = tuple(
+            estimate for estimate in self.estimates if estimate.text_class_id != text_class_id
+        )
+        if len(estimates) < len(self.estimates):
+            self.estimates = estimates
+            self._mark_changed(SampleField.ESTIMATES)
+
+    def replace_class_estimates(
+        self, class_estimates: tuple[ClassEstimate, ...], rest_confidence: float | None
+    ) -> None:
+        self.estimates = class_estimates
+        self.rest_confidence = rest_confidence
+        self._mark_changed(SampleField.ESTIMATES)
+
+    def clear_class_estimates(self) -> None:
+        self.estimates = ()
+        self.rest_confidence = None
+        self._mark_changed(SampleField.ESTIMATES)
+
+    def prioritize(self, priority: float | None) -> None:
+        self.priority = priority
+        self._mark_changed(SampleField.PRIORITY)
+
+    def _mark_changed(self, field: SampleField) -> None:
+        if self.changed_fields is not None:
+            self.changed_fields.add(field)
@@ -1,24 +1,52 @@
 import abc
+import enum
+from collections.abc import Iterator, Mapping, Sequence
 from dataclasses import dataclass
 
 from . import model
 
 
+class SampleOrder(enum.Enum):
+    """Order of the samples returned by `SampleRepository.find`."""
+
+    ID = "id"
+    # Uniformly random order; combined with a limit this picks random samples cheaply.
+    RANDOM = "random"
+    # Descending priority, samples without priority last.
+    PRIORITY = "priority"
+
+
 @dataclass
 class SampleQuery:
     """Query for finding samples."""
 
     has_label: bool | None = None
     has_embedding: bool | None = None
+    has_estimates: bool | None = None
     task_id: model.Id | None = None
+    # Only the samples with these ids.
+    ids: Sequence[model.Id] | None = None
+    # Maximum number of samples to return.
+    limit: int | None = None
+    # Only applies to `find`, `iter_find` always orders by id.
+    order: SampleOrder = SampleOrder.ID
+    # Loading plan: the embeddings (large) and estimates are not loaded if disabled, and the
+    # samples are returned without them. Only the changed fields of samples are written (see
+    # `model.Sample.changed_fields`), so the skipped fields must not be changed before updating.
+    # Repositories that do not load samples from storage may ignore the plan.
+    with_embedding: bool = True
+    with_estimates: bool = True
+    # Lock the found samples until the end of the transaction, so that values derived from them
+    # are not based on stale samples. Only applies to `find` and `find_ids`.
+    for_update: bool = False
 
 
 class SampleRepository(abc.ABC):
     """Base class for all sample repositories."""
 
     @abc.abstractmethod
-    def get_by_id(self, id_: model.Id) -> model.Sample:
-        """Get a sample by the unique identifier."""
+    def get_by_id(self, id_: model.Id, for_update: bool = False) -> model.Sample:
+        """Get a sample by the unique identifier (and lock it until the end of the transaction)."""
         raise NotImplementedError()
 
     @abc.abstractmethod
@@ -26,9 +54,127 @@ class SampleRepository(abc.ABC):
         """Find samples by the given query."""
         raise NotImplementedError()
 
+    @abc.abstractmethod
+    def find_ids(self, query: SampleQuery | None = None) -> tuple[model.Id, ...]:
+        """Find the ids of the samples matching the query (in the order of `find`)."""
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def iter_find(
+        self, query: SampleQuery | None = None, batch_size: int = 1000
+    ) -> Iterator[model.Sample]:
+        """
+        Iterate over the samples matching the given query (ordered by id).
+
+        In contrast to `find`, the samples are loaded lazily in batches of `batch_size`.
+        """
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def count(self, query: SampleQuery | None = None) -> int:
+        """Count the samples matching the given query (ignoring the limit)."""
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def claim(self, query: SampleQuery, lease_duration: float) -> model.Sample | None:
+        """
+        Atomically lease the first sample found by the query for `lease_duration` seconds.
+
+        Leased samples are skipped by `claim` until their lease expires or is released, so that
+        concurrent callers never get the same sample.
+        """
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def release(self, id_: model.Id) -> None:
+        """Release the lease of a sample."""
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def claim_many(self, query: SampleQuery, claim_duration: float) -> tuple[model.Sample, ...]:
+        """
+        Atomically claim up to `query.limit` samples found by the query for background work.
+
+        Claimed samples are skipped by `claim_many` for `claim_duration` seconds, so that
+        concurrent workers process disjoint samples and the samples of crashed workers are
+        claimed again after the claim expired. Claims are independent of annotation leases.
+        """
+        raise NotImplementedError()
+
     @abc.abstractmethod
     def update(self, sample: model.Sample) -> None:
-        """Update a sample."""
+        """Update a sample (only the changed fields if they are known)."""
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def update_embeddings(self, embeddings: Mapping[model.Id, model.Embedding]) -> None:
+        """Set the embeddings of many samples (by sample id) at once."""
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def update_estimates(
+        self,
+        sample_ids: Sequence[model.Id],
+        text_class_ids: Sequence[model.Id],
+        confidences: model.Matrix,
+    ) -> None:
+        """
+        Set the estimates of many samples for some text classes at once.
+
+        The confidences have one row per sample and one column per text class. Estimates of the
+        samples for other text classes are kept.
+        """
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def replace_estimates(
+        self,
+        sample_ids: Sequence[model.Id],
+        text_class_ids: Sequence[Sequence[model.Id]],
+        confidences: model.Matrix,
+        rest_confidences: Sequence[float | None],
+    ) -> None:
+        """
+        Replace all estimates of many samples at once (e.g. by the top estimates only).
+
+        Row i of the confidences holds the confidences of sample i for the text classes
+        `text_class_ids[i]`, so every sample has the same number of estimates. The rest
+        confidence of a sample applies to the text classes without an estimate.
+        """
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def get_confidences(
+        self, sample_ids: Sequence[model.Id], text_class_ids: Sequence[model.Id]
+    ) -> model.Matrix:
+        """
+        Get the confidences of the estimates of many samples (rows) for text classes (columns).
+
+        Missing estimates have a confidence of 0.
+        """
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def remove_estimates(self, text_class_ids: Sequence[model.Id]) -> None:
+        """Remove the estimates for the text classes from all samples."""
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def update_priorities(self, priorities: Mapping[model.Id, float | None]) -> None:
+        """Set the priorities of many samples (by sample id) at once."""
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def update_labels(
+        self, task_id: model.Id, labels: Mapping[model.Id, model.TextClass | None]
+    ) -> None:
+        """
+        Set the labels of many samples of a task (by sample id) at once.
+
+        Like annotating the samples one by one, removing a label clears the sample's estimates
+        and the leases of all updated samples are released. Raises a ValueError (without
+        updating anything) if a sample does not exist or belongs to another task.
+        """
         raise NotImplementedError()
 
     @abc.abstractmethod
@@ -36,6 +182,15 @@ class SampleRepository(abc.ABC):
         """Create a sample."""
         raise NotImplementedError()
 
+    @abc.abstractmethod
+    def create_many(self, samples: Sequence[model.Sample]) -> None:
+        """
+        Create many samples with bulk inserts.
+
+        The text classes of the samples must already exist (e.g. by creating them with the task).
+        """
+        raise NotImplementedError()
+
 
 class AnnotationTaskRepository(abc.ABC):
     """Base class for all annotation task repositories."""
@@ -47,7 +202,7 @@ class AnnotationTaskRepository(abc.ABC):
 
     @abc.abstractmethod
     def update(self, task: model.AnnotationTask) -> None:
-        """Update a task."""
+        """Update a task and increment its version (its label version is not written)."""
         raise NotImplementedError()
 
     @abc.abstractmethod
@@ -59,3 +214,34 @@ class AnnotationTaskRepository(abc.ABC):
     def find(self) -> tuple[model.AnnotationTask, ...]:
         """Find all tasks."""
         raise NotImplementedError()
+
+    @abc.abstractmethod
+    def get_version(self, id_: model.Id) -> int:
+        """Get the version of a task (without loading the task)."""
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def increment_label_version(self, id_: model.Id) -> None:
+        """Atomically increment the label version of a task."""
+        raise NotImplementedError()
+
+
+class ClassCentroidRepository(abc.ABC):
+    """Base class for all class centroid repositories."""
+
+    @abc.abstractmethod
+    def find(self, task_id: model.Id) -> tuple[model.ClassCentroid, ...]:
+        """Find the centroids of the classes of a task (including centroids without samples)."""
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def add_embeddings(
+        self, text_class: model.TextClass, embedding_sum: model.Embedding, count: int
+    ) -> None:
+        """
+        Add the sum of `count` embeddings to the centroid of a class.
+
+        Embeddings are removed with a negative count (and the negated sum). The centroid is
+        created if the class does not have one yet.
+        """
+        raise NotImplementedError()
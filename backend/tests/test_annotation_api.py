@@ -1,16 +1,24 @@
 """Test suite for service."""
 
+import pathlib
+from collections.abc import Callable
+
 import fastapi
 import fastapi.testclient
+import pytest
+import torch
 
 import nlpanno.adapters.persistence.inmemory
-from nlpanno.adapters import annotation_api
+from nlpanno.adapters import annotation_api, similarity_index
+from nlpanno.application import unitofwork
 from nlpanno.domain import model
 
 _GET_TASK_ENDPOINT = "/api/tasks/{task_id}"
 _GET_TASKS_ENDPOINT = "/api/tasks"
 _PATCH_SAMPLE_ENDPOINT = "/api/samples/{sample_id}"
 _NEXT_SAMPLE_ENDPOINT = "/api/tasks/{task_id}/nextSample"
+_PATCH_SAMPLES_ENDPOINT = "/api/tasks/{task_id}/samples"
+_SIMILAR_SAMPLES_ENDPOINT = "/api/samples/{sample_id}/similar"
 
 
 def test_get_task() -> None:
@@ -75,6 +83,25 @@ def test_get_next_sample() -> None:
     assert response.json() == expected_response
 
 
+def test_get_next_sample_with_top_estimates() -> None:
+    """Test that the classes without a stored estimate get the rest confidence."""
+    annotation_task = model.AnnotationTask.create(max_estimates=1)
+    text_class_1 = annotation_task.create_text_class("class 1")
+    text_class_2 = annotation_task.create_text_class("class 2")
+    sample = model.Sample.create(annotation_task.id, "text")
+    sample.replace_class_estimates((model.ClassEstimate.create(text_class_2.id, 0.5),), 0.25)
+    client = create_client((sample,), annotation_task)
+    endpoint = _NEXT_SAMPLE_ENDPOINT.format(task_id=annotation_task.id)
+
+    response = client.get(endpoint)
+
+    assert response.status_code == 200
+    assert response.json()["availableTextClasses"] == [
+        {"id": text_class_2.id, "name": text_class_2.name, "confidence": 0.5},
+        {"id": text_class_1.id, "name": text_class_1.name, "confidence": 0.25},
+    ]
+
+
 def test_patch_sample() -> None:
     """Test the patching (partial update) a sample."""
     annotation_task = model.AnnotationTask.create()
@@ -92,6 +119,130 @@ def test_patch_sample() -> None:
     assert updated.json()["textClass"]["id"] == text_class_2.id
 
 
+def test_patch_samples() -> None:
+    """Test patching the labels of many samples at once."""
+    annotation_task = model.AnnotationTask.create()
+    text_class_1 = annotation_task.create_text_class("class 1")
+    text_class_2 = annotation_task.create_text_class("class 2")
+    sample_1 = model.Sample.create(annotation_task.id, "text 1")
+    sample_2 = model.Sample.create(annotation_task.id, "text 2")
+    sample_2.annotate(text_class_1)
+    client = create_client((sample_1, sample_2), annotation_task)
+    endpoint = _PATCH_SAMPLES_ENDPOINT.format(task_id=annotation_task.id)
+    input_data = {
+        "samples": [
+            {"id": sample_1.id, "textClassId": text_class_2.id},
+            {"id": sample_2.id, "textClassId": None},
+        ]
+    }
+
+    response = client.patch(endpoint, json=input_data)
+    invalid_response = client.patch(
+        endpoint, json={"samples": [{"id": sample_1.id, "textClassId": "unknown"}]}
+    )
+
+    assert response.status_code == 204
+    assert sample_1.text_class == text_class_2
+    assert sample_2.text_class is None
+    assert invalid_response.status_code == 422
+    assert sample_1.text_class == text_class_2
+
+
+def test_sample_requests_use_one_transaction(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test that getting and patching a sample run a single transaction each."""
+    async_unit_of_work_type = nlpanno.adapters.persistence.inmemory.InMemoryAsyncUnitOfWork
+    run = async_unit_of_work_type.run
+    transactions: list[object] = []
+
+    async def run_counted(
+        self: nlpanno.adapters.persistence.inmemory.InMemoryAsyncUnitOfWork,
+        transaction: Callable[[unitofwork.UnitOfWork], object],
+    ) -> object:
+        transactions.append(transaction)
+        return await run(self, transaction)
+
+    monkeypatch.setattr(async_unit_of_work_type, "run", run_counted)
+    annotation_task = model.AnnotationTask.create()
+    text_class = annotation_task.create_text_class("class")
+    sample = model.Sample.create(annotation_task.id, "text")
+    client = create_client((sample,), annotation_task)
+
+    next_sample = client.get(_NEXT_SAMPLE_ENDPOINT.format(task_id=annotation_task.id))
+    next_sample_transactions = len(transactions)
+    patched = client.patch(
+        _PATCH_SAMPLE_ENDPOINT.format(sample_id=sample.id), json={"textClassId": text_class.id}
+    )
+
+    assert next_sample.json()["availableTextClasses"][0]["id"] == text_class.id
+    assert patched.json()["textClass"]["id"] == text_class.id
+    assert next_sample_transactions == 1
+    assert len(transactions) == 2
+
+
+def test_get_similar_samples(tmp_path: pathlib.Path) -> None:
+    """Test getting the samples with the most similar embeddings."""
+    annotation_task = model.AnnotationTask.create()
+    text_class = annotation_task.create_text_class("class")
+    samples = tuple(model.Sample.create(annotation_task.id, f"text {i}") for i in range(4))
+    embeddings = torch.tensor([[1.0, 0.0], [0.0, 1.0], [1.0, 0.2], [1.0, 1.0]])
+    for sample, embedding in zip(samples, embeddings):
+        sample.embed(embedding)
+    samples[2].annotate(text_class)
+    index = similarity_index.IVFSimilarityIndex(tmp_path)
+    # The last sample is not indexed yet.
+    index.add(
+        annotation_task.id,
+        {sample.id: embedding for sample, embedding in zip(samples[:3], embeddings)},
+    )
+    client = create_client(samples, annotation_task)
+    client.app.container.similarity_index.override(index)  # type: ignore
+    endpoint = _SIMILAR_SAMPLES_ENDPOINT.format(sample_id=samples[0].id)
+
+    response = client.get(endpoint, params={"k": 5})
+    unknown_response = client.get(_SIMILAR_SAMPLES_ENDPOINT.format(sample_id="unknown"))
+
+    assert response.status_code == 200
+    similar_samples = response.json()
+    assert [similar_sample["id"] for similar_sample in similar_samples] == [
+        samples[2].id,
+        samples[1].id,
+    ]
+    assert similar_samples[0]["textClass"] == {"id": text_class.id, "name": text_class.name}
+    assert similar_samples[0]["similarity"] == pytest.approx(1.0 / 1.04**0.5)
+    assert similar_samples[1]["similarity"] == pytest.approx(0.0)
+    assert unknown_response.status_code == 404
+
+
+def test_annotate_with_database(tmp_path: pathlib.Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test getting and annotating the next sample with the asyncio database driver."""
+    monkeypatch.setenv("NLPANNO_DATABASE_URL", f"sqlite:///{tmp_path / 'samples.db'}")
+    monkeypatch.setenv("NLPANNO_DATA_DIR", str(tmp_path))
+    annotation_task = model.AnnotationTask.create()
+    text_class = annotation_task.create_text_class("class")
+    sample = model.Sample.create(annotation_task.id, "text")
+    app = annotation_api.create_app()
+    with app.container.unit_of_work() as unit_of_work:  # type: ignore
+        unit_of_work.annotation_tasks.create(annotation_task)
+        unit_of_work.samples.create(sample)
+        unit_of_work.commit()
+
+    with fastapi.testclient.TestClient(app) as client:
+        next_response = client.get(_NEXT_SAMPLE_ENDPOINT.format(task_id=annotation_task.id))
+        empty_response = client.get(_NEXT_SAMPLE_ENDPOINT.format(task_id=annotation_task.id))
+        patch_response = client.patch(
+            _PATCH_SAMPLE_ENDPOINT.format(sample_id=sample.id),
+            json={"textClassId": text_class.id},
+        )
+
+    assert next_response.json()["id"] == sample.id
+    # The sample is leased until it is annotated.
+    assert empty_response.json() is None
+    assert patch_response.status_code == 200
+    assert patch_response.json()["textClass"] == {"id": text_class.id, "name": text_class.name}
+    with app.container.unit_of_work() as unit_of_work:  # type: ignore
+        assert unit_of_work.samples.get_by_id(sample.id).text_class == text_class
+
+
 def create_client(
     samples: tuple[model.Sample, ...], task_config: model.AnnotationTask
 ) -> fastapi.testclient.TestClient:
@@ -105,4 +256,7 @@ def create_client(
 
     app = annotation_api.create_app()
     app.container.unit_of_work.override(unit_of_work)  # type: ignore
+    app.container.async_unit_of_work.override(  # type: ignore
+        nlpanno.adapters.persistence.inmemory.InMemoryAsyncUnitOfWork(unit_of_work)
+    )
     return fastapi.testclient.TestClient(app)
@@ -36,3 +36,49 @@ class TestMtop:
         dataset = datasets.MTOP(input_dir, add_class_to_text=True)
         assert len(dataset.samples) == 1
         assert dataset.samples[0].text == f"{_MTOP_TEXT} ({_MTOP_TEXT_CLASS})"
+
+    @staticmethod
+    @pytest.mark.parametrize("workers", (1, 2))
+    def test_iter_samples(tmp_path: pathlib.Path, workers: int) -> None:
+        """Test iterating over the samples of several files with a limit."""
+        for file_name in ("eval.txt", "test.txt", "train.txt"):
+            (tmp_path / file_name).write_text(_MTOP_LINE + "\n" + _MTOP_LINE + "\n")
+        dataset = datasets.MTOP(tmp_path, limit=5, workers=workers)
+
+        samples = tuple(dataset.iter_samples())
+
+        assert len(samples) == 5
+        assert all(sample.text == _MTOP_TEXT for sample in samples)
+        assert all(sample.annotation_task_id == dataset.task_config.id for sample in samples)
+        assert tuple(dataset.iter_class_names()) == (_MTOP_TEXT_CLASS,) * 5
+
+
+class TestReadRecords:
+    """Tests for reading records from files."""
+
+    @staticmethod
+    @pytest.mark.parametrize(
+        ("file_name", "content"),
+        (
+            ("data.jsonl", '{"text": "a, b", "label": "x"}\n\n{"text": "c"}\n'),
+            ("data.csv", 'text,label\n"a, b",x\nc,\n'),
+            ("data.tsv", "text\tlabel\na, b\tx\nc\t\n"),
+        ),
+    )
+    def test_read_records(tmp_path: pathlib.Path, file_name: str, content: str) -> None:
+        """Test reading records with and without labels."""
+        path = tmp_path / file_name
+        path.write_text(content, encoding="utf-8")
+
+        records = tuple(datasets.read_records(path))
+
+        assert records == (datasets.Record("a, b", "x"), datasets.Record("c"))
+
+    @staticmethod
+    def test_read_mtop_records(tmp_path: pathlib.Path) -> None:
+        """Test reading the records of an MTOP directory."""
+        (tmp_path / "eval.txt").write_text(_MTOP_LINE + "\n", encoding="utf-8")
+
+        records = tuple(datasets.read_records(tmp_path))
+
+        assert records == (datasets.Record(_MTOP_TEXT, _MTOP_TEXT_CLASS),)
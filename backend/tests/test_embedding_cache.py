@@ -0,0 +1,78 @@
+"""Test suite for the embedding cache."""
+
+import pathlib
+from collections.abc import Sequence
+
+import pytest
+import torch
+
+from nlpanno.adapters import embedding_cache
+from nlpanno.application import service
+from nlpanno.domain import model
+
+
+class _CountingEmbeddingService(service.EmbeddingService):
+    """Embedding service recording the embedded texts."""
+
+    def __init__(self) -> None:
+        self.texts: list[str] = []
+
+    def embed_samples(self, samples: Sequence[model.Sample]) -> Sequence[model.Embedding]:
+        self.texts.extend(sample.text for sample in samples)
+        return tuple(torch.full((3,), float(len(sample.text))) for sample in samples)
+
+
+def test_cache_hits(tmp_path: pathlib.Path) -> None:
+    """Test that every text is embedded only once, also within a batch and across instances."""
+    inner_service = _CountingEmbeddingService()
+    path = tmp_path / "cache.sqlite3"
+    samples = tuple(model.Sample.create("task", text) for text in ("a", "bb", "a"))
+    caching_service = embedding_cache.CachingEmbeddingService(inner_service, "model", path)
+
+    first_embeddings = caching_service.embed_samples(samples)
+    caching_service.close()
+    caching_service = embedding_cache.CachingEmbeddingService(inner_service, "model", path)
+    second_embeddings = caching_service.embed_samples(samples)
+    other_model_service = embedding_cache.CachingEmbeddingService(inner_service, "other", path)
+    other_model_service.embed_samples(samples[:1])
+
+    assert inner_service.texts == ["a", "bb", "a"]
+    assert caching_service.hit_rate == 1.0
+    expected = (torch.full((3,), 1.0), torch.full((3,), 2.0), torch.full((3,), 1.0))
+    for embeddings in (first_embeddings, second_embeddings):
+        assert all(torch.equal(a, b) for a, b in zip(embeddings, expected))
+
+
+def test_cache_eviction(tmp_path: pathlib.Path) -> None:
+    """Test that the least recently used embeddings are evicted."""
+    inner_service = _CountingEmbeddingService()
+    caching_service = embedding_cache.CachingEmbeddingService(
+        inner_service, "model", tmp_path / "cache.sqlite3", max_entries=2
+    )
+
+    for text in ("a", "b", "a", "c", "a", "b"):
+        caching_service.embed_samples((model.Sample.create("task", text),))
+
+    assert inner_service.texts == ["a", "b", "c", "b"]
+    assert caching_service.hit_rate == pytest.approx(2 / 6)
+
+
+def test_cache_eviction_across_instances(tmp_path: pathlib.Path) -> None:
+    """Test that processes sharing the cache file evict down to the maximum together."""
+    path = tmp_path / "cache.sqlite3"
+    caching_services = [
+        embedding_cache.CachingEmbeddingService(
+            _CountingEmbeddingService(), "model", path, max_entries=2
+        )
+        for _ in range(2)
+    ]
+    for caching_service, texts in zip(caching_services, (("a", "b"), ("c", "d"))):
+        caching_service.embed_samples(tuple(model.Sample.create("task", text) for text in texts))
+    inner_service = _CountingEmbeddingService()
+    caching_service = embedding_cache.CachingEmbeddingService(inner_service, "model", path)
+
+    caching_service.embed_samples(
+        tuple(model.Sample.create("task", text) for text in ("a", "b", "c", "d"))
+    )
+
+    assert inner_service.texts == ["a", "b"]
@@ -0,0 +1,57 @@
+"""Test suite for the embedding store."""
+
+import pathlib
+
+import pytest
+import torch
+
+from nlpanno.adapters import embedding_store
+
+_TASK_ID = "task"
+
+
+def test_get(tmp_path: pathlib.Path) -> None:
+    """Test getting stored embeddings as the rows of a matrix."""
+    store = embedding_store.MemmapEmbeddingStore(tmp_path)
+    store.add(_TASK_ID, {"a": torch.tensor([1.0, 0.0]), "b": torch.tensor([1.0, 1.0])})
+    store.add(_TASK_ID, {"c": torch.tensor([0.0, 2.0]), "a": torch.tensor([3.0, 0.0])})
+    store.add("other task", {"d": torch.tensor([1.0, 0.1])})
+
+    matrix = store.get(_TASK_ID, ("c", "a"))
+
+    assert matrix is not None
+    assert torch.equal(matrix, torch.tensor([[0.0, 2.0], [3.0, 0.0]]))
+    assert store.get(_TASK_ID, ("a", "d")) is None
+    assert store.get("unknown task", ("a",)) is None
+    with pytest.raises(ValueError):
+        store.add(_TASK_ID, {"e": torch.tensor([1.0, 0.0, 0.0])})
+
+
+def test_get_after_changes(tmp_path: pathlib.Path) -> None:
+    """Test that a reader sees the embeddings added and removed by another writer."""
+    writer = embedding_store.MemmapEmbeddingStore(tmp_path)
+    reader = embedding_store.MemmapEmbeddingStore(tmp_path)
+    writer.add(_TASK_ID, {"a": torch.tensor([1.0, 0.0])})
+    assert reader.get(_TASK_ID, ("a",)) is not None
+
+    writer.add(_TASK_ID, {"b": torch.tensor([0.0, 1.0])})
+    matrix = reader.get(_TASK_ID, ("b", "a"))
+    assert matrix is not None
+    assert torch.equal(matrix, torch.tensor([[0.0, 1.0], [1.0, 0.0]]))
+
+    writer.clear(_TASK_ID)
+    assert reader.get(_TASK_ID, ("a",)) is None
+    writer.add(_TASK_ID, {"a": torch.tensor([2.0, 0.0, 1.0])})
+    matrix = reader.get(_TASK_ID, ("a",))
+    assert matrix is not None
+    assert torch.equal(matrix, torch.tensor([[2.0, 0.0, 1.0]]))
+
+
+def test_create_embedding_store(tmp_path: pathlib.Path) -> None:
+    """Test that the embeddings of each model are stored in their own directory."""
+    store = embedding_store.create_embedding_store(tmp_path, "sentence-transformers/model")
+    other_store = embedding_store.create_embedding_store(tmp_path, "sentence-transformers/other")
+    store.add(_TASK_ID, {"a": torch.tensor([1.0, 0.0])})
+
+    assert other_store.get(_TASK_ID, ("a",)) is None
+    assert (tmp_path / "embedding_store" / "sentence-transformers--model" / _TASK_ID).is_dir()
@@ -0,0 +1,92 @@
+"""Test suite for the transformers adapters."""
+
+import pathlib
+
+import pytest
+import torch
+import transformers
+
+from nlpanno import benchmark
+from nlpanno.adapters import embedding_transformers
+from nlpanno.domain import model
+
+
+def test_similarity_matrix_matches_pairwise_similarity() -> None:
+    """Test that the batched similarity equals the pairwise similarity."""
+    service = embedding_transformers.TransformersVectorSimilarityService(block_size=3)
+    sample_embeddings = tuple(torch.rand(8) for _ in range(7))
+    class_embeddings = tuple(torch.rand(8) for _ in range(2))
+
+    matrix = service.calculate_similarity_matrix(sample_embeddings, class_embeddings)
+
+    assert matrix.shape == (7, 2)
+    for row, sample_embedding in enumerate(sample_embeddings):
+        for column, class_embedding in enumerate(class_embeddings):
+            expected = service.calculate_similarity(sample_embedding, class_embedding)
+            assert abs(matrix[row, column].item() - expected) < 1e-6
+
+
+def test_similarity_matrix_without_classes() -> None:
+    """Test the batched similarity without any class embeddings."""
+    service = embedding_transformers.TransformersVectorSimilarityService()
+
+    matrix = service.calculate_similarity_matrix((torch.rand(8),), ())
+
+    assert matrix.shape == (1, 0)
+
+
+def test_quantized_backend(tiny_model_path: pathlib.Path) -> None:
+    """Test that the quantized backend agrees with the PyTorch model."""
+    samples = tuple(model.Sample.create("task", text) for text in ("hello world", "abc", "xyz"))
+    reference = embedding_transformers.TransformersEmbeddingService(str(tiny_model_path))
+    candidate = embedding_transformers.TransformersEmbeddingService(
+        str(tiny_model_path), "quantized"
+    )
+
+    parity = benchmark.compare_embeddings(reference, candidate, samples)
+
+    assert parity.min_cosine > 0.99
+    assert any(
+        isinstance(module, torch.ao.nn.quantized.dynamic.Linear)
+        for module in candidate._transformer.modules()
+    )
+
+
+def test_create_token_batches() -> None:
+    """Test that texts of similar length are batched within the token budget."""
+    batches = embedding_transformers.create_token_batches([5, 31, 4, 6, 30, 100], 64)
+
+    assert batches == [[2, 0, 3], [4, 1], [5]]
+
+
+def test_bucketed_embeddings_keep_order(tiny_model_path: pathlib.Path) -> None:
+    """Test that bucketing by length does not change the embeddings or their order."""
+    texts = ("a", "hello world " * 20, "abc", "the quick brown fox", "xyz " * 50)
+    samples = tuple(model.Sample.create("task", text) for text in texts)
+    service = embedding_transformers.TransformersEmbeddingService(
+        str(tiny_model_path), token_budget=64
+    )
+
+    embeddings = service.embed_samples(samples)
+
+    expected = service._transformer.encode(list(texts), batch_size=1, convert_to_tensor=True)
+    assert len(embeddings) == len(texts)
+    for embedding, expected_embedding in zip(embeddings, expected):
+        assert torch.allclose(embedding, expected_embedding, atol=1e-5)
+
+
+@pytest.fixture
+def tiny_model_path(tmp_path: pathlib.Path) -> pathlib.Path:
+    """Path to a tiny randomly initialized BERT model (to avoid downloading a model)."""
+    vocabulary = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]", *"abcdefghijklmnopqrstuvwxyz"]
+    (tmp_path / "vocab.txt").write_text("\n".join(vocabulary))
+    transformers.BertTokenizer(str(tmp_path / "vocab.txt")).save_pretrained(tmp_path)
+    config = transformers.BertConfig(
+        vocab_size=len(vocabulary),
+        hidden_size=32,
+        num_hidden_layers=2,
+        num_attention_heads=2,
+        intermediate_size=64,
+    )
+    transformers.BertModel(config).save_pretrained(tmp_path)
+    return tmp_path
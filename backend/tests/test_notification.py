@@ -0,0 +1,82 @@
+"""Test suite for the notification services."""
+
+import pathlib
+import threading
+
+import pytest
+
+from nlpanno.adapters import notification
+from nlpanno.application import service
+
+_CHANNEL = service.NotificationChannel.EMBEDDING_REQUESTED
+_OTHER_CHANNEL = service.NotificationChannel.ESTIMATION_REQUESTED
+
+
+def test_wait_times_out_without_notification(
+    notification_service: service.NotificationService,
+) -> None:
+    """Test that waiting without a notification times out."""
+    notification_service.subscribe(_CHANNEL)
+
+    assert notification_service.wait(_CHANNEL, timeout=0.01) is False
+
+
+def test_notification_published_before_waiting(
+    notification_service: service.NotificationService,
+) -> None:
+    """Test that a notification published between waits is not lost."""
+    notification_service.subscribe(_CHANNEL)
+
+    notification_service.publish(_CHANNEL)
+    notification_service.publish(_CHANNEL)
+
+    assert notification_service.wait(_CHANNEL, timeout=1.0) is True
+    assert notification_service.wait(_CHANNEL, timeout=0.01) is False
+
+
+def test_notification_wakes_up_waiting_subscriber(
+    notification_service: service.NotificationService,
+) -> None:
+    """Test that a notification wakes up a blocked subscriber."""
+    notification_service.subscribe(_CHANNEL)
+    timer = threading.Timer(0.05, notification_service.publish, args=(_CHANNEL,))
+    timer.start()
+
+    assert notification_service.wait(_CHANNEL, timeout=10.0) is True
+    timer.join()
+
+
+def test_channels_are_separated(notification_service: service.NotificationService) -> None:
+    """Test that a notification is only received on its channel."""
+    notification_service.subscribe(_CHANNEL)
+    notification_service.subscribe(_OTHER_CHANNEL)
+
+    notification_service.publish(_OTHER_CHANNEL)
+
+    assert notification_service.wait(_CHANNEL, timeout=0.01) is False
+    assert notification_service.wait(_OTHER_CHANNEL, timeout=1.0) is True
+
+
+def test_socket_notification_across_instances(tmp_path: pathlib.Path) -> None:
+    """Test that publishers and subscribers only need to share the directory."""
+    subscriber = notification.SocketNotificationService(tmp_path)
+    publisher = notification.SocketNotificationService(tmp_path)
+    subscriber.subscribe(_CHANNEL)
+
+    publisher.publish(_CHANNEL)
+
+    assert subscriber.wait(_CHANNEL, timeout=1.0) is True
+    subscriber.close()
+    assert list(tmp_path.iterdir()) == []
+
+
+@pytest.fixture(params=("inprocess", "socket"))
+def notification_service(
+    request: pytest.FixtureRequest, tmp_path: pathlib.Path
+) -> service.NotificationService:
+    """Fixture creating a notification service."""
+    if request.param == "inprocess":
+        return notification.InProcessNotificationService()
+    if request.param == "socket":
+        return notification.SocketNotificationService(tmp_path)
+    raise ValueError(f"Unknown notification service: {request.param}")
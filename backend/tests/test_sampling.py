@@ -1,18 +1,41 @@
 """Test suit for sampling."""
 
+import pytest
+import torch
+
 from nlpanno.adapters import sampling
-from nlpanno.domain import model
+from nlpanno.domain import model, repository
 
 
-def test_random_sampling_service() -> None:
-    """Test sampling with the random sampler."""
+def test_random_sampling_service_query() -> None:
+    """Test that the random sampler lets the repository pick an unlabeled sample."""
     random_sampler = sampling.RandomSamplingService()
-    id_ = model.create_id()
-    sample = model.Sample(
-        id_,
-        "task_id",
-        "text 1",
-        None,
+
+    query = random_sampler.create_query("task_id")
+
+    assert query == repository.SampleQuery(
+        has_label=False, task_id="task_id", order=repository.SampleOrder.RANDOM, limit=1
+    )
+
+
+@pytest.mark.parametrize(
+    "strategy",
+    (
+        model.SamplingStrategy.LEAST_CONFIDENCE,
+        model.SamplingStrategy.MARGIN,
+        model.SamplingStrategy.ENTROPY,
+    ),
+)
+def test_uncertainty_sampling_service(strategy: model.SamplingStrategy) -> None:
+    """Test that uncertain estimates get a higher priority than certain ones."""
+    uncertainty_sampler = sampling.create_sampling_service(strategy)
+    confidences = torch.tensor([[0.9, 0.1, 0.0], [0.5, 0.5, 0.1]])
+
+    priorities = uncertainty_sampler.calculate_priorities(confidences)
+    query = uncertainty_sampler.create_query("task_id")
+
+    assert priorities is not None
+    assert priorities[1] > priorities[0]
+    assert query == repository.SampleQuery(
+        has_label=False, task_id="task_id", order=repository.SampleOrder.PRIORITY, limit=1
     )
-    sampled_id = random_sampler.sample((sample,))
-    assert sampled_id == id_
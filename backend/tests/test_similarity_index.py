@@ -0,0 +1,100 @@
+"""Test suite for the similarity index."""
+
+import pathlib
+import threading
+
+import pytest
+import torch
+
+from nlpanno.adapters import similarity_index
+
+_TASK_ID = "task"
+
+
+def test_exact_search(tmp_path: pathlib.Path) -> None:
+    """Test searching an index that is too small to be trained."""
+    index = similarity_index.IVFSimilarityIndex(tmp_path)
+    index.add(_TASK_ID, {"a": torch.tensor([1.0, 0.0]), "b": torch.tensor([1.0, 1.0])})
+    index.add(_TASK_ID, {"c": torch.tensor([0.0, 2.0]), "a": torch.tensor([1.0, 0.0])})
+    index.add("other task", {"d": torch.tensor([1.0, 0.1])})
+
+    neighbors = index.search(_TASK_ID, torch.tensor([2.0, 0.1]), 3)
+
+    assert [neighbor_id for neighbor_id, _ in neighbors] == ["a", "b", "c"]
+    expected_similarity = torch.nn.functional.cosine_similarity(
+        torch.tensor([2.0, 0.1]), torch.tensor([1.0, 1.0]), dim=0
+    ).item()
+    assert neighbors[1][1] == pytest.approx(expected_similarity)
+    assert index.search("unknown task", torch.tensor([1.0, 0.0]), 3) == []
+    with pytest.raises(ValueError):
+        index.add(_TASK_ID, {"e": torch.tensor([1.0, 0.0, 0.0])})
+
+
+def test_trained_search(tmp_path: pathlib.Path) -> None:
+    """Test that probing all clusters of a trained index finds the exact nearest neighbors."""
+    generator = torch.Generator().manual_seed(0)
+    centers = torch.randn(8, 16, generator=generator)
+    embeddings = centers[torch.arange(2000) % 8] + 0.3 * torch.randn(2000, 16, generator=generator)
+    writer = similarity_index.IVFSimilarityIndex(tmp_path, min_training_size=500)
+    for start in range(0, 2000, 250):
+        writer.add(_TASK_ID, {str(i): embeddings[i] for i in range(start, start + 250)})
+    # Retrained after 500 and 2000 embeddings with 44 clusters.
+    reader = similarity_index.IVFSimilarityIndex(tmp_path, probes=44)
+    query = torch.randn(16, generator=generator)
+
+    neighbors = reader.search(_TASK_ID, query, 10)
+
+    similarities = torch.nn.functional.cosine_similarity(embeddings, query.unsqueeze(0))
+    expected_ids = [str(i) for i in similarities.topk(10).indices.tolist()]
+    assert [neighbor_id for neighbor_id, _ in neighbors] == expected_ids
+
+
+def test_search_after_changes(tmp_path: pathlib.Path) -> None:
+    """Test that a reader sees the embeddings added and removed by another writer."""
+    writer = similarity_index.IVFSimilarityIndex(tmp_path, min_training_size=4)
+    reader = similarity_index.IVFSimilarityIndex(tmp_path)
+    writer.add(_TASK_ID, {"a": torch.tensor([1.0, 0.0]), "b": torch.tensor([0.0, 1.0])})
+    assert [neighbor_id for neighbor_id, _ in reader.search(_TASK_ID, torch.ones(2), 5)] == [
+        "a",
+        "b",
+    ]
+
+    writer.add(_TASK_ID, {"c": torch.tensor([1.0, 1.0]), "d": torch.tensor([-1.0, 0.0])})
+    assert reader.search(_TASK_ID, torch.ones(2), 1)[0][0] == "c"
+
+    writer.clear(_TASK_ID)
+    assert reader.search(_TASK_ID, torch.ones(2), 5) == []
+
+
+def test_concurrent_search(tmp_path: pathlib.Path) -> None:
+    """Test searching from several threads while embeddings are added."""
+    generator = torch.Generator().manual_seed(0)
+    embeddings = torch.randn(2001, 8, generator=generator)
+    writer = similarity_index.IVFSimilarityIndex(tmp_path, min_training_size=100)
+    reader = similarity_index.IVFSimilarityIndex(tmp_path)
+    writer.add(_TASK_ID, {"0": embeddings[0]})
+    errors: list[Exception] = []
+    is_adding = threading.Event()
+    is_adding.set()
+
+    def search() -> None:
+        while is_adding.is_set():
+            try:
+                neighbors = reader.search(_TASK_ID, embeddings[0], 5)
+                assert neighbors[0][0] == "0"
+            except Exception as error:
+                errors.append(error)
+                return
+
+    threads = [threading.Thread(target=search) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    try:
+        for start in range(1, len(embeddings), 20):
+            writer.add(_TASK_ID, {str(i): embeddings[i] for i in range(start, start + 20)})
+    finally:
+        is_adding.clear()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
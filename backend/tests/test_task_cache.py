@@ -0,0 +1,38 @@
+"""Test suite for the annotation task cache."""
+
+import dataclasses
+
+from nlpanno.adapters import task_cache
+from nlpanno.domain import model
+
+
+def test_get() -> None:
+    """Test that a cached task is only returned for its version."""
+    cache = task_cache.LRUAnnotationTaskCache()
+    annotation_task = model.AnnotationTask.create()
+    cache.put(annotation_task)
+
+    assert cache.get(annotation_task.id, 0) is annotation_task
+    assert cache.get(annotation_task.id, 1) is None
+    assert cache.get("unknown", 0) is None
+    assert (cache.hits, cache.misses) == (1, 2)
+
+    updated_task = dataclasses.replace(annotation_task, version=1)
+    cache.put(updated_task)
+    # An outdated task loaded by a slower request does not replace the newer one.
+    cache.put(annotation_task)
+    assert cache.get(annotation_task.id, 1) is updated_task
+
+
+def test_eviction() -> None:
+    """Test that the least recently used tasks are evicted."""
+    cache = task_cache.LRUAnnotationTaskCache(max_entries=2)
+    first_task, second_task, third_task = (model.AnnotationTask.create() for _ in range(3))
+    cache.put(first_task)
+    cache.put(second_task)
+    cache.get(first_task.id, 0)
+    cache.put(third_task)
+
+    assert cache.get(first_task.id, 0) is first_task
+    assert cache.get(second_task.id, 0) is None
+    assert cache.get(third_task.id, 0) is third_task
@@ -0,0 +1,559 @@
+"""Test suite for the use cases."""
+
+import asyncio
+import pathlib
+import threading
+from collections.abc import Sequence
+
+import pytest
+import sqlalchemy
+import torch
+
+import nlpanno.adapters.persistence.inmemory
+import nlpanno.adapters.persistence.sqlalchemy
+from nlpanno.adapters import (
+    embedding_store,
+    embedding_transformers,
+    notification,
+    sampling,
+    similarity_index,
+    task_cache,
+)
+from nlpanno.application import service, unitofwork, usecase
+from nlpanno.domain import model, repository
+
+
+class _FakeEmbeddingService(service.EmbeddingService):
+    """Embedding service recording the sizes of the batches."""
+
+    def __init__(self) -> None:
+        self.batch_sizes: list[int] = []
+
+    def embed_samples(self, samples: Sequence[model.Sample]) -> Sequence[model.Embedding]:
+        self.batch_sizes.append(len(samples))
+        return tuple(torch.full((4,), float(len(sample.text))) for sample in samples)
+
+
+def test_embed_all_samples_in_chunks() -> None:
+    """Test that all samples are embedded chunk by chunk."""
+    samples = tuple(model.Sample.create("task", "x" * (i + 1)) for i in range(5))
+    unit_of_work = nlpanno.adapters.persistence.inmemory.InMemoryUnitOfWork()
+    with unit_of_work:
+        for sample in samples:
+            unit_of_work.samples.create(sample)
+        unit_of_work.commit()
+    embedding_service = _FakeEmbeddingService()
+    use_case = usecase.EmbedAllSamplesUseCase(
+        embedding_service,
+        unit_of_work,
+        notification.InProcessNotificationService(),
+        chunk_size=2,
+    )
+
+    assert use_case.execute() is True
+    assert use_case.execute() is False
+
+    assert embedding_service.batch_sizes == [2, 2, 1]
+    with unit_of_work:
+        for sample in samples:
+            embedding = unit_of_work.samples.get_by_id(sample.id).embedding
+            assert embedding is not None
+            assert embedding[0].item() == len(sample.text)
+
+
+def test_embed_into_similarity_index(tmp_path: pathlib.Path) -> None:
+    """Test that the embedded samples are added to the similarity index of their task."""
+    samples = tuple(model.Sample.create("task", "x" * (i + 1)) for i in range(3))
+    unit_of_work = nlpanno.adapters.persistence.inmemory.InMemoryUnitOfWork()
+    with unit_of_work:
+        unit_of_work.samples.create_many(samples)
+    index = similarity_index.IVFSimilarityIndex(tmp_path)
+    use_case = usecase.EmbedAllSamplesUseCase(
+        _FakeEmbeddingService(),
+        unit_of_work,
+        notification.InProcessNotificationService(),
+        chunk_size=2,
+        similarity_index=index,
+    )
+
+    use_case.execute()
+
+    neighbors = index.search("task", torch.ones(4), 5)
+    assert {neighbor_id for neighbor_id, _ in neighbors} == {sample.id for sample in samples}
+
+
+def test_embed_into_embedding_store(tmp_path: pathlib.Path) -> None:
+    """Test that the embedded samples are added to the embedding store of their task."""
+    samples = tuple(model.Sample.create("task", "x" * (i + 1)) for i in range(3))
+    unit_of_work = nlpanno.adapters.persistence.inmemory.InMemoryUnitOfWork()
+    with unit_of_work:
+        unit_of_work.samples.create_many(samples)
+    store = embedding_store.MemmapEmbeddingStore(tmp_path)
+    use_case = usecase.EmbedAllSamplesUseCase(
+        _FakeEmbeddingService(),
+        unit_of_work,
+        notification.InProcessNotificationService(),
+        chunk_size=2,
+        embedding_store=store,
+    )
+
+    use_case.execute()
+
+    matrix = store.get("task", tuple(sample.id for sample in samples))
+    assert matrix is not None
+    assert matrix[:, 0].tolist() == [1.0, 2.0, 3.0]
+
+
+def test_estimate_samples() -> None:
+    """Test that unlabeled samples are estimated against the class centroids."""
+    unit_of_work, annotation_task, unlabeled = _create_estimation_fixture()
+    text_class_1, text_class_2 = annotation_task.text_classes
+    use_case = _create_estimate_samples_use_case(unit_of_work)
+
+    use_case.execute()
+
+    with unit_of_work:
+        estimated = unit_of_work.samples.get_by_id(unlabeled.id)
+    confidences = {estimate.text_class_id: estimate.confidence for estimate in estimated.estimates}
+    assert confidences.keys() == {text_class_1.id, text_class_2.id}
+    assert abs(confidences[text_class_1.id] - 2**-0.5) < 1e-6
+    assert abs(confidences[text_class_2.id] - 2**-0.5) < 1e-6
+
+
+def test_estimate_samples_with_database() -> None:
+    """Test writing the estimates and priorities in bulk, also when only some classes changed."""
+    engine = sqlalchemy.create_engine("sqlite://", poolclass=sqlalchemy.pool.StaticPool)
+    unit_of_work, annotation_task, unlabeled = _create_estimation_fixture(
+        nlpanno.adapters.persistence.sqlalchemy.SQLAlchemyUnitOfWork(engine)
+    )
+    text_class_1, text_class_2 = annotation_task.text_classes
+    use_case = _create_estimate_samples_use_case(unit_of_work, model.SamplingStrategy.MARGIN)
+    use_case.execute()
+    with unit_of_work:
+        first_priority = unit_of_work.samples.get_by_id(unlabeled.id).priority
+    new_sample = model.Sample.create(annotation_task.id, "text 4")
+    new_sample.embed(torch.tensor([1.0, 0.5]))
+    with unit_of_work:
+        unit_of_work.samples.create_many((new_sample,))
+        unit_of_work.commit()
+    usecase.AnnotateSampleUseCase(
+        unit_of_work, notification.InProcessNotificationService()
+    ).execute(new_sample.id, text_class_1.id)
+
+    use_case.execute()
+
+    with unit_of_work:
+        estimated = unit_of_work.samples.get_by_id(unlabeled.id)
+    confidences = {estimate.text_class_id: estimate.confidence for estimate in estimated.estimates}
+    assert len(estimated.estimates) == 2
+    expected = torch.nn.functional.cosine_similarity(
+        torch.tensor([1.0, 1.0]), torch.tensor([1.0, 0.25]), dim=0
+    ).item()
+    assert confidences[text_class_1.id] == pytest.approx(expected)
+    assert confidences[text_class_2.id] == pytest.approx(2**-0.5)
+    assert first_priority is not None
+    assert estimated.priority is not None
+    assert estimated.priority < first_priority
+
+
+@pytest.mark.parametrize(
+    ("sampling_strategy", "uses_priorities"),
+    [(model.SamplingStrategy.RANDOM, False), (model.SamplingStrategy.MARGIN, True)],
+)
+def test_estimate_samples_priority_statements(
+    sampling_strategy: model.SamplingStrategy, uses_priorities: bool
+) -> None:
+    """Test that priorities are only read and written for strategies that use them."""
+    engine = sqlalchemy.create_engine("sqlite://", poolclass=sqlalchemy.pool.StaticPool)
+    unit_of_work, annotation_task, _ = _create_estimation_fixture(
+        nlpanno.adapters.persistence.sqlalchemy.SQLAlchemyUnitOfWork(engine)
+    )
+    text_class_1, _ = annotation_task.text_classes
+    use_case = _create_estimate_samples_use_case(unit_of_work, sampling_strategy)
+    use_case.execute()
+    new_sample = model.Sample.create(annotation_task.id, "text 4")
+    new_sample.embed(torch.tensor([1.0, 0.5]))
+    with unit_of_work:
+        unit_of_work.samples.create_many((new_sample,))
+        unit_of_work.commit()
+    usecase.AnnotateSampleUseCase(
+        unit_of_work, notification.InProcessNotificationService()
+    ).execute(new_sample.id, text_class_1.id)
+    statements: list[str] = []
+    sqlalchemy.event.listen(
+        engine, "before_cursor_execute", lambda *args: statements.append(args[2])
+    )
+
+    use_case.execute()
+
+    priority_statements = [
+        statement
+        for statement in statements
+        if statement.startswith(("UPDATE samples SET priority", "SELECT estimates.sample_id"))
+    ]
+    assert (len(priority_statements) > 0) == uses_priorities
+
+
+def test_estimate_top_samples() -> None:
+    """Test that only the top estimates are stored for tasks with a maximum number."""
+    engine = sqlalchemy.create_engine("sqlite://", poolclass=sqlalchemy.pool.StaticPool)
+    unit_of_work, annotation_task, unlabeled = _create_estimation_fixture(
+        nlpanno.adapters.persistence.sqlalchemy.SQLAlchemyUnitOfWork(engine), max_estimates=1
+    )
+    text_class_1, text_class_2 = annotation_task.text_classes
+    use_case = _create_estimate_samples_use_case(unit_of_work, model.SamplingStrategy.MARGIN)
+    use_case.execute()
+    new_sample = model.Sample.create(annotation_task.id, "text 4")
+    new_sample.embed(torch.tensor([0.5, 1.0]))
+    with unit_of_work:
+        unit_of_work.samples.create_many((new_sample,))
+        unit_of_work.commit()
+    usecase.AnnotateSampleUseCase(
+        unit_of_work, notification.InProcessNotificationService()
+    ).execute(new_sample.id, text_class_2.id)
+
+    use_case.execute()
+
+    with unit_of_work:
+        estimated = unit_of_work.samples.get_by_id(unlabeled.id)
+    expected = torch.nn.functional.cosine_similarity(
+        torch.tensor([1.0, 1.0]), torch.tensor([0.25, 1.0]), dim=0
+    ).item()
+    assert [estimate.text_class_id for estimate in estimated.estimates] == [text_class_2.id]
+    assert estimated.estimates[0].confidence == pytest.approx(expected)
+    assert estimated.rest_confidence == pytest.approx(2**-0.5)
+    assert estimated.priority is not None
+
+
+def test_estimate_samples_from_embedding_store(tmp_path: pathlib.Path) -> None:
+    """Test that the sample embeddings are read from the embedding store if it has them."""
+    unit_of_work, annotation_task, unlabeled = _create_estimation_fixture()
+    text_class_1, text_class_2 = annotation_task.text_classes
+    store = embedding_store.MemmapEmbeddingStore(tmp_path)
+    store.add(annotation_task.id, {unlabeled.id: torch.tensor([1.0, 0.0])})
+    use_case = usecase.EstimateSamplesUseCase(
+        embedding_transformers.TransformersVectorSimilarityService(),
+        sampling.create_sampling_service,
+        unit_of_work,
+        embedding_store=store,
+    )
+
+    use_case.execute()
+
+    with unit_of_work:
+        estimated = unit_of_work.samples.get_by_id(unlabeled.id)
+    confidences = {estimate.text_class_id: estimate.confidence for estimate in estimated.estimates}
+    assert abs(confidences[text_class_1.id] - 1.0) < 1e-6
+    assert abs(confidences[text_class_2.id]) < 1e-6
+
+
+def test_estimate_samples_skips_unchanged_tasks() -> None:
+    """Test that estimation only does work after labels changed."""
+    unit_of_work, annotation_task, _ = _create_estimation_fixture()
+    text_class_1, _ = annotation_task.text_classes
+    use_case = _create_estimate_samples_use_case(unit_of_work)
+    assert use_case.execute() is True
+    assert use_case.execute() is False
+
+    new_sample = model.Sample.create(annotation_task.id, "text 4")
+    new_sample.embed(torch.tensor([1.0, 0.5]))
+    with unit_of_work:
+        unit_of_work.samples.create(new_sample)
+    usecase.AnnotateSampleUseCase(
+        unit_of_work, notification.InProcessNotificationService()
+    ).execute(new_sample.id, text_class_1.id)
+
+    assert use_case.execute() is True
+    assert use_case.execute() is False
+
+
+def test_annotation_updates_class_centroids() -> None:
+    """Test that labeling, relabeling and unlabeling move the class centroids."""
+    unit_of_work, annotation_task, unlabeled = _create_estimation_fixture()
+    text_class_1, text_class_2 = annotation_task.text_classes
+    use_case = usecase.AnnotateSampleUseCase(
+        unit_of_work, notification.InProcessNotificationService()
+    )
+
+    use_case.execute(unlabeled.id, text_class_1.id)
+    assert _get_centroid_means(unit_of_work, annotation_task.id) == {
+        text_class_1.id: [1.0, 0.5],
+        text_class_2.id: [0.0, 1.0],
+    }
+    use_case.execute(unlabeled.id, text_class_2.id)
+    assert _get_centroid_means(unit_of_work, annotation_task.id) == {
+        text_class_1.id: [1.0, 0.0],
+        text_class_2.id: [0.5, 1.0],
+    }
+    usecase.AnnotateSamplesUseCase(
+        unit_of_work, notification.InProcessNotificationService()
+    ).execute(annotation_task.id, {unlabeled.id: None})
+    assert _get_centroid_means(unit_of_work, annotation_task.id) == {
+        text_class_1.id: [1.0, 0.0],
+        text_class_2.id: [0.0, 1.0],
+    }
+
+
+def test_embedding_updates_class_centroids() -> None:
+    """Test that embedding labeled samples adds them to the centroids of their classes."""
+    annotation_task = model.AnnotationTask.create()
+    text_class = annotation_task.create_text_class("class")
+    samples = tuple(model.Sample.create(annotation_task.id, text) for text in ("xx", "xxxx", "x"))
+    samples[0].annotate(text_class)
+    samples[1].annotate(text_class)
+    unit_of_work = nlpanno.adapters.persistence.inmemory.InMemoryUnitOfWork()
+    with unit_of_work:
+        unit_of_work.annotation_tasks.create(annotation_task)
+        unit_of_work.samples.create_many(samples)
+
+    usecase.EmbedAllSamplesUseCase(
+        _FakeEmbeddingService(), unit_of_work, notification.InProcessNotificationService()
+    ).execute()
+
+    assert _get_centroid_means(unit_of_work, annotation_task.id) == {text_class.id: [3.0] * 4}
+
+
+def test_estimate_only_changed_classes() -> None:
+    """Test that a changed label only recalculates the similarities to the moved centroid."""
+    unit_of_work, annotation_task, unlabeled = _create_estimation_fixture()
+    text_class_1, _ = annotation_task.text_classes
+    similarity_service = _RecordingSimilarityService()
+    use_case = usecase.EstimateSamplesUseCase(
+        similarity_service, sampling.create_sampling_service, unit_of_work
+    )
+    use_case.execute()
+    new_sample = model.Sample.create(annotation_task.id, "text 4")
+    new_sample.embed(torch.tensor([1.0, 0.5]))
+    with unit_of_work:
+        unit_of_work.samples.create(new_sample)
+    use_case.execute()
+    similarity_service.shapes.clear()
+
+    usecase.AnnotateSampleUseCase(
+        unit_of_work, notification.InProcessNotificationService()
+    ).execute(new_sample.id, text_class_1.id)
+    use_case.execute()
+
+    assert similarity_service.shapes == [(1, 1)]
+    with unit_of_work:
+        estimated = unit_of_work.samples.get_by_id(unlabeled.id)
+    confidences = {estimate.text_class_id: estimate.confidence for estimate in estimated.estimates}
+    expected = torch.nn.functional.cosine_similarity(
+        torch.tensor([1.0, 1.0]), torch.tensor([1.0, 0.25]), dim=0
+    ).item()
+    assert confidences[text_class_1.id] == pytest.approx(expected)
+
+
+def test_next_sample_by_priority() -> None:
+    """Test that uncertainty sampling picks the sample closest to the decision boundary."""
+    unit_of_work, annotation_task, unlabeled = _create_estimation_fixture()
+    certain = model.Sample.create(annotation_task.id, "text 4")
+    certain.embed(torch.tensor([1.0, 0.1]))
+    with unit_of_work:
+        unit_of_work.samples.create(certain)
+    strategy = model.SamplingStrategy.MARGIN
+    _create_estimate_samples_use_case(unit_of_work, strategy).execute()
+    use_case = usecase.GetNextSampleUseCase(
+        sampling.create_sampling_service, strategy, unit_of_work
+    )
+
+    next_sample = use_case.execute(annotation_task.id)
+
+    assert next_sample is not None
+    assert next_sample.id == unlabeled.id
+    with unit_of_work:
+        certain_priority = unit_of_work.samples.get_by_id(certain.id).priority
+    assert next_sample.priority is not None
+    assert certain_priority is not None
+    assert next_sample.priority > certain_priority
+
+
+def test_fetch_annotation_task_from_cache(tmp_path: pathlib.Path) -> None:
+    """Test that cached tasks are used until the task is updated (e.g. by another process)."""
+    engine = sqlalchemy.create_engine(f"sqlite:///{tmp_path / 'samples.db'}")
+    unit_of_work = nlpanno.adapters.persistence.sqlalchemy.SQLAlchemyUnitOfWork(engine)
+    annotation_task = model.AnnotationTask.create()
+    annotation_task.create_text_class("class 1")
+    with unit_of_work:
+        unit_of_work.create_tables()
+        unit_of_work.annotation_tasks.create(annotation_task)
+        unit_of_work.commit()
+    cache = task_cache.LRUAnnotationTaskCache()
+    use_case = usecase.AsyncFetchAnnotationTaskUseCase(
+        nlpanno.adapters.persistence.sqlalchemy.SQLAlchemyThreadedAsyncUnitOfWork(engine), cache
+    )
+
+    first_task = asyncio.run(use_case.execute(annotation_task.id))
+    second_task = asyncio.run(use_case.execute(annotation_task.id))
+    with unit_of_work:
+        annotation_task = unit_of_work.annotation_tasks.get_by_id(annotation_task.id)
+        annotation_task.create_text_class("class 2")
+        unit_of_work.annotation_tasks.update(annotation_task)
+        unit_of_work.commit()
+    updated_task = asyncio.run(use_case.execute(annotation_task.id))
+
+    assert second_task is first_task
+    assert len(first_task.text_classes) == 1
+    assert len(updated_task.text_classes) == 2
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_embed_with_concurrent_workers(tmp_path: pathlib.Path) -> None:
+    """Test that concurrent embedding workers embed disjoint samples."""
+    engine = sqlalchemy.create_engine(f"sqlite:///{tmp_path / 'samples.db'}")
+    unit_of_work = nlpanno.adapters.persistence.sqlalchemy.SQLAlchemyUnitOfWork(engine)
+    with unit_of_work:
+        unit_of_work.create_tables()
+        unit_of_work.samples.create_many(
+            tuple(model.Sample.create("task", f"text {i}") for i in range(100))
+        )
+        unit_of_work.commit()
+    embedding_services = tuple(_FakeEmbeddingService() for _ in range(4))
+    use_cases = tuple(
+        usecase.EmbedAllSamplesUseCase(
+            embedding_service,
+            nlpanno.adapters.persistence.sqlalchemy.SQLAlchemyUnitOfWork(engine),
+            notification.InProcessNotificationService(),
+            chunk_size=5,
+        )
+        for embedding_service in embedding_services
+    )
+
+    workers = tuple(threading.Thread(target=use_case.execute) for use_case in use_cases)
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    embedded = sum(sum(embedding_service.batch_sizes) for embedding_service in embedding_services)
+    assert embedded == 100
+    with unit_of_work:
+        assert unit_of_work.samples.count(repository.SampleQuery(has_embedding=False)) == 0
+
+
+def test_next_sample_with_concurrent_clients(tmp_path: pathlib.Path) -> None:
+    """Test that concurrent clients never get the same sample."""
+    engine = sqlalchemy.create_engine(f"sqlite:///{tmp_path / 'samples.db'}")
+    unit_of_work = nlpanno.adapters.persistence.sqlalchemy.SQLAlchemyUnitOfWork(engine)
+    annotation_task = model.AnnotationTask.create()
+    with unit_of_work:
+        unit_of_work.create_tables()
+        unit_of_work.annotation_tasks.create(annotation_task)
+        for i in range(50):
+            unit_of_work.samples.create(model.Sample.create(annotation_task.id, f"text {i}"))
+        unit_of_work.commit()
+    claimed_ids: list[model.Id] = []
+    errors: list[Exception] = []
+
+    def claim_until_exhausted() -> None:
+        use_case = usecase.GetNextSampleUseCase(
+            sampling.create_sampling_service,
+            model.SamplingStrategy.RANDOM,
+            nlpanno.adapters.persistence.sqlalchemy.SQLAlchemyUnitOfWork(engine),
+        )
+        try:
+            while (sample := use_case.execute(annotation_task.id)) is not None:
+                claimed_ids.append(sample.id)
+        except Exception as error:
+            errors.append(error)
+
+    clients = tuple(threading.Thread(target=claim_until_exhausted) for _ in range(8))
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+
+    assert errors == []
+    assert len(claimed_ids) == 50
+    assert len(set(claimed_ids)) == 50
+
+
+def test_import_samples() -> None:
+    """Test importing samples in batches and creating the text classes of the labels."""
+    unit_of_work = nlpanno.adapters.persistence.inmemory.InMemoryUnitOfWork()
+    annotation_task = usecase.CreateAnnotationTaskUseCase(unit_of_work).execute("task")
+    use_case = usecase.ImportSamplesUseCase(
+        unit_of_work, notification.InProcessNotificationService(), batch_size=2
+    )
+    records = (("text 1", "b"), ("text 2", None), ("text 3", "a"), ("text 4", "b"))
+
+    batch_sizes = tuple(use_case.execute(annotation_task.id, records))
+
+    assert batch_sizes == (2, 2)
+    with unit_of_work:
+        annotation_task = unit_of_work.annotation_tasks.get_by_id(annotation_task.id)
+        samples = unit_of_work.samples.find()
+    assert tuple(text_class.name for text_class in annotation_task.text_classes) == ("b", "a")
+    labels = {
+        sample.text: None if sample.text_class is None else sample.text_class.name
+        for sample in samples
+    }
+    assert labels == {"text 1": "b", "text 2": None, "text 3": "a", "text 4": "b"}
+
+
+class _RecordingSimilarityService(embedding_transformers.TransformersVectorSimilarityService):
+    """Similarity service recording the shapes of the similarity matrices."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.shapes: list[tuple[int, int]] = []
+
+    def calculate_similarity_matrix(
+        self,
+        sample_embeddings: Sequence[model.Embedding] | model.Matrix,
+        class_embeddings: Sequence[model.Embedding],
+    ) -> model.Matrix:
+        self.shapes.append((len(sample_embeddings), len(class_embeddings)))
+        return super().calculate_similarity_matrix(sample_embeddings, class_embeddings)
+
+
+def _get_centroid_means(
+    unit_of_work: unitofwork.UnitOfWork, task_id: model.Id
+) -> dict[model.Id, list[float]]:
+    with unit_of_work:
+        return {
+            centroid.text_class_id: centroid.mean().tolist()
+            for centroid in unit_of_work.class_centroids.find(task_id)
+        }
+
+
+def _create_estimate_samples_use_case(
+    unit_of_work: unitofwork.UnitOfWork,
+    sampling_strategy: model.SamplingStrategy = model.SamplingStrategy.RANDOM,
+) -> usecase.EstimateSamplesUseCase:
+    return usecase.EstimateSamplesUseCase(
+        embedding_transformers.TransformersVectorSimilarityService(),
+        sampling.create_sampling_service,
+        unit_of_work,
+        sampling_strategy,
+    )
+
+
+def _create_estimation_fixture(
+    unit_of_work: unitofwork.UnitOfWork | None = None, max_estimates: int | None = None
+) -> tuple[unitofwork.UnitOfWork, model.AnnotationTask, model.Sample]:
+    """Create a task with one labeled sample per class and one unlabeled sample."""
+    annotation_task = model.AnnotationTask.create(max_estimates=max_estimates)
+    text_class_1 = annotation_task.create_text_class("class 1")
+    text_class_2 = annotation_task.create_text_class("class 2")
+    labeled_1 = model.Sample.create(annotation_task.id, "text 1")
+    labeled_1.embed(torch.tensor([1.0, 0.0]))
+    labeled_2 = model.Sample.create(annotation_task.id, "text 2")
+    labeled_2.embed(torch.tensor([0.0, 1.0]))
+    unlabeled = model.Sample.create(annotation_task.id, "text 3")
+    unlabeled.embed(torch.tensor([1.0, 1.0]))
+    if unit_of_work is None:
+        unit_of_work = nlpanno.adapters.persistence.inmemory.InMemoryUnitOfWork()
+    with unit_of_work:
+        unit_of_work.create_tables()
+        unit_of_work.annotation_tasks.create(annotation_task)
+        unit_of_work.commit()
+        unit_of_work.samples.create_many((labeled_1, labeled_2, unlabeled))
+        unit_of_work.commit()
+    # Annotated by the use case, which maintains the class centroids.
+    annotate_sample_use_case = usecase.AnnotateSampleUseCase(
+        unit_of_work, notification.InProcessNotificationService()
+    )
+    annotate_sample_use_case.execute(labeled_1.id, text_class_1.id)
+    annotate_sample_use_case.execute(labeled_2.id, text_class_2.id)
+    return unit_of_work, annotation_task, unlabeled
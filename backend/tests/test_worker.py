@@ -0,0 +1,46 @@
+"""Test suite for the main loop of the workers."""
+
+import pytest
+
+from nlpanno.adapters import notification, worker
+from nlpanno.application import service
+
+_CHANNEL = service.NotificationChannel.EMBEDDING_REQUESTED
+
+
+class _StopLoop(BaseException):
+    """Raised to leave the (endless) loop."""
+
+
+class _FailingNotificationService(notification.InProcessNotificationService):
+    """Notification service whose first wait fails (e.g. because the connection dropped)."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.timeouts: list[float] = []
+
+    def wait(self, channel: service.NotificationChannel, timeout: float) -> bool:
+        self.timeouts.append(timeout)
+        if len(self.timeouts) == 1:
+            raise ConnectionError("connection dropped")
+        return False
+
+
+def test_run_loop_retries_failed_wait(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test that a failing wait backs off like failing work instead of ending the loop."""
+    sleeps: list[float] = []
+    monkeypatch.setattr(worker.time, "sleep", sleeps.append)
+    notification_service = _FailingNotificationService()
+    executions: list[None] = []
+
+    def execute() -> bool:
+        executions.append(None)
+        if len(executions) == 3:
+            raise _StopLoop()
+        return False
+
+    with pytest.raises(_StopLoop):
+        worker.run_loop(execute, notification_service, _CHANNEL)
+
+    assert notification_service.timeouts == [1.0, 2.0]
+    assert sleeps == [1.0]